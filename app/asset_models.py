@@ -2,7 +2,7 @@
 WeCard 素材库数据模型
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy import Column, Integer, BigInteger, String, Text, Enum, JSON, Boolean, TIMESTAMP, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from .main import db
@@ -91,17 +91,16 @@ class TenantAsset(db.Model):
             'file_size_formatted': self.get_formatted_file_size()
         }
     
-    def to_admin_dict(self):
-        """转换为管理后台字典（包含统计信息）"""
+    def to_admin_dict(self, recent_views=None):
+        """
+        转换为管理后台字典（包含统计信息）
+        recent_views: 列表页批量查询好的近30天浏览数，未提供时单独查询
+        """
         base_dict = self.to_dict()
         
         # 添加统计信息
-        recent_views = AssetAnalytics.query.filter_by(
-            asset_id=self.id,
-            action_type='view'
-        ).filter(
-            AssetAnalytics.created_at >= datetime.now() - timedelta(days=30)
-        ).count()
+        if recent_views is None:
+            recent_views = count_recent_views([self.id]).get(self.id, 0)
         
         base_dict.update({
             'recent_views': recent_views,
@@ -209,6 +208,20 @@ class AssetAnalytics(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+def count_recent_views(asset_ids, days=30):
+    """批量统计素材近 days 天的浏览数：{asset_id: count}（一次 GROUP BY 查询）"""
+    if not asset_ids:
+        return {}
+    rows = db.session.query(
+        AssetAnalytics.asset_id, db.func.count(AssetAnalytics.id)
+    ).filter(
+        AssetAnalytics.asset_id.in_(list(asset_ids)),
+        AssetAnalytics.action_type == 'view',
+        AssetAnalytics.created_at >= datetime.now() - timedelta(days=days)
+    ).group_by(AssetAnalytics.asset_id).all()
+    return {asset_id: count for asset_id, count in rows}
+
+
 class AssetCategory(db.Model):
     """素材分类模型"""
     __tablename__ = 'asset_categories'
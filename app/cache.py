@@ -0,0 +1,539 @@
+"""
+Redis 缓存与统计工具
+供 wecom 路由、后台任务等共享同一个连接池（解决Gunicorn多Worker问题）
+
+两级缓存：
+- L1：进程内 LRU + TTL，热点键（suite_access_token 等）命中时不访问Redis
+- L2：Redis，跨Worker共享
+- set_cache/delete_cache 通过 Redis pub/sub 通知其它Worker清除各自的L1
+- 值可以是字符串，也可以是可JSON序列化的Python对象（读取时还原为对象）
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+
+CACHE_PREFIX = 'wecom'
+
+# L1 进程内缓存：最大条目数 / 最长存活秒数（兜底：pub/sub 消息丢失时最多旧这么久）
+CACHE_L1_ENABLED = os.getenv('CACHE_L1_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_L1_MAXSIZE = int(os.getenv('CACHE_L1_MAXSIZE', 2048))
+CACHE_L1_TTL = float(os.getenv('CACHE_L1_TTL', 30))
+# 统计计数先在进程内累加，间隔 STATS_FLUSH_INTERVAL 秒批量写入Redis
+STATS_FLUSH_INTERVAL = float(os.getenv('CACHE_STATS_FLUSH_INTERVAL', 5))
+
+INVALIDATE_CHANNEL = f'{CACHE_PREFIX}:cache:invalidate'
+# 非字符串值序列化为JSON时的标记前缀（字符串值原样存储，兼容已有缓存）
+_JSON_MARK = '__json__:'
+
+# 创建Redis连接池
+redis_pool = redis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,
+    decode_responses=True,
+    max_connections=10
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+def _encode(value):
+    if isinstance(value, str):
+        return value
+    return _JSON_MARK + json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _decode(raw):
+    if isinstance(raw, str) and raw.startswith(_JSON_MARK):
+        try:
+            return json.loads(raw[len(_JSON_MARK):])
+        except ValueError:
+            return None
+    return raw
+
+
+class LocalCache:
+    """
+    进程内 LRU + TTL 缓存（L1）
+    返回的对象在多个请求间共享，调用方不要修改
+    """
+
+    def __init__(self, maxsize=CACHE_L1_MAXSIZE, ttl=CACHE_L1_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (found, value)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        """ttl 为 Redis 中的剩余秒数，L1 不会比 L2 存活更久"""
+        ttl = self.ttl if ttl is None or ttl < 0 else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_cache = LocalCache()
+
+
+class InvalidationListener:
+    """
+    订阅 L1 失效通知（每个进程一个守护线程）
+    消息格式 "<进程实例id>|<key>"，忽略本进程自己发出的消息
+    断线期间可能漏掉通知，重连后清空整个L1
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.instance_id = uuid.uuid4().hex
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # fork 后的子进程：换新的实例id并清掉继承来的L1
+            self.instance_id = uuid.uuid4().hex
+            self.cache.clear()
+            thread = threading.Thread(target=self._run, name='cache-invalidation', daemon=True)
+            thread.start()
+            self._pid = pid
+
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                self.cache.clear()
+                backoff = 1
+                for message in pubsub.listen():
+                    data = message.get('data')
+                    if not isinstance(data, str) or '|' not in data:
+                        continue
+                    sender, key = data.split('|', 1)
+                    if sender != self.instance_id:
+                        self.cache.delete(key)
+            except Exception as e:
+                logger.warning(f'cache invalidation listener disconnected: {e}')
+                self.cache.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def publish(self, *keys):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.publish(INVALIDATE_CHANNEL, f'{self.instance_id}|{key}')
+            pipe.execute()
+        except Exception as e:
+            logger.error(f'Redis publish invalidation error: {e}')
+
+
+invalidation_listener = InvalidationListener(local_cache)
+
+
+def set_cache(key, value, ttl=600, local=True):
+    """
+    写入缓存（L2 Redis + 本进程L1），并通知其它Worker清除L1中的旧值
+    local=False 时不写入L1（一次性或强一致的键）
+    """
+    try:
+        redis_client.setex(f'{CACHE_PREFIX}:{key}', ttl, _encode(value))
+    except Exception as e:
+        logger.error(f'Redis set_cache error: {e}')
+        local_cache.delete(key)
+        return False
+    if CACHE_L1_ENABLED:
+        invalidation_listener.publish(key)
+        if local:
+            invalidation_listener.ensure_started()
+            local_cache.set(key, value, ttl)
+    return True
+
+
+def get_cache(key, local=True):
+    """
+    读取缓存：先查L1，未命中再查Redis并回填L1
+    local=False 时跳过L1直接读Redis（如拿到锁后的二次确认）
+    """
+    if CACHE_L1_ENABLED and local:
+        found, value = local_cache.get(key)
+        if found:
+            incr_stat('cache', 'l1_hit')
+            return value
+    try:
+        if CACHE_L1_ENABLED and local:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.get(f'{CACHE_PREFIX}:{key}')
+            pipe.ttl(f'{CACHE_PREFIX}:{key}')
+            raw, ttl = pipe.execute()
+        else:
+            raw, ttl = redis_client.get(f'{CACHE_PREFIX}:{key}'), None
+    except Exception as e:
+        logger.error(f'Redis get_cache error: {e}')
+        return None
+    if raw is None:
+        incr_stat('cache', 'miss')
+        return None
+    incr_stat('cache', 'l2_hit')
+    value = _decode(raw)
+    if CACHE_L1_ENABLED and local:
+        invalidation_listener.ensure_started()
+        local_cache.set(key, value, ttl)
+    return value
+
+
+def delete_cache(*keys):
+    """删除缓存键（L1 + L2），并通知其它Worker"""
+    return delete_many(keys)
+
+
+def make_key(namespace, *parts):
+    """
+    命名空间缓存键：make_key('card', 'member', 1, 2) -> 'card:member:1:2'
+    （CACHE_PREFIX 由 set_cache/get_cache 统一添加）
+    """
+    return ':'.join(str(part) for part in (namespace, *parts))
+
+
+def get_many(keys, local=True):
+    """
+    批量读取缓存：L1 未命中的键用一次 MGET（同一pipeline带上TTL）从Redis读取
+    返回 {key: value}，只包含命中的键
+    """
+    keys = list(dict.fromkeys(keys))
+    result = {}
+    missing = []
+    for key in keys:
+        if CACHE_L1_ENABLED and local:
+            found, value = local_cache.get(key)
+            if found:
+                result[key] = value
+                continue
+        missing.append(key)
+    if result:
+        incr_stat('cache', 'l1_hit', len(result))
+    if not missing:
+        return result
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.mget([f'{CACHE_PREFIX}:{key}' for key in missing])
+        for key in missing:
+            pipe.ttl(f'{CACHE_PREFIX}:{key}')
+        raws, *ttls = pipe.execute()
+    except Exception as e:
+        logger.error(f'Redis get_many error: {e}')
+        return result
+
+    hits = 0
+    for key, raw, ttl in zip(missing, raws, ttls):
+        if raw is None:
+            continue
+        hits += 1
+        value = _decode(raw)
+        result[key] = value
+        if CACHE_L1_ENABLED and local:
+            invalidation_listener.ensure_started()
+            local_cache.set(key, value, ttl)
+    if hits:
+        incr_stat('cache', 'l2_hit', hits)
+    if len(missing) - hits:
+        incr_stat('cache', 'miss', len(missing) - hits)
+    return result
+
+
+def set_many(mapping, ttl=600, local=True):
+    """批量写入缓存：一个pipeline完成所有 SETEX 和失效通知"""
+    if not mapping:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.setex(f'{CACHE_PREFIX}:{key}', ttl, _encode(value))
+            if CACHE_L1_ENABLED:
+                pipe.publish(INVALIDATE_CHANNEL, f'{invalidation_listener.instance_id}|{key}')
+        pipe.execute()
+    except Exception as e:
+        logger.error(f'Redis set_many error: {e}')
+        local_cache.delete(*mapping)
+        return False
+    if CACHE_L1_ENABLED and local:
+        invalidation_listener.ensure_started()
+        for key, value in mapping.items():
+            local_cache.set(key, value, ttl)
+    return True
+
+
+def delete_many(keys):
+    """批量删除缓存键（L1 + L2），返回Redis中实际删除的数量"""
+    keys = list(keys)
+    if not keys:
+        return 0
+    local_cache.delete(*keys)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(*[f'{CACHE_PREFIX}:{key}' for key in keys])
+        if CACHE_L1_ENABLED:
+            for key in keys:
+                pipe.publish(INVALIDATE_CHANNEL, f'{invalidation_listener.instance_id}|{key}')
+        deleted = pipe.execute()[0]
+    except Exception as e:
+        logger.error(f'Redis delete_many error: {e}')
+        return 0
+    return deleted
+
+
+def incr_cache(key, amount=1):
+    """原子自增计数类缓存键（如版本号），并通知其它Worker清除L1"""
+    local_cache.delete(key)
+    try:
+        value = redis_client.incr(f'{CACHE_PREFIX}:{key}', amount)
+    except Exception as e:
+        logger.error(f'Redis incr_cache error: {e}')
+        return None
+    if CACHE_L1_ENABLED:
+        invalidation_listener.publish(key)
+    return value
+
+
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.monotonic()
+
+
+def flush_stats():
+    """把进程内累加的统计计数批量写入Redis"""
+    global _stats_flushed_at
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _stats_flushed_at = time.monotonic()
+    if not pending:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for (group, field), amount in pending.items():
+            pipe.hincrby(f'{CACHE_PREFIX}:stats:{group}', field, amount)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f'Redis flush_stats error: {e}')
+
+
+def incr_stat(group, field, amount=1):
+    """累加统计计数器（进程内累加，定期写入Redis Hash，所有Worker共享）"""
+    with _stats_lock:
+        _pending_stats[(group, field)] += amount
+        due = time.monotonic() - _stats_flushed_at >= STATS_FLUSH_INTERVAL
+    if due:
+        flush_stats()
+
+
+def get_stats(group=None):
+    """
+    读取统计计数器
+    group为空时返回所有分组：{group: {field: count}}
+    cache 分组额外给出 L1/L2 命中率
+    """
+    flush_stats()
+    try:
+        if group:
+            raw = redis_client.hgetall(f'{CACHE_PREFIX}:stats:{group}')
+            return _with_ratios(group, {k: int(v) for k, v in raw.items()})
+        result = {}
+        prefix = f'{CACHE_PREFIX}:stats:'
+        for key in redis_client.scan_iter(match=f'{prefix}*'):
+            raw = redis_client.hgetall(key)
+            name = key[len(prefix):]
+            result[name] = _with_ratios(name, {k: int(v) for k, v in raw.items()})
+        return result
+    except Exception as e:
+        logger.error(f'Redis get_stats error: {e}')
+        return {}
+
+
+def _with_ratios(group, stats):
+    if group != 'cache':
+        return stats
+    total = stats.get('l1_hit', 0) + stats.get('l2_hit', 0) + stats.get('miss', 0)
+    if total:
+        stats['l1_hit_ratio'] = round(stats.get('l1_hit', 0) / total, 4)
+        stats['l2_hit_ratio'] = round(stats.get('l2_hit', 0) / total, 4)
+    stats['l1_size'] = len(local_cache)
+    return stats
+
+
+def get_or_refresh(key, loader, margin=300, lock_timeout=15, wait_timeout=5, stat=None, force=False):
+    """
+    带单飞(single-flight)刷新的凭证缓存
+
+    - key 对应的新鲜值在 expires_in - margin 秒后过期，提前触发刷新
+    - 同时保留一份 key:stale（expires_in 秒后过期），刷新失败或等锁超时时复用旧值
+    - 通过Redis锁保证同一时刻只有一个Worker调用 loader，其它Worker等待后直接读缓存
+
+    loader() 返回 (value, expires_in) 或 None
+    """
+    if not force:
+        cached = get_cache(key)
+        if cached:
+            if stat:
+                incr_stat(stat, 'hit')
+            return cached
+    if stat:
+        incr_stat(stat, 'miss')
+
+    lock = redis_client.lock(f'{CACHE_PREFIX}:lock:{key}', timeout=lock_timeout, blocking_timeout=wait_timeout)
+    try:
+        acquired = lock.acquire()
+    except Exception as e:
+        # Redis不可用：直接回源，不做跨Worker协调
+        logger.error(f'Redis lock error for {key}: {e}')
+        result = loader()
+        return result[0] if result else None
+
+    if not acquired:
+        # 其它Worker刷新超时，尽量复用旧值
+        if stat:
+            incr_stat(stat, 'lock_timeout')
+        return get_cache(key, local=False) or get_cache(f'{key}:stale', local=False)
+
+    try:
+        if not force:
+            # 等锁期间可能已被其它Worker刷新（绕过L1，以Redis为准）
+            cached = get_cache(key, local=False)
+            if cached:
+                if stat:
+                    incr_stat(stat, 'coalesced')
+                return cached
+
+        result = loader()
+        if not result:
+            if stat:
+                incr_stat(stat, 'refresh_error')
+            return get_cache(f'{key}:stale', local=False)
+
+        value, expires_in = result
+        expires_in = int(expires_in or 7200)
+        set_cache(key, value, ttl=max(expires_in - margin, 60))
+        set_cache(f'{key}:stale', value, ttl=max(expires_in - 60, 60), local=False)
+        set_cache(f'{key}:issued', f'{int(time.time())}:{expires_in}', ttl=expires_in, local=False)
+        if stat:
+            incr_stat(stat, 'refresh')
+        return value
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def single_flight(key, loader, ttl=10, lock_timeout=30, wait_timeout=10, stat=None):
+    """
+    跨Worker合并同一个键的并发调用（单飞）
+
+    - 同一时刻只有一个调用方（持有 lock:key）执行 loader，结果写入 key 并保留 ttl 秒
+    - 其它调用方等锁结束后直接读取结果；ttl 内的后续调用也复用该结果
+    - loader() 返回None表示失败，不写入结果，等待中的调用方拿到锁后自己重试
+    - 等锁超时返回None（不重复回源）；Redis不可用时直接调用 loader
+
+    结果必须可JSON序列化（如成员ID），由调用方自行重新加载
+    """
+    cached = get_cache(key, local=False)
+    if cached is not None:
+        if stat:
+            incr_stat(stat, 'hit')
+        return cached
+
+    lock = redis_client.lock(f'{CACHE_PREFIX}:lock:{key}', timeout=lock_timeout, blocking_timeout=wait_timeout)
+    try:
+        acquired = lock.acquire()
+    except Exception as e:
+        logger.error(f'Redis lock error for {key}: {e}')
+        return loader()
+
+    if not acquired:
+        if stat:
+            incr_stat(stat, 'lock_timeout')
+        return get_cache(key, local=False)
+
+    try:
+        # 等锁期间其它调用方可能已完成
+        cached = get_cache(key, local=False)
+        if cached is not None:
+            if stat:
+                incr_stat(stat, 'coalesced')
+            return cached
+        value = loader()
+        if value is not None:
+            set_cache(key, value, ttl=ttl, local=False)
+        if stat:
+            incr_stat(stat, 'miss' if value is not None else 'error')
+        return value
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def token_age_ratio(key):
+    """
+    get_or_refresh 写入的凭证已使用的有效期比例（0~1）
+    没有缓存记录时返回None
+    """
+    issued = get_cache(f'{key}:issued', local=False)
+    if not issued:
+        return None
+    try:
+        issued_at, expires_in = (int(part) for part in issued.split(':', 1))
+    except ValueError:
+        return None
+    if expires_in <= 0:
+        return 1.0
+    return min(max((time.time() - issued_at) / expires_in, 0.0), 1.0)
@@ -0,0 +1,28 @@
+"""
+名片读取缓存的键与失效
+- card:member:{tenant_id}:{member_id}：成员快照（名称、职位、部门、头像、手机、邮箱）
+- tenant:profile:{tenant_id}：租户信息（名称）
+写入成员或租户资料的路径（回调、全量同步、OAuth、资料刷新、授权）在提交后清除对应的键
+"""
+from .cache import delete_many, make_key
+
+
+def member_card_key(tenant_id, member_id):
+    return make_key('card', 'member', tenant_id, member_id)
+
+
+def tenant_card_key(tenant_id):
+    return make_key('tenant', 'profile', tenant_id)
+
+
+def card_cache_keys(tenant_id, member_id):
+    return member_card_key(tenant_id, member_id), tenant_card_key(tenant_id)
+
+
+def invalidate_member_cards(tenant_id, member_ids):
+    """清除成员快照（一个pipeline批量删除），忽略还没有ID的成员"""
+    return delete_many([member_card_key(tenant_id, member_id) for member_id in member_ids if member_id])
+
+
+def invalidate_tenant_card(tenant_id):
+    return delete_many([tenant_card_key(tenant_id)])
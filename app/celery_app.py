@@ -0,0 +1,70 @@
+"""
+Celery 应用（后台任务 / 定时任务）
+
+启动：
+    celery -A app.celery_app.celery worker -l info
+    celery -A app.celery_app.celery worker -l info -Q wecom_events   # 企微回调事件专用Worker
+    celery -A app.celery_app.celery worker -l info -Q wecom_push     # 欢迎语推送专用Worker
+    celery -A app.celery_app.celery worker -l info -Q wecom_sync     # 通讯录同步（长任务）
+    celery -A app.celery_app.celery beat -l info
+"""
+import os
+
+from celery import Celery
+from celery.signals import worker_init
+
+from .main import create_app
+from .rate_limit import mark_worker_process
+
+
+def make_celery(flask_app):
+    """创建Celery实例，任务在Flask应用上下文中执行"""
+    celery = Celery(
+        flask_app.import_name,
+        broker=flask_app.config['CELERY_BROKER_URL'],
+        backend=flask_app.config['CELERY_RESULT_BACKEND'],
+        include=['app.tasks']
+    )
+    celery.conf.update(
+        task_serializer='json',
+        accept_content=['json'],
+        result_serializer='json',
+        timezone='Asia/Shanghai',
+        task_ignore_result=True,
+        # 回调事件走专用队列，不和定时任务/同步任务抢Worker
+        task_routes={
+            'wecom.process_event': {'queue': flask_app.config['WECOM_EVENT_QUEUE']},
+            'wecom.drain_welcome_pushes': {'queue': flask_app.config['WECOM_PUSH_QUEUE']},
+            'wecom.sync_members': {'queue': flask_app.config['WECOM_SYNC_QUEUE']},
+        },
+    )
+
+    # 定时任务
+    celery.conf.beat_schedule = {
+        'refresh-wecom-tokens': {
+            'task': 'wecom.refresh_tokens',
+            'schedule': flask_app.config['WECOM_TOKEN_REFRESH_INTERVAL'],
+        },
+        'schedule-member-syncs': {
+            'task': 'wecom.schedule_member_syncs',
+            'schedule': flask_app.config['WECOM_SYNC_SCHEDULE_INTERVAL'],
+        },
+    }
+
+    class ContextTask(celery.Task):
+        def __call__(self, *args, **kwargs):
+            with flask_app.app_context():
+                return self.run(*args, **kwargs)
+
+    celery.Task = ContextTask
+    return celery
+
+
+@worker_init.connect
+def on_worker_init(**kwargs):
+    """Worker 进程中的 qyapi 调用可以较长时间等待限流令牌（prefork 子进程继承此标记）"""
+    mark_worker_process()
+
+
+flask_app = create_app(os.getenv('FLASK_ENV', 'production'))
+celery = make_celery(flask_app)
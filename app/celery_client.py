@@ -0,0 +1,29 @@
+"""
+Web进程投递后台任务用的 Celery 客户端
+只按应用配置连接 broker，导入时不创建 Flask 应用（celery_app 导入时会 create_app，只供 Worker / beat 使用）
+任务按名称投递，由调用方指定队列
+"""
+from celery import Celery
+from flask import current_app
+
+
+def get_celery_client():
+    """当前应用的 Celery 客户端（每个应用创建一次，保存在 app.extensions）"""
+    client = current_app.extensions.get('celery_client')
+    if client is None:
+        config = current_app.config
+        client = Celery(current_app.import_name, broker=config['CELERY_BROKER_URL'],
+                        backend=config['CELERY_RESULT_BACKEND'])
+        client.conf.update(
+            task_serializer='json',
+            accept_content=['json'],
+            result_serializer='json',
+            task_ignore_result=True,
+        )
+        current_app.extensions['celery_client'] = client
+    return client
+
+
+def send_task(name, **options):
+    """按任务名投递：send_task('wecom.sync_members', args=[job_id], queue='wecom_sync')"""
+    return get_celery_client().send_task(name, **options)
@@ -16,6 +16,34 @@ class Config:
     # Redis配置
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Celery配置（后台任务 / 定时任务）
+    CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', REDIS_URL)
+    CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', REDIS_URL)
+    
+    # 企微凭证后台刷新：每隔N秒扫描一次，已使用有效期超过比例的凭证提前续期
+    WECOM_TOKEN_REFRESH_INTERVAL = int(os.getenv('WECOM_TOKEN_REFRESH_INTERVAL', '300'))
+    WECOM_TOKEN_REFRESH_RATIO = float(os.getenv('WECOM_TOKEN_REFRESH_RATIO', '0.8'))
+    WECOM_TOKEN_REFRESH_JITTER = int(os.getenv('WECOM_TOKEN_REFRESH_JITTER', '120'))  # 秒，打散各租户刷新时间
+    
+    # 企微回调事件：验签解密后投递到专用队列，由独立Worker处理，回调接口立即返回success
+    WECOM_EVENT_ASYNC = os.getenv('WECOM_EVENT_ASYNC', 'true').lower() == 'true'
+    WECOM_EVENT_QUEUE = os.getenv('WECOM_EVENT_QUEUE', 'wecom_events')
+    # 事件处理失败时Worker重试的次数和间隔（秒，按次数递增）
+    WECOM_EVENT_MAX_RETRIES = int(os.getenv('WECOM_EVENT_MAX_RETRIES', '3'))
+    WECOM_EVENT_RETRY_DELAY = int(os.getenv('WECOM_EVENT_RETRY_DELAY', '10'))
+    # 欢迎语推送专用队列（WelcomeCode有效期短，不和其它事件排队）
+    WECOM_PUSH_QUEUE = os.getenv('WECOM_PUSH_QUEUE', 'wecom_push')
+    WECOM_SYNC_QUEUE = os.getenv('WECOM_SYNC_QUEUE', 'wecom_sync')
+    
+    # 通讯录定时校正同步（见 sync_scheduler）：每隔N秒扫描一次到期租户
+    WECOM_SYNC_SCHEDULE_ENABLED = os.getenv('WECOM_SYNC_SCHEDULE_ENABLED', 'true').lower() == 'true'
+    WECOM_SYNC_SCHEDULE_INTERVAL = int(os.getenv('WECOM_SYNC_SCHEDULE_INTERVAL', '300'))
+    WECOM_SYNC_RECONCILE_INTERVAL = int(os.getenv('WECOM_SYNC_RECONCILE_INTERVAL', '86400'))  # 每个租户的校正周期
+    WECOM_SYNC_MAX_CONCURRENT = int(os.getenv('WECOM_SYNC_MAX_CONCURRENT', '4'))  # 全局同时排队/执行的同步数
+    WECOM_SYNC_PLAN_CONCURRENCY = os.getenv('WECOM_SYNC_PLAN_CONCURRENCY', 'free:1,trial:1')  # 按套餐限制，未列出的不单独限制
+    WECOM_SYNC_CONTACT_ACTIVE_WINDOW = int(os.getenv('WECOM_SYNC_CONTACT_ACTIVE_WINDOW', '3600'))  # 秒内有通讯录回调视为活跃
+    WECOM_SYNC_STAGGER = int(os.getenv('WECOM_SYNC_STAGGER', '15'))  # 同一轮启动的任务间隔秒数
+    
     # MinIO/S3配置
     MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT', 'localhost:9000')
     MINIO_ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY', 'minioadmin')
@@ -54,6 +82,7 @@ class TestingConfig(Config):
     """测试环境配置"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    WECOM_EVENT_ASYNC = False
 
 # 配置映射
 config = {
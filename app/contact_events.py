@@ -0,0 +1,169 @@
+"""
+通讯录变更回调（InfoType=change_contact）增量更新成员和部门
+- create_user / update_user：按回调中出现的字段更新成员（第三方应用收不到的字段保持原值）
+- delete_user：标记为离职、不可见（与全量同步的停用逻辑一致，不删除记录）
+- create_party / update_party / delete_party：维护 departments 表
+- 成员所属部门写入 member_departments（见 departments），部门树缓存由调用方在提交后清除
+全量同步（/sync-members）只作为定期校正，不再是刷新成员的主要手段
+"""
+import logging
+
+from .departments import event_department_links, remove_member_departments, set_member_departments
+from .models import db, Member, Department
+
+logger = logging.getLogger(__name__)
+
+# 回调字段 -> Member 字段
+USER_FIELDS = {
+    'Name': 'name',
+    'Mobile': 'mobile',
+    'Email': 'email',
+    'Avatar': 'avatar_url',
+    'Position': 'position',
+    'OpenUserID': 'open_userid',
+}
+
+# 回调字段 -> Department 字段
+PARTY_FIELDS = {
+    'Name': 'name',
+    'ParentId': 'parent_id',
+    'Order': 'order',
+}
+PARTY_INT_FIELDS = ('parent_id', 'order')
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def main_department_id(event):
+    """主部门：MainDepartment，缺失时取 Department 列表的第一个"""
+    main = parse_int(event.text('MainDepartment'))
+    if main is not None:
+        return main
+    departments = [parse_int(part) for part in (event.text('Department') or '').split(',')]
+    departments = [dept_id for dept_id in departments if dept_id is not None]
+    return departments[0] if departments else None
+
+
+def department_name(tenant_id, dept_id):
+    if dept_id is None:
+        return None
+    department = Department.query.filter_by(tenant_id=tenant_id, dept_id=dept_id).first()
+    return department.name if department else None
+
+
+def apply_user_event(tenant, event):
+    """
+    处理 create_user / update_user / delete_user，返回受影响的成员（未找到时返回None）
+    只修改session，由调用方提交
+    """
+    userid = event.text('UserID')
+    if not userid:
+        return None
+    member = Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
+
+    if event.change_type == 'delete_user':
+        if member:
+            member.is_active = False
+            member.in_visible_range = False
+            member.updated_at = db.func.now()
+            remove_member_departments(tenant.id, member_id=member.id)
+        return member
+
+    if member is None:
+        member = Member(tenant_id=tenant.id, userid=userid, role='user', is_installer=False)
+        db.session.add(member)
+
+    # 修改了userid（企业只能修改一次）
+    new_userid = event.text('NewUserID')
+    if new_userid and new_userid != userid:
+        if Member.query.filter_by(tenant_id=tenant.id, userid=new_userid).first():
+            logger.warning(f'change_contact: tenant={tenant.id} userid {userid} -> {new_userid} already exists')
+        else:
+            member.userid = new_userid
+
+    for tag, attr in USER_FIELDS.items():
+        value = event.text(tag)
+        if value:
+            setattr(member, attr, value)
+    if not member.name:
+        member.name = member.userid
+
+    dept_name = department_name(tenant.id, main_department_id(event))
+    if dept_name:
+        member.department = dept_name
+
+    # 1=已激活，2=已禁用，4=未激活，5=退出企业；回调不带Status时新成员视为在职，已有成员保持原值
+    status = event.text('Status')
+    if status:
+        member.is_active = status == '1'
+    elif member.is_active is None:
+        member.is_active = True
+    member.in_visible_range = True
+    member.updated_at = db.func.now()
+    set_member_departments(member, event_department_links(event))
+    return member
+
+
+def apply_party_event(tenant, event):
+    """
+    处理 create_party / update_party / delete_party，返回部门（删除或未找到时返回None）
+    部门改名时同步更新成员上冗余存储的部门名称；只修改session，由调用方提交
+    """
+    dept_id = parse_int(event.text('Id'))
+    if dept_id is None:
+        return None
+    department = Department.query.filter_by(tenant_id=tenant.id, dept_id=dept_id).first()
+
+    if event.change_type == 'delete_party':
+        if department:
+            db.session.delete(department)
+        remove_member_departments(tenant.id, dept_ids=[dept_id])
+        return None
+
+    if department is None:
+        department = Department(tenant_id=tenant.id, dept_id=dept_id)
+        db.session.add(department)
+
+    old_name = department.name
+    for tag, attr in PARTY_FIELDS.items():
+        value = event.text(tag)
+        if value is None or value == '':
+            continue
+        if attr in PARTY_INT_FIELDS:
+            value = parse_int(value)
+            if value is None:
+                continue
+        setattr(department, attr, value)
+    department.updated_at = db.func.now()
+
+    if old_name and department.name and old_name != department.name:
+        Member.query.filter_by(tenant_id=tenant.id, department=old_name).update(
+            {'department': department.name, 'sync_fingerprint': None}, synchronize_session=False)
+    return department
+
+
+def sync_departments(tenant_id, departments):
+    """全量同步时用 department/list 的结果校正 departments 表（新增、更新、删除已不存在的部门）"""
+    existing = {department.dept_id: department for department in Department.query.filter_by(tenant_id=tenant_id)}
+    seen = set()
+    for item in departments:
+        dept_id = parse_int(item.get('id'))
+        if dept_id is None:
+            continue
+        seen.add(dept_id)
+        department = existing.get(dept_id)
+        if department is None:
+            department = Department(tenant_id=tenant_id, dept_id=dept_id)
+            db.session.add(department)
+        department.name = item.get('name') or department.name
+        department.parent_id = parse_int(item.get('parentid'))
+        department.order = parse_int(item.get('order'))
+    removed = [dept_id for dept_id in existing if dept_id not in seen]
+    for dept_id in removed:
+        db.session.delete(existing[dept_id])
+    remove_member_departments(tenant_id, dept_ids=removed)
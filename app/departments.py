@@ -0,0 +1,185 @@
+"""
+部门树与成员所属部门
+- departments 表由 department/list（全量同步）和 change_contact 部门回调维护（见 contact_events）
+- member_departments 记录成员所属的全部部门（主部门、负责人标记），按 (tenant_id, dept_id) 建索引，
+  "部门下的成员" 直接查关联表，不再按 Member.department 名称字符串匹配
+- 租户的部门树（含各部门成员数）缓存在 Redis，部门或成员所属部门变化时清除
+"""
+import logging
+import os
+
+from sqlalchemy import delete, func, insert, select
+
+from .cache import delete_cache, get_cache, make_key, set_cache
+from .models import db, Department, Member, MemberDepartment
+
+logger = logging.getLogger(__name__)
+
+ORG_TREE_CACHE_TTL = int(os.getenv('WECOM_ORG_TREE_CACHE_TTL', 3600))
+LINK_CHUNK = 500
+
+
+def parse_id_list(text):
+    """回调中的部门列表：'1,2,3' -> [1, 2, 3]"""
+    ids = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if part.lstrip('-').isdigit():
+            ids.append(int(part))
+    return ids
+
+
+def build_links(dept_ids, main_dept_id=None, leader_flags=None):
+    """
+    [(dept_id, is_main, is_leader)]；未指定主部门时取第一个部门
+    leader_flags 与 dept_ids 一一对应（is_leader_in_dept / IsLeaderInDept）
+    """
+    dept_ids = list(dict.fromkeys(dept_id for dept_id in dept_ids if dept_id is not None))
+    if not dept_ids:
+        return []
+    if main_dept_id not in dept_ids:
+        main_dept_id = dept_ids[0]
+    leader_flags = list(leader_flags or [])
+    return [(dept_id, dept_id == main_dept_id, bool(leader_flags[i]) if i < len(leader_flags) else False)
+            for i, dept_id in enumerate(dept_ids)]
+
+
+def user_department_links(user_info):
+    """user/list、user/get 返回值中的所属部门；接口没有返回 department 时返回None（保持原关联）"""
+    dept_ids = user_info.get('department')
+    if not isinstance(dept_ids, list):
+        return None
+    return build_links(dept_ids, user_info.get('main_department'), user_info.get('is_leader_in_dept'))
+
+
+def event_department_links(event):
+    """change_contact 成员回调中的所属部门；回调不带 Department 时返回None（保持原关联）"""
+    text = event.text('Department')
+    if text is None:
+        return None
+    main = event.text('MainDepartment')
+    main = int(main) if main and main.isdigit() else None
+    return build_links(parse_id_list(text), main, parse_id_list(event.text('IsLeaderInDept')))
+
+
+def replace_member_departments(tenant_id, links_by_member):
+    """
+    批量替换成员的所属部门：{member_id: [(dept_id, is_main, is_leader)]}
+    按块先删后插，只修改session，由调用方提交
+    """
+    table = MemberDepartment.__table__
+    member_ids = list(links_by_member)
+    for start in range(0, len(member_ids), LINK_CHUNK):
+        chunk = member_ids[start:start + LINK_CHUNK]
+        db.session.execute(delete(table).where(table.c.member_id.in_(chunk)))
+        rows = [{'member_id': member_id, 'tenant_id': tenant_id, 'dept_id': dept_id,
+                 'is_main': is_main, 'is_leader': is_leader}
+                for member_id in chunk for dept_id, is_main, is_leader in links_by_member[member_id]]
+        if rows:
+            db.session.execute(insert(table), rows)
+
+
+def set_member_departments(member, links):
+    """单个成员（回调、OAuth同步资料）；links 为None时不修改"""
+    if links is None:
+        return
+    if member.id is None:
+        db.session.flush()
+    replace_member_departments(member.tenant_id, {member.id: links})
+
+
+def remove_member_departments(tenant_id, member_id=None, dept_ids=None):
+    """删除成员的全部关联，或删除已不存在的部门的关联"""
+    table = MemberDepartment.__table__
+    stmt = delete(table).where(table.c.tenant_id == tenant_id)
+    if member_id is not None:
+        stmt = stmt.where(table.c.member_id == member_id)
+    if dept_ids is not None:
+        if not dept_ids:
+            return
+        stmt = stmt.where(table.c.dept_id.in_(list(dept_ids)))
+    db.session.execute(stmt)
+
+
+def department_names(tenant_id):
+    """{dept_id: name}"""
+    return {department['id']: department['name'] for department in load_departments(tenant_id)}
+
+
+def org_tree_cache_key(tenant_id):
+    return make_key('org_tree', tenant_id)
+
+
+def invalidate_org_tree(tenant_id):
+    delete_cache(org_tree_cache_key(tenant_id))
+
+
+def load_departments(tenant_id):
+    """
+    租户的全部部门（扁平列表，带直属成员数），优先读缓存
+    [{'id', 'name', 'parent_id', 'order', 'member_count'}]
+    """
+    key = org_tree_cache_key(tenant_id)
+    cached = get_cache(key)
+    if cached is not None:
+        return cached
+
+    table = Department.__table__
+    rows = db.session.execute(
+        select(table.c.dept_id, table.c.name, table.c.parent_id, table.c.order)
+        .where(table.c.tenant_id == tenant_id)
+    ).all()
+    links, members = MemberDepartment.__table__, Member.__table__
+    counts = dict(db.session.execute(
+        select(links.c.dept_id, func.count())
+        .select_from(links.join(members, members.c.id == links.c.member_id))
+        .where(links.c.tenant_id == tenant_id, members.c.in_visible_range.is_(True))
+        .group_by(links.c.dept_id)
+    ).all())
+    departments = [{'id': row.dept_id, 'name': row.name, 'parent_id': row.parent_id, 'order': row.order,
+                    'member_count': counts.get(row.dept_id, 0)} for row in rows]
+    set_cache(key, departments, ttl=ORG_TREE_CACHE_TTL)
+    return departments
+
+
+def get_org_tree(tenant_id):
+    """
+    部门树：根部门（上级不在列表中）列表，子部门按 order 降序（与企微一致）放在 children 中
+    返回新构建的对象，调用方可以修改
+    """
+    nodes = {department['id']: dict(department, children=[]) for department in load_departments(tenant_id)}
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node['parent_id'])
+        if parent is not None and node['parent_id'] != node['id']:
+            parent['children'].append(node)
+        else:
+            roots.append(node)
+    for node in nodes.values():
+        node['children'].sort(key=lambda child: (-(child['order'] or 0), child['id']))
+    roots.sort(key=lambda root: (-(root['order'] or 0), root['id']))
+    return roots
+
+
+def subtree_department_ids(tenant_id, dept_id):
+    """dept_id 及其所有下级部门（部门不存在时只返回 dept_id 自身）"""
+    children = {}
+    for department in load_departments(tenant_id):
+        children.setdefault(department['parent_id'], []).append(department['id'])
+    ids, stack = set(), [dept_id]
+    while stack:
+        current = stack.pop()
+        if current in ids:
+            continue
+        ids.add(current)
+        stack.extend(children.get(current, ()))
+    return ids
+
+
+def member_ids_in_department(tenant_id, dept_id, recursive=True):
+    """部门（recursive=True 时含下级部门）下成员ID的子查询，走 idx_member_dept_tenant_dept 索引"""
+    dept_ids = subtree_department_ids(tenant_id, dept_id) if recursive else {dept_id}
+    table = MemberDepartment.__table__
+    return select(table.c.member_id).where(
+        table.c.tenant_id == tenant_id, table.c.dept_id.in_(sorted(dept_ids))
+    ).distinct()
@@ -0,0 +1,86 @@
+"""
+回调录制（可选）
+设置 WECOM_EVENT_RECORD_DIR 后，每个解密后的回调追加写入 gzip 压缩的 JSONL：
+    {"ts": 接收时间, "source": "callback|command", "xml": "<xml>...</xml>"}
+每个进程写自己的文件（callbacks-<日期>-<pid>.jsonl.gz），多Worker不会互相覆盖
+回放见 scripts/replay_callbacks.py
+
+注意：录制文件包含明文回调内容，只在压测环境或排查问题时短期开启
+"""
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WECOM_EVENT_RECORD_DIR = os.getenv('WECOM_EVENT_RECORD_DIR', '')
+
+
+class EventRecorder:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_key = None
+
+    def _open(self):
+        key = (time.strftime('%Y%m%d'), os.getpid())
+        if self._file is None or self._file_key != key:
+            if self._file is not None:
+                self._file.close()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'callbacks-{key[0]}-{key[1]}.jsonl.gz')
+            self._file = gzip.open(path, 'at', encoding='utf-8')
+            self._file_key = key
+        return self._file
+
+    def record(self, xml_plaintext, source, received_at=None):
+        line = json.dumps({'ts': received_at or time.time(), 'source': source, 'xml': xml_plaintext},
+                          ensure_ascii=False)
+        try:
+            with self._lock:
+                handle = self._open()
+                handle.write(line + '\n')
+                # 每条都刷到磁盘，进程被杀时最多丢最后一条
+                handle.flush()
+        except Exception as e:
+            logger.error(f'record wecom event failed: {e}')
+
+
+_recorder = EventRecorder(WECOM_EVENT_RECORD_DIR) if WECOM_EVENT_RECORD_DIR else None
+
+
+def record_event(xml_plaintext, source, received_at=None):
+    """未开启录制时什么都不做"""
+    if _recorder is not None:
+        _recorder.record(xml_plaintext, source, received_at)
+
+
+def iter_recorded(paths):
+    """
+    读取录制文件（支持通配符），按接收时间排序返回记录
+    文件末尾因进程退出而不完整时，读到的部分照常返回
+    """
+    files = []
+    for pattern in paths:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    records = []
+    for path in files:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as handle:
+                for line in handle:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError as e:
+                        logger.warning(f'{path}: skip malformed line ({e})')
+        except (EOFError, OSError) as e:
+            logger.warning(f'{path}: truncated recording ({e}), keeping records read so far')
+    records.sort(key=lambda record: record['ts'])
+    return records
@@ -0,0 +1,149 @@
+"""
+成员 userid <-> open_userid 映射
+- userid 转 open_userid 用 batch/userid_to_openuserid，每次最多 1000 个
+- 转换结果持久化在 user_id_mappings 表（两个方向都有索引），并缓存在 Redis；
+  对应关系不会变化，查询顺序为 Redis -> 表 -> 企微接口（只转换都未命中的）
+- 全量同步时按部门批量转换，OAuth（只拿到 open_userid）时反查真实 userid，
+  两边都按映射精确匹配成员，不再按姓名+手机号猜测
+"""
+import logging
+import os
+
+from sqlalchemy import func, select
+
+from .cache import get_many, make_key, set_many
+from .models import db, UserIdMapping
+
+logger = logging.getLogger(__name__)
+
+CONVERT_CHUNK = 1000
+IDMAP_CACHE_TTL = int(os.getenv('WECOM_IDMAP_CACHE_TTL', 86400))
+
+
+def open_userid_key(tenant_id, userid):
+    return make_key('idmap', 'open', tenant_id, userid)
+
+
+def userid_key(tenant_id, open_userid):
+    return make_key('idmap', 'user', tenant_id, open_userid)
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def upsert_statement(rows):
+    """按数据库方言生成批量 upsert 语句（冲突键：uq_idmap_tenant_userid）"""
+    table = UserIdMapping.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        return stmt.on_duplicate_key_update(open_userid=stmt.inserted.open_userid, updated_at=func.now())
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(rows)
+        return stmt.on_conflict_do_update(index_elements=['tenant_id', 'userid'],
+                                          set_={'open_userid': stmt.excluded.open_userid, 'updated_at': func.now()})
+    raise RuntimeError(f'bulk upsert not supported for dialect {dialect}')
+
+
+def cache_mappings(tenant_id, mapping):
+    """{userid: open_userid} 两个方向写入Redis"""
+    values = {}
+    for userid, open_userid in mapping.items():
+        values[open_userid_key(tenant_id, userid)] = open_userid
+        values[userid_key(tenant_id, open_userid)] = userid
+    set_many(values, ttl=IDMAP_CACHE_TTL, local=False)
+
+
+def store_mappings(tenant_id, mapping):
+    """保存转换结果（表 + Redis），提交由本函数完成"""
+    if not mapping:
+        return
+    items = list(mapping.items())
+    for chunk in chunks(items, CONVERT_CHUNK):
+        db.session.execute(upsert_statement([
+            {'tenant_id': tenant_id, 'userid': userid, 'open_userid': open_userid} for userid, open_userid in chunk
+        ]))
+    db.session.commit()
+    cache_mappings(tenant_id, mapping)
+
+
+def load_mappings(tenant_id, column, values):
+    """从表中按 userid 或 open_userid 批量查询，返回 {查询值: 对应值}"""
+    table = UserIdMapping.__table__
+    other = table.c.open_userid if column == 'userid' else table.c.userid
+    found = {}
+    for chunk in chunks(list(values), CONVERT_CHUNK):
+        rows = db.session.execute(
+            select(table.c[column], other).where(table.c.tenant_id == tenant_id, table.c[column].in_(chunk))
+        ).all()
+        found.update(dict(rows))
+    return found
+
+
+def convert_userids(access_token, userids, corp_id=None):
+    """调用 batch/userid_to_openuserid（每批 CONVERT_CHUNK 个），返回 {userid: open_userid}"""
+    from .wecom_client import wecom_client, WeComAPIError
+
+    mapping = {}
+    invalid = 0
+    for chunk in chunks(list(userids), CONVERT_CHUNK):
+        try:
+            data = wecom_client.userid_to_openuserid(access_token, chunk, corp_id=corp_id)
+        except WeComAPIError as exc:
+            logger.warning(f'userid_to_openuserid failed: corp_id={corp_id}, errcode={exc.errcode}, {exc.errmsg}')
+            continue
+        for item in data.get('open_userid_list', []):
+            if item.get('userid') and item.get('open_userid'):
+                mapping[item['userid']] = item['open_userid']
+        invalid += len(data.get('invalid_userid_list') or [])
+    if invalid:
+        logger.info(f'userid_to_openuserid: corp_id={corp_id}, {invalid} invalid userids')
+    return mapping
+
+
+def open_userids_for(tenant_id, userids, access_token=None, corp_id=None):
+    """
+    批量获取 {userid: open_userid}
+    传入 access_token 时，Redis 和表中都没有的 userid 调用企微接口转换并保存；否则只返回已知的
+    """
+    userids = list(dict.fromkeys(userid for userid in userids if userid))
+    if not userids:
+        return {}
+    cached = get_many([open_userid_key(tenant_id, userid) for userid in userids], local=False)
+    result = {userid: cached[open_userid_key(tenant_id, userid)]
+              for userid in userids if open_userid_key(tenant_id, userid) in cached}
+
+    missing = [userid for userid in userids if userid not in result]
+    if missing:
+        stored = load_mappings(tenant_id, 'userid', missing)
+        if stored:
+            cache_mappings(tenant_id, stored)
+            result.update(stored)
+        missing = [userid for userid in missing if userid not in stored]
+
+    if missing and access_token:
+        converted = convert_userids(access_token, missing, corp_id=corp_id)
+        store_mappings(tenant_id, converted)
+        result.update(converted)
+    return result
+
+
+def userid_for_open_userid(tenant_id, open_userid):
+    """open_userid 对应的真实 userid（只查已保存的映射，没有时返回None）"""
+    if not open_userid:
+        return None
+    key = userid_key(tenant_id, open_userid)
+    cached = get_many([key], local=False)
+    if key in cached:
+        return cached[key]
+    userid = load_mappings(tenant_id, 'open_userid', [open_userid]).get(open_userid)
+    if userid:
+        cache_mappings(tenant_id, {userid: open_userid})
+    return userid
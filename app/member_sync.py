@@ -0,0 +1,297 @@
+"""
+通讯录全量同步的批量写入
+- 开始时一次性把租户成员的关键列读入内存索引（userid / open_userid / mobile / name+mobile），不再逐个查询
+- OAuth 先创建的成员（userid 暂为 open_userid）按 userid->open_userid 映射精确匹配（见 id_mapping），
+  没有映射时才退回到姓名+手机号匹配
+- 变更按 CHUNK 条拼成一条 INSERT ... ON DUPLICATE KEY UPDATE（SQLite/PostgreSQL 为 ON CONFLICT），每块提交一次
+- 未同步到的成员用 UPDATE ... WHERE id IN (...) 批量停用
+全程不加载 ORM 对象，session 的 identity map 不会随成员数增长
+- 每个成员保存上次同步内容的指纹（sync_fingerprint），指纹一致且仍在可见范围内的成员不再写入
+- 写入的成员同时替换其所属部门（member_departments，见 departments），结束后清除部门树缓存
+
+拉取方式（WECOM_MEMBER_SYNC_MODE）：
+- crawl（默认）：从可见范围的根部门 fetch_child=1 拉取，按userid去重，每位成员只写一次
+  请求最少，但整个根部门是一个拉取单元：同步任务的并发拉取和逐部门检查点不起作用（见 sync_jobs）
+- department：逐部门 fetch_child=0 拉取（根部门无权限递归时使用），同样去重；
+  通讯录很大、需要并发拉取或中断后按部门续传时使用
+成员的部门名称取主部门（main_department），从同一份 department/list 快照中解析
+（user/list_id 只返回userid和部门ID，补全资料还要逐个 user/get，因此不采用）
+"""
+import hashlib
+import json
+import logging
+import os
+
+from sqlalchemy import func, select, update
+
+from .card_cache import invalidate_member_cards
+from .departments import invalidate_org_tree, replace_member_departments, user_department_links
+from .models import db, Member
+
+logger = logging.getLogger(__name__)
+
+MEMBER_SYNC_CHUNK = 500
+MEMBER_SYNC_MODE = os.getenv('WECOM_MEMBER_SYNC_MODE', 'crawl')
+
+# 企微返回值为空时保留数据库原值的字段
+COALESCE_COLUMNS = ('name', 'mobile', 'email', 'avatar_url', 'position', 'open_userid')
+# 每次同步直接覆盖的字段
+OVERWRITE_COLUMNS = ('department', 'is_active', 'in_visible_range', 'sync_fingerprint')
+
+
+def upsert_statement(rows):
+    """按数据库方言生成批量 upsert 语句（冲突键：uq_tenant_userid）"""
+    table = Member.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        incoming = stmt.inserted
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(rows)
+        incoming = stmt.excluded
+    else:
+        raise RuntimeError(f'bulk upsert not supported for dialect {dialect}')
+
+    values = {column: func.coalesce(incoming[column], table.c[column]) for column in COALESCE_COLUMNS}
+    values.update({column: incoming[column] for column in OVERWRITE_COLUMNS})
+    values['updated_at'] = func.now()
+    if dialect == 'mysql':
+        return stmt.on_duplicate_key_update(**values)
+    return stmt.on_conflict_do_update(index_elements=['tenant_id', 'userid'], set_=values)
+
+
+def root_department_ids(departments):
+    """可见范围内的根部门：上级部门不在列表中的部门"""
+    ids = {department.get('id') for department in departments}
+    return [department.get('id') for department in departments if department.get('parentid') not in ids]
+
+
+def member_department_id(user_info):
+    main = user_info.get('main_department')
+    if main:
+        return main
+    departments = user_info.get('department') or []
+    return departments[0] if departments else None
+
+
+def sync_targets(departments, mode=None):
+    """要拉取的部门及 fetch_child 参数：crawl 为可见范围根部门递归拉取，department 为逐部门拉取"""
+    mode = mode or MEMBER_SYNC_MODE
+    if mode == 'department':
+        return [department.get('id') for department in departments], 0
+    return root_department_ids(departments), 1
+
+
+def resolve_department_name(user_info, dept_names, fetched_from=None):
+    """成员的部门名称：主部门；主部门不在快照中（或接口未返回）时，退回到拉取时所在的部门"""
+    return dept_names.get(member_department_id(user_info)) or dept_names.get(fetched_from)
+
+
+def member_fingerprint(user_info, dept_name):
+    """同步写入字段的指纹（user/list 返回值 + 解析出的部门名称，所属部门变化也要重新写入）"""
+    values = [user_info.get(field) for field in ('name', 'mobile', 'email', 'avatar', 'position', 'status',
+                                                 'department', 'main_department', 'is_leader_in_dept',
+                                                 'open_userid')]
+    values.append(dept_name)
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class MemberIndex:
+    """租户成员的内存索引（只读取匹配和停用需要的列）"""
+
+    def __init__(self, tenant_id):
+        table = Member.__table__
+        rows = db.session.execute(
+            select(table.c.id, table.c.userid, table.c.open_userid, table.c.name, table.c.mobile,
+                   table.c.is_active, table.c.in_visible_range, table.c.sync_fingerprint)
+            .where(table.c.tenant_id == tenant_id)
+        ).all()
+        self.by_userid = {}
+        self.by_open_userid = {}
+        self.by_mobile = {}
+        self.by_name_mobile = {}
+        for row in rows:
+            entry = {'id': row.id, 'userid': row.userid, 'active': bool(row.is_active or row.in_visible_range),
+                     'visible': bool(row.in_visible_range), 'fingerprint': row.sync_fingerprint}
+            self.by_userid[row.userid] = entry
+            if row.open_userid:
+                self.by_open_userid.setdefault(row.open_userid, entry)
+            if row.mobile:
+                self.by_mobile.setdefault(row.mobile, entry)
+                if row.name:
+                    self.by_name_mobile.setdefault((row.name, row.mobile), entry)
+
+    def __len__(self):
+        return len(self.by_userid)
+
+    def match(self, userid, name, mobile, open_userid=None):
+        """
+        按真实userid匹配；找不到时按 open_userid 匹配（OAuth先创建、userid不同的成员），
+        没有 open_userid 映射时才尝试 name+mobile，再尝试仅mobile
+        返回 (entry, matched_by)
+        """
+        entry = self.by_userid.get(userid)
+        if entry:
+            return entry, 'userid'
+        if open_userid:
+            entry = self.by_open_userid.get(open_userid)
+            return (entry, 'open_userid') if entry else (None, None)
+        if name and mobile:
+            entry = self.by_name_mobile.get((name, mobile))
+            if entry:
+                return entry, 'name+mobile'
+        elif mobile:
+            entry = self.by_mobile.get(mobile)
+            if entry:
+                return entry, 'mobile'
+        return None, None
+
+    def rename(self, entry, userid):
+        self.by_userid.pop(entry['userid'], None)
+        entry['userid'] = userid
+        self.by_userid[userid] = entry
+
+
+class MemberSync:
+    """
+    用法：
+        sync = MemberSync(tenant_id)
+        for user_info in userlist:
+            if user_info['userid'] not in sync.synced_userids:   # 跨部门去重
+                sync.add(user_info, resolve_department_name(user_info, dept_names, dept_id))
+        sync.finish()   # 写入剩余变更并停用未同步到的成员
+        sync.stats      # {'synced', 'created', 'updated', 'unchanged', 'renamed', 'deactivated'}
+    """
+
+    def __init__(self, tenant_id, chunk_size=MEMBER_SYNC_CHUNK, synced_userids=None, before_write=None):
+        """
+        synced_userids：断点续传时之前已写入的成员，不再重复写入，停用时视为已同步
+        before_write：每块写库前调用（如续期同步锁，锁已丢失时抛异常中止写入）
+        """
+        self.tenant_id = tenant_id
+        self.chunk_size = chunk_size
+        self.before_write = before_write
+        self.index = MemberIndex(tenant_id)
+        self.pending = {}
+        self.pending_links = {}
+        # 本块中资料或userid有变化的已有成员，提交后清除名片缓存
+        self.touched_ids = set()
+        self.synced_userids = set(synced_userids or ())
+        self.stats = {'synced': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'renamed': 0, 'deactivated': 0}
+
+    def add(self, user_info, dept_name):
+        userid = user_info.get('userid')
+        if not userid:
+            return
+        name, mobile, open_userid = user_info.get('name'), user_info.get('mobile'), user_info.get('open_userid')
+        entry, matched_by = self.index.match(userid, name, mobile, open_userid)
+        if entry and matched_by != 'userid':
+            logger.info(f'member sync: tenant={self.tenant_id} matched by {matched_by}, {entry["userid"]} -> {userid}')
+            self.rename(entry, userid)
+
+        self.synced_userids.add(userid)
+        self.stats['synced'] += 1
+        fingerprint = member_fingerprint(user_info, dept_name)
+        if entry and entry['visible'] and entry['fingerprint'] == fingerprint:
+            self.stats['unchanged'] += 1
+            return
+
+        # status: 1=激活，2=禁用，4=未激活，5=退出企业
+        self.pending[userid] = {
+            'tenant_id': self.tenant_id,
+            'userid': userid,
+            'name': user_info.get('name', userid),
+            'mobile': mobile,
+            'email': user_info.get('email'),
+            'avatar_url': user_info.get('avatar'),
+            'position': user_info.get('position'),
+            'open_userid': open_userid,
+            'department': dept_name,
+            'is_active': user_info.get('status', 1) == 1,
+            'in_visible_range': True,
+            'sync_fingerprint': fingerprint,
+            'role': 'user',
+            'is_installer': False,
+        }
+        self.pending_links[userid] = user_department_links(user_info)
+        if entry:
+            self.touched_ids.add(entry['id'])
+            self.stats['updated'] += 1
+        else:
+            self.stats['created'] += 1
+            entry = {'id': None, 'userid': userid, 'active': True}
+            self.index.by_userid[userid] = entry
+        # 同一成员再次出现时按已写入处理
+        entry.update(visible=True, fingerprint=fingerprint)
+
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def rename(self, entry, userid):
+        """OAuth创建的成员改为真实userid（少见，单独执行）"""
+        table = Member.__table__
+        db.session.execute(update(table).where(table.c.id == entry['id']).values(userid=userid))
+        self.index.rename(entry, userid)
+        self.touched_ids.add(entry['id'])
+        self.stats['renamed'] += 1
+
+    def flush(self):
+        if not self.pending and not self.touched_ids:
+            return
+        if self.before_write:
+            self.before_write()
+        if self.pending:
+            db.session.execute(upsert_statement(list(self.pending.values())))
+            self.write_links()
+        db.session.commit()
+        invalidate_member_cards(self.tenant_id, self.touched_ids)
+        self.pending = {}
+        self.pending_links = {}
+        self.touched_ids = set()
+
+    def write_links(self):
+        """替换本块成员的所属部门（新建成员的ID在 upsert 之后才能查到）"""
+        userids = [userid for userid, links in self.pending_links.items() if links is not None]
+        if not userids:
+            return
+        table = Member.__table__
+        rows = db.session.execute(
+            select(table.c.id, table.c.userid)
+            .where(table.c.tenant_id == self.tenant_id, table.c.userid.in_(userids))
+        ).all()
+        links_by_member = {}
+        for member_id, userid in rows:
+            self.index.by_userid[userid]['id'] = member_id
+            links_by_member[member_id] = self.pending_links[userid]
+        replace_member_departments(self.tenant_id, links_by_member)
+
+    def deactivate_missing(self):
+        """本次未同步到的成员标记为不可见、离职（只更新当前仍为激活/可见的）"""
+        ids = [entry['id'] for userid, entry in self.index.by_userid.items()
+               if entry['id'] and entry['active'] and userid not in self.synced_userids]
+        table = Member.__table__
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            if self.before_write:
+                self.before_write()
+            db.session.execute(
+                update(table).where(table.c.id.in_(chunk))
+                .values(in_visible_range=False, is_active=False, updated_at=func.now())
+            )
+        db.session.commit()
+        invalidate_member_cards(self.tenant_id, ids)
+        self.stats['deactivated'] = len(ids)
+        return ids
+
+    def finish(self, deactivate=True):
+        """deactivate=False：本次拉取不完整（有部门失败）时不停用，避免误停用拉取失败部门的成员"""
+        self.flush()
+        if deactivate:
+            self.deactivate_missing()
+        invalidate_org_tree(self.tenant_id)
+        return self.stats
@@ -1,6 +1,6 @@
 from .main import db
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import func, event, inspect
 
 class Tenant(db.Model):
     __tablename__ = 'tenants'
@@ -24,6 +24,7 @@ class Tenant(db.Model):
     templates = db.relationship('CardTemplate', backref='tenant', lazy=True, cascade='all, delete-orphan')
     files = db.relationship('FileAsset', backref='tenant', lazy=True, cascade='all, delete-orphan')
     logs = db.relationship('CardLog', backref='tenant', lazy=True, cascade='all, delete-orphan')
+    departments = db.relationship('Department', backref='tenant', lazy=True, cascade='all, delete-orphan')
 
 class Member(db.Model):
     __tablename__ = 'members'
@@ -52,12 +53,29 @@ class Member(db.Model):
     oauth_authorized_at = db.Column(db.DateTime)  # OAuth授权时间
     user_ticket = db.Column(db.String(512))  # 用户票据
     
+    # 通讯录同步：上次同步写入内容的指纹，一致时跳过写入（见 member_sync）
+    sync_fingerprint = db.Column(db.String(40))
+    
     created_at = db.Column(db.DateTime, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
     
+    # 所属部门（通讯录同步/回调维护，department 字段保留主部门名称用于展示）
+    department_links = db.relationship('MemberDepartment', backref='member', lazy=True, cascade='all, delete-orphan')
+    
     # 唯一约束：同一租户下userid唯一
     __table_args__ = (db.UniqueConstraint('tenant_id', 'userid', name='uq_tenant_userid'),)
 
+# 同步管理的字段被其他途径修改（OAuth、回调、名片编辑）后，指纹失效，下次同步重新写入
+SYNC_FINGERPRINT_FIELDS = ('name', 'mobile', 'email', 'avatar_url', 'position', 'department',
+                           'is_active', 'in_visible_range')
+
+
+@event.listens_for(Member, 'before_update')
+def reset_sync_fingerprint(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in SYNC_FINGERPRINT_FIELDS):
+        target.sync_fingerprint = None
+
 class CardTemplate(db.Model):
     __tablename__ = 'card_templates'
     id = db.Column(db.Integer, primary_key=True)
@@ -92,4 +110,70 @@ class CardLog(db.Model):
     meta = db.Column(db.JSON)
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.String(512))
-    created_at = db.Column(db.DateTime, default=func.now(), index=True)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=func.now(), index=True)
+
+class Department(db.Model):
+    """企业通讯录部门（由 change_contact 回调增量维护，全量同步时校正）"""
+    __tablename__ = 'departments'
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False, index=True)
+    dept_id = db.Column(db.Integer, nullable=False)  # 企微部门ID
+    name = db.Column(db.String(256))  # 第三方应用可能拿不到部门名称
+    parent_id = db.Column(db.Integer)  # 上级部门的企微部门ID，根部门为0
+    order = db.Column(db.BigInteger)  # 在上级部门中的排序值
+    created_at = db.Column(db.DateTime, default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    # 唯一约束：同一租户下部门ID唯一
+    __table_args__ = (db.UniqueConstraint('tenant_id', 'dept_id', name='uq_tenant_dept'),)
+
+
+class MemberSyncRun(db.Model):
+    """通讯录同步的每次执行记录（手动/定时），用于容量规划和排查"""
+    __tablename__ = 'member_sync_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    job_id = db.Column(db.String(32), nullable=False, index=True)
+    trigger = db.Column(db.String(16), default='manual')  # manual / scheduled
+    status = db.Column(db.String(16), nullable=False)  # done / failed
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    departments = db.Column(db.Integer)  # 本次需要拉取的部门数（含之前已完成的检查点）
+    failed_departments = db.Column(db.Integer, default=0)
+    concurrency = db.Column(db.Integer)
+    users_synced = db.Column(db.Integer)
+    written = db.Column(db.Integer)
+    unchanged = db.Column(db.Integer)
+    deactivated = db.Column(db.Integer)
+    error = db.Column(db.String(512))
+
+    __table_args__ = (db.Index('idx_sync_run_tenant_started', 'tenant_id', 'started_at'),)
+
+
+class MemberDepartment(db.Model):
+    """成员与部门的多对多关系（部门用企微部门ID），按 (tenant_id, dept_id) 索引查询部门下成员"""
+    __tablename__ = 'member_departments'
+    member_id = db.Column(db.Integer, db.ForeignKey('members.id', ondelete='CASCADE'), primary_key=True)
+    dept_id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    is_main = db.Column(db.Boolean, default=False)  # 是否主部门
+    is_leader = db.Column(db.Boolean, default=False)  # 是否该部门负责人
+
+    __table_args__ = (db.Index('idx_member_dept_tenant_dept', 'tenant_id', 'dept_id'),)
+
+
+class UserIdMapping(db.Model):
+    """成员 userid 与服务商主体下 open_userid 的对应关系（batch/userid_to_openuserid 转换结果，见 id_mapping）"""
+    __tablename__ = 'user_id_mappings'
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    userid = db.Column(db.String(128), nullable=False)
+    open_userid = db.Column(db.String(128), nullable=False)
+    created_at = db.Column(db.DateTime, default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'userid', name='uq_idmap_tenant_userid'),
+        db.Index('idx_idmap_tenant_open_userid', 'tenant_id', 'open_userid'),
+    )
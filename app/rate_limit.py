@@ -0,0 +1,145 @@
+"""
+qyapi 调用限流（Redis 令牌桶）
+按 企业 + 接口 维度计数，gunicorn 各Worker和Celery Worker 共享同一个桶
+企微返回 45009/45033（调用频率/并发超限）时进入惩罚期，按指数退避后再放行
+等待令牌只在 Celery Worker 进程中允许较长时间（WECOM_RATE_LIMIT_MAX_WAIT）；
+Web 请求内最多等待 WECOM_RATE_LIMIT_REQUEST_MAX_WAIT 秒，超过即放弃，不占住 gunicorn Worker
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+WECOM_RATE_LIMIT_ENABLED = os.getenv('WECOM_RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# 每个 企业+接口 每秒补充的令牌数 / 桶容量（企微上限约为每企业每接口1万次/分钟）
+WECOM_RATE_LIMIT_RATE = float(os.getenv('WECOM_RATE_LIMIT_RATE', 50))
+WECOM_RATE_LIMIT_BURST = int(os.getenv('WECOM_RATE_LIMIT_BURST', 100))
+# 等待令牌的最长时间（秒），超过则放弃本次调用：Celery Worker 中 / Web 请求内
+WECOM_RATE_LIMIT_MAX_WAIT = float(os.getenv('WECOM_RATE_LIMIT_MAX_WAIT', 30))
+WECOM_RATE_LIMIT_REQUEST_MAX_WAIT = float(os.getenv('WECOM_RATE_LIMIT_REQUEST_MAX_WAIT', 1))
+# 命中限流错误码后的退避：base * 2^(连续次数-1)，不超过 max
+WECOM_RATE_LIMIT_BACKOFF_BASE = float(os.getenv('WECOM_RATE_LIMIT_BACKOFF_BASE', 1))
+WECOM_RATE_LIMIT_BACKOFF_MAX = float(os.getenv('WECOM_RATE_LIMIT_BACKOFF_MAX', 60))
+
+RATE_LIMIT_ERRCODES = (45009, 45033)
+
+# 当前进程是否为 Celery Worker（worker_init 时标记，见 celery_app）
+_worker_process = False
+
+
+def mark_worker_process():
+    global _worker_process
+    _worker_process = True
+
+
+# KEYS[1]=令牌桶 KEYS[2]=惩罚期
+# ARGV[1]=每秒令牌数 ARGV[2]=桶容量
+# 返回需要等待的毫秒数，0 表示已取得令牌
+TOKEN_BUCKET_SCRIPT = """
+local penalty = redis.call('PTTL', KEYS[2])
+if penalty > 0 then
+    return penalty
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RateLimiter:
+    """企业+接口 维度的分布式令牌桶"""
+
+    def __init__(self, client, prefix='wecom:ratelimit', rate=WECOM_RATE_LIMIT_RATE,
+                 burst=WECOM_RATE_LIMIT_BURST, max_wait=WECOM_RATE_LIMIT_MAX_WAIT,
+                 request_max_wait=WECOM_RATE_LIMIT_REQUEST_MAX_WAIT,
+                 backoff_base=WECOM_RATE_LIMIT_BACKOFF_BASE, backoff_max=WECOM_RATE_LIMIT_BACKOFF_MAX):
+        self.client = client
+        self.prefix = prefix
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.request_max_wait = request_max_wait
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _keys(self, scope, api):
+        base = f'{self.prefix}:{scope}:{api}'
+        return f'{base}:bucket', f'{base}:penalty', f'{base}:strikes'
+
+    def acquire(self, scope, api):
+        """
+        取得一个调用令牌，必要时阻塞等待
+        返回 True；等待超过 max_wait（Web 请求内为 request_max_wait）返回 False；Redis 不可用时直接放行
+        """
+        bucket_key, penalty_key, _ = self._keys(scope, api)
+        deadline = time.monotonic() + (self.max_wait if _worker_process else self.request_max_wait)
+        waited = False
+        while True:
+            try:
+                wait_ms = int(self._script(keys=[bucket_key, penalty_key], args=[self.rate, self.burst]))
+            except Exception as e:
+                logger.error(f'rate limiter unavailable, allow call: {e}')
+                return True
+            if wait_ms <= 0:
+                if waited:
+                    _incr_stat('throttled')
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _incr_stat('wait_timeout')
+                return False
+            waited = True
+            time.sleep(min(wait_ms / 1000.0, remaining))
+
+    def penalize(self, scope, api):
+        """
+        企微返回限流错误码：进入惩罚期，连续命中时退避时间翻倍
+        返回本次退避秒数
+        """
+        _, penalty_key, strikes_key = self._keys(scope, api)
+        try:
+            pipe = self.client.pipeline()
+            pipe.incr(strikes_key)
+            pipe.expire(strikes_key, int(self.backoff_max * 2))
+            strikes = pipe.execute()[0]
+            backoff = min(self.backoff_max, self.backoff_base * (2 ** (strikes - 1)))
+            self.client.set(penalty_key, strikes, px=int(backoff * 1000))
+        except Exception as e:
+            logger.error(f'rate limiter penalize error: {e}')
+            backoff = self.backoff_base
+        _incr_stat('limited')
+        logger.warning(f'qyapi rate limited: scope={scope}, api={api}, backoff={backoff}s')
+        return backoff
+
+    def reset(self, scope, api):
+        """调用成功：清除连续限流计数"""
+        try:
+            self.client.delete(self._keys(scope, api)[2])
+        except Exception as e:
+            logger.error(f'rate limiter reset error: {e}')
+
+
+def _incr_stat(field):
+    # 延迟导入：限流器本身只依赖传入的Redis客户端
+    from .cache import incr_stat
+    incr_stat('rate_limit', field)
@@ -3,6 +3,7 @@ from sqlalchemy import func, or_
 from sqlalchemy.sql import text
 from ..models import Tenant, Member, CardLog, FileAsset
 from ..main import db
+from ..cache import get_stats
 
 bp = Blueprint('admin_api', __name__, url_prefix='/api/admin')
 
@@ -143,3 +144,10 @@ def tenant_detail(tenant_id):
         'members': member_data,
         'logs': log_data,
     })
+
+
+@bp.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """企微凭证缓存命中统计（hit/miss/refresh 等计数器）"""
+    group = request.args.get('group')
+    return jsonify({'stats': get_stats(group or None)})
@@ -8,13 +8,34 @@ from sqlalchemy import and_, or_
 
 # ✅ 修复导入路径
 from ..main import db
-from ..asset_models import TenantAsset, AssetAnalytics
+from ..asset_models import TenantAsset, AssetAnalytics, count_recent_views
 from ..models import Tenant, Member
+from ..cache import get_many, set_many, make_key
 
 from .wecom import verify_jwt_token
 
 bp = Blueprint('assets', __name__, url_prefix='/api/tenant/assets')
 
+# 素材近30天浏览数缓存时间（秒）
+RECENT_VIEWS_CACHE_TTL = 300
+
+
+def load_recent_views(asset_ids):
+    """
+    一页素材的近30天浏览数：先批量读缓存（一次MGET），
+    未命中的素材用一次 GROUP BY 查询补齐并批量回写
+    """
+    keys = {asset_id: make_key('asset', 'recent_views', asset_id) for asset_id in asset_ids}
+    cached = get_many(keys.values())
+    result = {asset_id: cached[key] for asset_id, key in keys.items() if key in cached}
+    missing = [asset_id for asset_id in asset_ids if asset_id not in result]
+    if missing:
+        counts = count_recent_views(missing)
+        fresh = {asset_id: counts.get(asset_id, 0) for asset_id in missing}
+        set_many({keys[asset_id]: str(count) for asset_id, count in fresh.items()}, ttl=RECENT_VIEWS_CACHE_TTL)
+        result.update(fresh)
+    return {asset_id: int(count) for asset_id, count in result.items()}
+
 
 @bp.route('', methods=['GET'])
 def list_assets():
@@ -54,7 +75,8 @@ def list_assets():
         error_out=False
     )
     
-    assets = [a.to_admin_dict() for a in pagination.items]
+    recent_views = load_recent_views([a.id for a in pagination.items])
+    assets = [a.to_admin_dict(recent_views=recent_views.get(a.id, 0)) for a in pagination.items]
     
     return jsonify({
         'success': True,
@@ -94,7 +116,7 @@ def get_asset(asset_id):
     
     return jsonify({
         'success': True,
-        'asset': asset.to_admin_dict()
+        'asset': asset.to_admin_dict(recent_views=load_recent_views([asset.id]).get(asset.id, 0))
     })
 
 
@@ -3,12 +3,55 @@ import os
 from ..models import Member, CardTemplate, Tenant
 from sqlalchemy.exc import SQLAlchemyError
 from ..main import db
+from ..cache import get_many, set_many
+from ..card_cache import card_cache_keys, invalidate_member_cards
 
 bp = Blueprint('card', __name__, url_prefix='/card')
 
 # API 蓝图（新）：/api/card
 api_bp = Blueprint('card_api', __name__, url_prefix='/api/card')
 
+# 名片读取用的成员快照 / 租户信息缓存时间（秒）
+CARD_CACHE_TTL = int(os.getenv('CARD_CACHE_TTL', 300))
+
+
+def member_snapshot(member):
+    """名片展示用到的成员字段"""
+    return {
+        'name': member.name or '',
+        'position': member.position or '',
+        'department': member.department or '',
+        'avatar_url': member.avatar_url or '',
+        'mobile': member.mobile or '',
+        'email': member.email or '',
+    }
+
+
+def load_card_data(tenant_id, member_id):
+    """
+    名片数据：成员快照 + 租户信息，一次MGET读取
+    任一缓存未命中时查库并批量回写；成员不存在返回 (None, None)
+    """
+    member_key, tenant_key = card_cache_keys(tenant_id, member_id)
+    cached = get_many([member_key, tenant_key])
+    if member_key in cached and tenant_key in cached:
+        return cached[member_key], cached[tenant_key]
+
+    # 关联查询，避免懒加载关系异常
+    result = (
+        db.session.query(Member, Tenant.name.label('tenant_name'))
+        .outerjoin(Tenant, Member.tenant_id == Tenant.id)
+        .filter(Member.id == member_id, Member.tenant_id == tenant_id)
+        .first()
+    )
+    if not result:
+        return None, None
+    member, tenant_name = result
+    snapshot, tenant_info = member_snapshot(member), {'name': tenant_name or ''}
+    set_many({member_key: snapshot, tenant_key: tenant_info}, ttl=CARD_CACHE_TTL)
+    return snapshot, tenant_info
+
+
 @bp.route('/<int:tenant_id>/<int:member_id>', methods=['GET'])
 def render_card(tenant_id, member_id):
     # TODO: render template with member data
@@ -61,13 +104,7 @@ def get_card_profile():
 
     try:
         try:
-            # 关联查询，避免懒加载关系异常
-            result = (
-                db.session.query(Member, Tenant.name.label('tenant_name'))
-                .outerjoin(Tenant, Member.tenant_id == Tenant.id)
-                .filter(Member.id == member_id, Member.tenant_id == tenant_id)
-                .first()
-            )
+            member, tenant_info = load_card_data(tenant_id, member_id)
         except SQLAlchemyError as e:
             # 数据库不可用或表未创建时，返回演示数据，避免 500 阻塞前端联调
             demo_profile = {
@@ -103,24 +140,22 @@ def get_card_profile():
             }
             return jsonify({'tenant_id': tenant_id, 'member_id': member_id, 'card_profile': demo_profile, 'stub': True, 'error': 'db_unavailable'}), 200
 
-        if not result:
+        if not member:
             return jsonify({'error': 'member_not_found'}), 404
 
-        member, tenant_name = result
-
         # 构造 Profile，所有字段做兜底，避免 500
         profile = {
             'basic_info': {
-                'name': member.name or '',
-                'title': member.position or '',
-                'department': member.department or '',
-                'company': tenant_name or '',
-                'avatar': member.avatar_url or '',
+                'name': member['name'],
+                'title': member['position'],
+                'department': member['department'],
+                'company': tenant_info['name'],
+                'avatar': member['avatar_url'],
                 'company_logo': ''
             },
             'contact_info': {
-                'mobile': member.mobile or '',
-                'email': member.email or '',
+                'mobile': member['mobile'],
+                'email': member['email'],
                 'wechat': '',
                 'phone': '',
                 'address': '',
@@ -189,6 +224,7 @@ def update_card_profile():
         # 数据库不可用时回显（避免阻塞前端联调）
         return jsonify({'tenant_id': tenant_id, 'member_id': member_id, 'card_profile': card_data, 'stub': True, 'error': 'db_commit_failed', 'detail': str(e)}), 200
 
+    invalidate_member_cards(tenant_id, [member_id])
     return jsonify({'status': 'ok'})
 
 
@@ -13,12 +13,30 @@ from decimal import Decimal
 import xml.etree.ElementTree as ET
 import jwt
 import secrets
-import redis
 import sys
 import random
 import string
 
 from ..models import db, Tenant, Member
+from ..cache import (
+    CACHE_PREFIX, redis_client, set_cache, get_cache, delete_cache, incr_cache, get_or_refresh, incr_stat,
+    make_key, single_flight
+)
+from ..wecom_client import INVALID_TOKEN_ERRCODES, wecom_client, WeComAPIError
+from ..welcome_push import enqueue_welcome_push
+from ..wecom_crypto import WeComCryptoError, get_crypto
+from ..wecom_events import WeComEvent, events
+from ..celery_client import send_task
+from ..event_recorder import record_event
+from ..contact_events import apply_user_event, apply_party_event
+from ..departments import (
+    department_names, get_org_tree, invalidate_org_tree, member_ids_in_department,
+    set_member_departments, user_department_links,
+)
+from ..id_mapping import userid_for_open_userid
+from ..sync_jobs import create_job, enqueue_job, get_job
+from ..sync_scheduler import note_contact_activity
+from ..card_cache import invalidate_member_cards, invalidate_tenant_card
 
 bp = Blueprint('wecom', __name__, url_prefix='/api/v1/wecom')
 
@@ -34,42 +52,21 @@ WECOM_CONFIG = {
     'encoding_aes_key': os.getenv('WECOM_ENCODING_AES_KEY', ''),
 }
 
-# Redis缓存配置（替代内存缓存，解决Gunicorn多Worker问题）
-REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
-REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
-REDIS_DB = int(os.getenv('REDIS_DB', 0))
-REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
-
-# 创建Redis连接池
-redis_pool = redis.ConnectionPool(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB,
-    password=REDIS_PASSWORD,
-    decode_responses=True,
-    max_connections=10
-)
-redis_client = redis.Redis(connection_pool=redis_pool)
-
+# 凭证缓存：提前5分钟刷新，过期前保留旧值供等锁超时的Worker复用
+TOKEN_REFRESH_MARGIN = int(os.getenv('WECOM_TOKEN_REFRESH_MARGIN', 300))
 
-def set_cache(key, value, ttl=600):
-    """使用Redis设置缓存，支持跨Worker共享"""
-    try:
-        redis_client.setex(f'wecom:{key}', ttl, value)
-        return True
-    except Exception as e:
-        current_app.logger.error(f'Redis set_cache error: {e}')
-        return False
+# 权限缓存：管理员列表（Redis Set）与 (tenant_id, userid) 权限决策
+ADMIN_LIST_TTL = int(os.getenv('WECOM_ADMIN_LIST_TTL', 600))
+ADMIN_LIST_PLACEHOLDER = '__loaded__'
+PERMISSION_CACHE_TTL = int(os.getenv('WECOM_PERMISSION_CACHE_TTL', 300))
 
+# 回调去重窗口：企微对未及时应答的回调会重推同一个Encrypt包
+EVENT_DEDUP_TTL = int(os.getenv('WECOM_EVENT_DEDUP_TTL', 3600))
+# 处理中的认领标记：超过该时间仍未完成（Worker崩溃、队列积压）时允许重推的事件再处理
+EVENT_CLAIM_TTL = int(os.getenv('WECOM_EVENT_CLAIM_TTL', 600))
 
-def get_cache(key):
-    """使用Redis获取缓存，支持跨Worker共享"""
-    try:
-        value = redis_client.get(f'wecom:{key}')
-        return value
-    except Exception as e:
-        current_app.logger.error(f'Redis get_cache error: {e}')
-        return None
+# 成员资料同步/OAuth取资料的并发合并：结果保留N秒，期间同一成员（同一OAuth code）的调用直接复用
+PROFILE_COALESCE_TTL = int(os.getenv('WECOM_PROFILE_COALESCE_TTL', 10))
 
 
 def sanitize_media_url(value):
@@ -139,31 +136,32 @@ def build_card_preview_config(raw_config, header_background, member_custom_push_
     return resolved
 
 
-def get_suite_access_token():
-    cached = get_cache('suite_access_token')
-    if cached:
-        return cached
-
-    payload = {
-        'suite_id': WECOM_CONFIG['suite_id'],
-        'suite_secret': WECOM_CONFIG['suite_secret'],
-        'suite_ticket': get_cache('suite_ticket') or ''
-    }
+def fetch_suite_access_token():
+    """调用 service/get_suite_token 获取suite_access_token，返回 (token, expires_in)"""
     try:
-        resp = requests.post('https://qyapi.weixin.qq.com/cgi-bin/service/get_suite_token', json=payload, timeout=5)
-        data = resp.json()
-        # 企微成功响应：有suite_access_token字段且无errcode，或errcode=0
-        if 'suite_access_token' in data and data.get('errcode', 0) == 0:
-            token = data['suite_access_token']
-            expires_in = int(data.get('expires_in', 7200)) - 60
-            set_cache('suite_access_token', token, ttl=max(expires_in, 60))
-            return token
-        current_app.logger.error(f'get_suite_access_token error: {data}')
+        return wecom_client.get_suite_token(
+            WECOM_CONFIG['suite_id'],
+            WECOM_CONFIG['suite_secret'],
+            get_cache('suite_ticket') or ''
+        )
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_suite_access_token error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_suite_access_token exception: {exc}')
     return None
 
 
+def get_suite_access_token(force_refresh=False):
+    """获取suite_access_token（Redis缓存，单Worker刷新）"""
+    return get_or_refresh(
+        'suite_access_token',
+        fetch_suite_access_token,
+        margin=TOKEN_REFRESH_MARGIN,
+        stat='suite_token',
+        force=force_refresh
+    )
+
+
 def get_pre_auth_code():
     token = get_suite_access_token()
     if not token:
@@ -172,16 +170,11 @@ def get_pre_auth_code():
     if cached:
         return cached
     try:
-        resp = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/get_pre_auth_code?suite_id={WECOM_CONFIG["suite_id"]}&suite_access_token={token}',
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            code = data['pre_auth_code']
-            set_cache('pre_auth_code', code, ttl=600)
-            return code
-        current_app.logger.error(f'get_pre_auth_code error: {data}')
+        code = wecom_client.get_pre_auth_code(WECOM_CONFIG['suite_id'], token).token
+        set_cache('pre_auth_code', code, ttl=600)
+        return code
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_pre_auth_code error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_pre_auth_code exception: {exc}')
     return None
@@ -192,40 +185,44 @@ def exchange_permanent_code(auth_code):
     if not token:
         return None
     try:
-        resp = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/get_permanent_code?access_token={token}',
-            json={'auth_code': auth_code},
-            timeout=5
-        )
-        data = resp.json()
-        # 企微成功响应：有permanent_code字段且无errcode，或errcode=0
-        if 'permanent_code' in data and data.get('errcode', 0) == 0:
+        data = wecom_client.get_permanent_code(token, auth_code)
+        if 'permanent_code' in data:
             return data
         current_app.logger.error(f'get_permanent_code error: {data}')
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_permanent_code error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_permanent_code exception: {exc}')
     return None
 
 
-def get_corp_info(corp_id, permanent_code):
+def get_auth_info(corp_id, permanent_code):
+    """service/get_auth_info：企业信息（auth_corp_info）和授权信息（auth_info），失败返回None"""
     token = get_suite_access_token()
     if not token:
         return None
     try:
-        resp = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/get_auth_info?access_token={token}',
-            json={'auth_corpid': corp_id, 'permanent_code': permanent_code},
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            return data.get('auth_corp_info')
-        current_app.logger.error(f'get_corp_info error: {data}')
+        return wecom_client.get_auth_info(token, corp_id, permanent_code)
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_auth_info error: {exc.data or exc}')
     except Exception as exc:
-        current_app.logger.error(f'get_corp_info exception: {exc}')
+        current_app.logger.error(f'get_auth_info exception: {exc}')
     return None
 
 
+def get_corp_info(corp_id, permanent_code):
+    data = get_auth_info(corp_id, permanent_code)
+    return data.get('auth_corp_info') if data else None
+
+
+def auth_user_limit(auth_info):
+    """授权信息中应用可见范围的成员数（allow_user）"""
+    user_limit = 0
+    for agent in (auth_info or {}).get('agent', []):
+        user_limit = len(agent.get('privilege', {}).get('allow_user', []))
+    return user_limit
+
+
 def cache_suite_ticket(ticket):
     set_cache('suite_ticket', ticket, ttl=600)
     current_app.logger.info('suite_ticket cached')
@@ -309,6 +306,9 @@ def auth_callback():
         db.session.rollback()
         current_app.logger.error(f'DB error on tenant {corp_id}: {exc}')
         return jsonify({'error': 'db commit failed'}), 500
+    invalidate_corp_access_token(corp_id)
+    invalidate_permission_cache(tenant.id, corp_id)
+    invalidate_tenant_card(tenant.id)
 
     detail = get_corp_info(corp_id, permanent_code)
 
@@ -335,7 +335,10 @@ def callback_handler():
         echostr = request.args.get('echostr', '')
         if not verify_signature(WECOM_CONFIG['token'], timestamp, nonce, echostr, signature):
             return 'Invalid signature', 400
-        return decrypt_message(echostr)
+        plaintext = decrypt_message(echostr)
+        if plaintext is None:
+            return 'Decrypt failed', 400
+        return plaintext
 
     import sys
     print('=== callback POST received ===', file=sys.stderr, flush=True)
@@ -357,13 +360,15 @@ def callback_handler():
         return 'Invalid signature', 400
     print('callback signature verified', file=sys.stderr, flush=True)
 
-    plaintext = decrypt_message(encrypt_text)
-    print(f'decrypt result length: {len(plaintext) if plaintext else 0}', file=sys.stderr, flush=True)
+    plaintext = decrypt_message(encrypt_text, validate_receive_id=True)
+    if plaintext is None:
+        return 'Decrypt failed', 400
+    print(f'decrypt result length: {len(plaintext)}', file=sys.stderr, flush=True)
     if plaintext:
         print(f'📄 FULL DECRYPTED XML:', file=sys.stderr, flush=True)
         print(plaintext, file=sys.stderr, flush=True)
         print(f'📄 END OF XML', file=sys.stderr, flush=True)
-    process_event(plaintext)
+    dispatch_event(plaintext, 'callback', encrypt_text)
     print('=== callback processing done ===', file=sys.stderr, flush=True)
     return 'success'
 
@@ -377,7 +382,10 @@ def command_handler():
         echostr = request.args.get('echostr', '')
         if not verify_signature(WECOM_CONFIG['token'], timestamp, nonce, echostr, signature):
             return 'Invalid signature', 400
-        return decrypt_message(echostr)
+        plaintext = decrypt_message(echostr)
+        if plaintext is None:
+            return 'Decrypt failed', 400
+        return plaintext
 
     import sys
     print('=== COMMAND POST received ===', file=sys.stderr, flush=True)
@@ -399,221 +407,448 @@ def command_handler():
         return 'Invalid signature', 400
     print('command signature verified', file=sys.stderr, flush=True)
 
-    plaintext = decrypt_message(encrypt_text)
-    print(f'command decrypt result length: {len(plaintext) if plaintext else 0}', file=sys.stderr, flush=True)
+    plaintext = decrypt_message(encrypt_text, validate_receive_id=True)
+    if plaintext is None:
+        return 'Decrypt failed', 400
+    print(f'command decrypt result length: {len(plaintext)}', file=sys.stderr, flush=True)
     if plaintext:
         print(f'📄 COMMAND FULL DECRYPTED XML:', file=sys.stderr, flush=True)
         print(plaintext, file=sys.stderr, flush=True)
         print(f'📄 END OF COMMAND XML', file=sys.stderr, flush=True)
-    process_event(plaintext)
+    dispatch_event(plaintext, 'command', encrypt_text)
     print('=== COMMAND processing done ===', file=sys.stderr, flush=True)
     return 'success'
 
 
-def process_event(xml_plaintext):
-    import sys
+def event_dedup_key(encrypt_text):
+    """回调去重键：Encrypt 包的摘要（企微重推时 Encrypt 包不变）"""
+    digest = hashlib.sha256(encrypt_text.encode('utf-8')).hexdigest()
+    return f'{CACHE_PREFIX}:event_dedup:{digest}'
+
+
+def claim_event(dedup_key):
+    """
+    回调去重：SET NX 标记为处理中（EVENT_CLAIM_TTL 秒），第一次收到返回True，重推返回False
+    处理成功后由 finish_event 延长到去重窗口，失败时由 release_event 删除，企微重推时可以重新处理
+    Redis不可用时按首次处理
+    """
     try:
-        root = ET.fromstring(xml_plaintext)
-        info_type = root.findtext('InfoType')
-        print(f'⭐ wecom event: {info_type}', file=sys.stderr, flush=True)
-        if info_type == 'suite_ticket':
-            ticket = root.findtext('SuiteTicket')
-            print(f'⭐ suite_ticket extracted: {ticket[:20]}...', file=sys.stderr, flush=True)
-            cache_suite_ticket(ticket)
-            print(f'⭐ suite_ticket cached successfully!', file=sys.stderr, flush=True)
-        elif info_type in ('create_auth', 'change_auth'):
-            auth_code = root.findtext('AuthCode')
-            print(f'⭐ {info_type} auth_code={auth_code[:20]}...', file=sys.stderr, flush=True)
-            # 处理租户授权
-            print(f'🔄 开始处理租户授权...', file=sys.stderr, flush=True)
-            try:
-                api_result = exchange_permanent_code(auth_code)
-                if not api_result:
-                    print(f'❌ 换取permanent_code失败', file=sys.stderr, flush=True)
-                    return
-                
-                # 从API返回中提取企业信息
-                auth_corp_info = api_result.get('auth_corp_info', {})
-                corp_id = auth_corp_info.get('corpid')
-                corp_name = auth_corp_info.get('corp_name', 'Unknown')
-                permanent_code = api_result.get('permanent_code')
-                
-                # 提取授权信息（包含可见范围）
-                auth_info = api_result.get('auth_info', {})
-                auth_user_info = api_result.get('auth_user_info', {})
-                installer_userid = auth_user_info.get('userid')  # 安装者userid
-                
-                # 提取可见范围用户列表
-                visible_users = []
-                user_limit = 0
-                if auth_info and 'agent' in auth_info:
-                    for agent in auth_info['agent']:
-                        privilege = agent.get('privilege', {})
-                        allow_users = privilege.get('allow_user', [])
-                        visible_users.extend(allow_users)
-                        user_limit = len(allow_users)
-                
-                # 打印完整信息以便调试
-                print(f'📋 企业信息：{auth_corp_info}', file=sys.stderr, flush=True)
-                print(f'👤 安装者：{installer_userid}', file=sys.stderr, flush=True)
-                print(f'👥 可见范围用户数：{user_limit}', file=sys.stderr, flush=True)
-                
-                if not corp_id or not permanent_code:
-                    print(f'❌ API返回数据不完整', file=sys.stderr, flush=True)
-                    return
-                
-                print(f'✅ 获得permanent_code', file=sys.stderr, flush=True)
-                print(f'   corp_id: {corp_id}', file=sys.stderr, flush=True)
-                print(f'   corp_name: {corp_name}', file=sys.stderr, flush=True)
-                
-                # 保存或更新租户
-                tenant = Tenant.query.filter_by(corp_id=corp_id).first()
-                if not tenant:
-                    tenant = Tenant(corp_id=corp_id, name=corp_name)
-                    print(f'➕ 创建新租户：{corp_name}', file=sys.stderr, flush=True)
-                else:
-                    tenant.name = corp_name
-                    print(f'🔄 更新租户：{corp_name}', file=sys.stderr, flush=True)
-                
-                tenant.permanent_code = permanent_code
-                tenant.plan = 'trial'
-                tenant.installer_userid = installer_userid
-                tenant.auth_info = json.dumps(auth_info, ensure_ascii=False)
-                tenant.user_limit = user_limit
-                
-                # config字段是Text类型，需要存JSON字符串
-                if tenant.config is None or tenant.config == '':
-                    tenant.config = '{}'
-                
-                db.session.add(tenant)
-                db.session.commit()
-                
-                print(f'🎉 租户保存成功！ID={tenant.id}, Name={tenant.name}, 安装者={installer_userid}, 名额={user_limit}', file=sys.stderr, flush=True)
-            except Exception as e:
-                print(f'❌ 处理授权时发生错误: {e}', file=sys.stderr, flush=True)
-                import traceback
-                traceback.print_exc(file=sys.stderr)
-        elif info_type == 'cancel_auth':
-            corp_id = root.findtext('AuthCorpId')
-            tenant = Tenant.query.filter_by(corp_id=corp_id).first()
-            if tenant:
-                tenant.plan = 'cancelled'
-                db.session.commit()
-            print(f'⭐ cancel auth corp_id={corp_id}', file=sys.stderr, flush=True)
-        elif info_type == 'change_external_contact':
-            # 处理外部联系人事件
-            change_type = root.findtext('ChangeType')
-            userid = root.findtext('UserID')
-            external_userid = root.findtext('ExternalUserID')
-            auth_corp_id = root.findtext('AuthCorpId')
-            welcome_code = root.findtext('WelcomeCode')
-            state = root.findtext('State')
-            
-            print(f'📇 外部联系人事件: change_type={change_type}, userid={userid}, external_userid={external_userid}', 
-                  file=sys.stderr, flush=True)
-            print(f'   auth_corp_id={auth_corp_id}, welcome_code={welcome_code[:20] if welcome_code else "None"}', 
-                  file=sys.stderr, flush=True)
-            
-            # 查找租户
-            tenant = Tenant.query.filter_by(corp_id=auth_corp_id).first()
-            if not tenant:
-                print(f'❌ 租户不存在: auth_corp_id={auth_corp_id}', file=sys.stderr, flush=True)
-            else:
-                print(f'✅ 找到租户: id={tenant.id}, name={tenant.name}', file=sys.stderr, flush=True)
-                
-                # 查找员工
-                member = Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
-                if not member:
-                    print(f'⚠️ 员工不存在，尝试同步: userid={userid}', file=sys.stderr, flush=True)
-                else:
-                    print(f'✅ 找到员工: id={member.id}, name={member.name}', file=sys.stderr, flush=True)
-                
-                if change_type in ('add_external_contact', 'add_half_external_contact'):
-                    event_name = '添加外部联系人' if change_type == 'add_external_contact' else '外部联系人免验证添加成员'
-                    print(f'➕ 处理{event_name}事件', file=sys.stderr, flush=True)
-                    
-                    # ✅ 检查成员OAuth授权状态
-                    if member and not member.oauth_authorized:
-                        if not member.name or member.name == userid or not member.avatar_url:
-                            print(f'⚠️ 成员尚未完成OAuth授权，推送名片可能显示不完整: userid={userid}, name={member.name}, has_avatar={bool(member.avatar_url)}', file=sys.stderr, flush=True)
-                    
-                    # 只有在有welcome_code且员工存在的情况下才推送名片
-                    if welcome_code and member:
-                        # 1. 构建卡片预览链接（用于推送消息）
-                        card_preview_url = f'https://zjemail.cn/card-preview/{tenant.id}/{member.id}'
-                        # 2. 构建完整名片链接（点击后跳转）
-                        card_url = f'https://zjemail.cn/card/{tenant.id}/{member.id}'
-                        print(f'🎨 构建卡片预览链接: {card_preview_url}', file=sys.stderr, flush=True)
-                        print(f'🎨 构建完整名片链接: {card_url}', file=sys.stderr, flush=True)
-                        
-                        # 2. 获取推送配置（从租户配置中读取，如果没有使用默认值）
-                        try:
-                            config = json.loads(tenant.config or '{}')
-                            push_config = config.get('push_config', {})
-                            card_title = push_config.get('cardTitle', f'{member.name}的电子名片')
-                            
-                            print(f'📋 推送配置: title={card_title}', file=sys.stderr, flush=True)
-                        except Exception as e:
-                            print(f'⚠️ 读取推送配置失败，使用默认值: {e}', file=sys.stderr, flush=True)
-                            card_title = f'{member.name}的电子名片'
-                        
-                        # 3. 发送欢迎语（推送两条消息：文字标题 + 卡片链接）
-                        success = send_welcome_message(
-                            corp_id=auth_corp_id,
-                            permanent_code=tenant.permanent_code,
-                            welcome_code=welcome_code,
-                            card_preview_url=card_preview_url,  # 卡片预览链接
-                            card_title=card_title  # 第一条文字消息的标题
-                        )
-                        
-                        if success:
-                            print(f'🎉 名片自动推送成功！客户将收到 {member.name} 的数字名片', file=sys.stderr, flush=True)
-                        else:
-                            print(f'⚠️ 名片推送失败，但不影响业务流程', file=sys.stderr, flush=True)
-                    else:
-                        if not welcome_code:
-                            print(f'⚠️ 缺少welcome_code，无法发送欢迎语', file=sys.stderr, flush=True)
-                        if not member:
-                            print(f'⚠️ 员工不存在，无法推送名片', file=sys.stderr, flush=True)
-                    
-                elif change_type == 'del_external_contact':
-                    print(f'➖ 处理删除外部联系人事件', file=sys.stderr, flush=True)
-                elif change_type == 'del_follow_user':
-                    print(f'🗑️ 处理成员被客户删除事件', file=sys.stderr, flush=True)
+        return bool(redis_client.set(dedup_key, 'processing', nx=True, ex=EVENT_CLAIM_TTL))
     except Exception as exc:
-        print(f'❌ process_event error: {exc}; data={xml_plaintext[:200]}', file=sys.stderr, flush=True)
-        current_app.logger.error(f'process_event error: {exc}; data={xml_plaintext[:200]}')
+        current_app.logger.error(f'Redis claim_event error: {exc}')
+        return True
 
 
-def verify_signature(token, timestamp, nonce, data, signature):
+def finish_event(dedup_key):
+    """事件处理成功：去重标记保留 EVENT_DEDUP_TTL 秒"""
+    if not dedup_key:
+        return
+    try:
+        redis_client.set(dedup_key, 'done', ex=EVENT_DEDUP_TTL)
+    except Exception as exc:
+        current_app.logger.error(f'Redis finish_event error: {exc}')
+
+
+def release_event(dedup_key):
+    """事件处理失败：删除去重标记，企微重推的同一事件会重新处理"""
+    if not dedup_key:
+        return
+    try:
+        redis_client.delete(dedup_key)
+    except Exception as exc:
+        current_app.logger.error(f'Redis release_event error: {exc}')
+
+
+def process_claimed_event(xml_plaintext, received_at, dedup_key):
+    """请求内处理已认领的事件：成功后标记完成，失败时释放认领并抛出（回调返回失败，由企微重推）"""
+    try:
+        process_event(xml_plaintext, received_at)
+    except Exception:
+        release_event(dedup_key)
+        raise
+    finish_event(dedup_key)
+
+
+def dispatch_event(xml_plaintext, source, encrypt_text=None):
+    """
+    回调事件分发：已验签解密的事件投递到 Celery 专用队列，回调接口立即返回success
+    慢操作（换取永久授权码、发送欢迎语等）由事件Worker执行，避免企微超时重推
+    企微重推的重复事件直接确认，不再处理（按InfoType计数）；处理失败的事件不算重复
+    未开启异步或投递失败时在请求内处理，不丢事件
+    """
+    received_at = time.time()
+    event = WeComEvent.parse(xml_plaintext, received_at)
+    info_type = event.info_type if event else None
+    dedup_key = event_dedup_key(encrypt_text) if encrypt_text else None
+    if dedup_key and not claim_event(dedup_key):
+        incr_stat('events_duplicate', info_type or 'unknown')
+        print(f'♻️ 重复回调已忽略: {info_type} ({source})', file=sys.stderr, flush=True)
+        return
+    # 只录制认领成功的事件，重推的重复包不会被录制和回放
+    record_event(xml_plaintext, source, received_at)
+    # 分发表中声明 inline 的事件（如 suite_ticket）在请求内处理
+    if (event and events.is_inline(event)) or not current_app.config.get('WECOM_EVENT_ASYNC'):
+        incr_stat('events', 'inline')
+        process_claimed_event(xml_plaintext, received_at, dedup_key)
+        return
+
     try:
-        params = [token, timestamp, nonce, data]
-        params.sort()
-        calculated = hashlib.sha1(''.join(params).encode('utf-8')).hexdigest()
-        return calculated == signature
+        send_task(
+            'wecom.process_event',
+            args=[xml_plaintext, source, received_at],
+            kwargs={'dedup_key': dedup_key},
+            queue=current_app.config['WECOM_EVENT_QUEUE'],
+            retry_policy={'max_retries': 2, 'interval_start': 0, 'interval_step': 0.2, 'interval_max': 0.5}
+        )
+        incr_stat('events', 'enqueued')
+        print(f'📮 事件已入队: {info_type} ({source})', file=sys.stderr, flush=True)
     except Exception as exc:
+        current_app.logger.error(f'enqueue wecom event failed, process inline: {exc}')
+        incr_stat('events', 'enqueue_failed')
+        process_claimed_event(xml_plaintext, received_at, dedup_key)
+
+
+def process_event(xml_plaintext, received_at=None):
+    """处理企微事件：解析后交给分发表中注册的处理函数；received_at 为回调接收时间"""
+    event = WeComEvent.parse(xml_plaintext, received_at)
+    if not event:
+        print(f'❌ process_event error: invalid xml; data={(xml_plaintext or "")[:200]}', file=sys.stderr, flush=True)
+        current_app.logger.error(f'process_event error: invalid xml; data={(xml_plaintext or "")[:200]}')
+        return None
+    print(f'⭐ wecom event: {event.type_key}', file=sys.stderr, flush=True)
+    return events.dispatch(event)
+
+
+# ------------------------------------------------------------
+# 事件处理函数（按 InfoType / InfoType/ChangeType 注册）
+# ------------------------------------------------------------
+
+@events.register('suite_ticket', inline=True)
+def handle_suite_ticket(event):
+    ticket = event.text('SuiteTicket')
+    print(f'⭐ suite_ticket extracted: {ticket[:20]}...', file=sys.stderr, flush=True)
+    cache_suite_ticket(ticket)
+    print(f'⭐ suite_ticket cached successfully!', file=sys.stderr, flush=True)
+
+
+@events.register('create_auth')
+def handle_auth(event):
+    info_type = event.info_type
+    auth_code = event.text('AuthCode')
+    print(f'⭐ {info_type} auth_code={auth_code[:20]}...', file=sys.stderr, flush=True)
+    # 处理租户授权
+    print(f'🔄 开始处理租户授权...', file=sys.stderr, flush=True)
+    try:
+        api_result = exchange_permanent_code(auth_code)
+        if not api_result:
+            print(f'❌ 换取permanent_code失败', file=sys.stderr, flush=True)
+            return
+
+        # 从API返回中提取企业信息
+        auth_corp_info = api_result.get('auth_corp_info', {})
+        corp_id = auth_corp_info.get('corpid')
+        corp_name = auth_corp_info.get('corp_name', 'Unknown')
+        permanent_code = api_result.get('permanent_code')
+
+        # 提取授权信息（包含可见范围）
+        auth_info = api_result.get('auth_info', {})
+        auth_user_info = api_result.get('auth_user_info', {})
+        installer_userid = auth_user_info.get('userid')  # 安装者userid
+
+        # 可见范围用户数
+        user_limit = auth_user_limit(auth_info)
+
+        # 打印完整信息以便调试
+        print(f'📋 企业信息：{auth_corp_info}', file=sys.stderr, flush=True)
+        print(f'👤 安装者：{installer_userid}', file=sys.stderr, flush=True)
+        print(f'👥 可见范围用户数：{user_limit}', file=sys.stderr, flush=True)
+
+        if not corp_id or not permanent_code:
+            print(f'❌ API返回数据不完整', file=sys.stderr, flush=True)
+            return
+
+        print(f'✅ 获得permanent_code', file=sys.stderr, flush=True)
+        print(f'   corp_id: {corp_id}', file=sys.stderr, flush=True)
+        print(f'   corp_name: {corp_name}', file=sys.stderr, flush=True)
+
+        # 保存或更新租户
+        tenant = Tenant.query.filter_by(corp_id=corp_id).first()
+        if not tenant:
+            tenant = Tenant(corp_id=corp_id, name=corp_name)
+            print(f'➕ 创建新租户：{corp_name}', file=sys.stderr, flush=True)
+        else:
+            tenant.name = corp_name
+            print(f'🔄 更新租户：{corp_name}', file=sys.stderr, flush=True)
+
+        tenant.permanent_code = permanent_code
+        tenant.plan = 'trial'
+        tenant.installer_userid = installer_userid
+        tenant.auth_info = json.dumps(auth_info, ensure_ascii=False)
+        tenant.user_limit = user_limit
+
+        # config字段是Text类型，需要存JSON字符串
+        if tenant.config is None or tenant.config == '':
+            tenant.config = '{}'
+
+        db.session.add(tenant)
+        db.session.commit()
+        invalidate_corp_access_token(corp_id)
+        invalidate_permission_cache(tenant.id, corp_id)
+        invalidate_tenant_card(tenant.id)
+
+        print(f'🎉 租户保存成功！ID={tenant.id}, Name={tenant.name}, 安装者={installer_userid}, 名额={user_limit}', file=sys.stderr, flush=True)
+    except Exception as e:
+        db.session.rollback()
+        print(f'❌ 处理授权时发生错误: {e}', file=sys.stderr, flush=True)
+        # 交给分发表记录错误指标
+        raise
+
+
+@events.register('change_auth')
+def handle_change_auth(event):
+    """
+    授权变更（管理员修改可见范围、应用权限等）：回调不带AuthCode，用永久授权码重新拉取授权信息
+    提交后清除企业access_token、权限决策和管理员列表、名片中的租户信息缓存
+    """
+    corp_id = event.text('AuthCorpId')
+    tenant = Tenant.query.filter_by(corp_id=corp_id).first()
+    if not tenant:
+        print(f'❌ change_auth：租户不存在 corp_id={corp_id}', file=sys.stderr, flush=True)
+        invalidate_corp_access_token(corp_id)
+        return
+
+    data = get_auth_info(corp_id, tenant.permanent_code) if tenant.permanent_code else None
+    if data:
+        auth_info = data.get('auth_info') or {}
+        tenant.name = (data.get('auth_corp_info') or {}).get('corp_name') or tenant.name
+        tenant.auth_info = json.dumps(auth_info, ensure_ascii=False)
+        tenant.user_limit = auth_user_limit(auth_info)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    invalidate_corp_access_token(corp_id)
+    invalidate_permission_cache(tenant.id, corp_id)
+    invalidate_tenant_card(tenant.id)
+    print(f'⭐ change_auth corp_id={corp_id}, tenant_id={tenant.id}, refreshed={bool(data)}', file=sys.stderr, flush=True)
+    if tenant.permanent_code and not data:
+        # 缓存已清除；授权信息拉取失败时交给分发表记录错误并重试
+        raise RuntimeError(f'get_auth_info failed for corp {corp_id}')
+
+
+@events.register('cancel_auth')
+def handle_cancel_auth(event):
+    corp_id = event.text('AuthCorpId')
+    tenant = Tenant.query.filter_by(corp_id=corp_id).first()
+    if tenant:
+        tenant.plan = 'cancelled'
+        db.session.commit()
+        invalidate_permission_cache(tenant.id, corp_id)
+    invalidate_corp_access_token(corp_id)
+    print(f'⭐ cancel auth corp_id={corp_id}', file=sys.stderr, flush=True)
+
+
+def load_external_contact_context(event):
+    """外部联系人事件公共部分：打印事件、查找租户和员工，返回 (tenant, member)"""
+    userid = event.text('UserID')
+    external_userid = event.text('ExternalUserID')
+    auth_corp_id = event.text('AuthCorpId')
+    welcome_code = event.text('WelcomeCode')
+
+    print(f'📇 外部联系人事件: change_type={event.change_type}, userid={userid}, external_userid={external_userid}', 
+          file=sys.stderr, flush=True)
+    print(f'   auth_corp_id={auth_corp_id}, welcome_code={welcome_code[:20] if welcome_code else "None"}', 
+          file=sys.stderr, flush=True)
+
+    # 查找租户
+    tenant = Tenant.query.filter_by(corp_id=auth_corp_id).first()
+    if not tenant:
+        print(f'❌ 租户不存在: auth_corp_id={auth_corp_id}', file=sys.stderr, flush=True)
+        return None, None
+    print(f'✅ 找到租户: id={tenant.id}, name={tenant.name}', file=sys.stderr, flush=True)
+
+    # 查找员工
+    member = Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
+    if not member:
+        print(f'⚠️ 员工不存在，尝试同步: userid={userid}', file=sys.stderr, flush=True)
+    else:
+        print(f'✅ 找到员工: id={member.id}, name={member.name}', file=sys.stderr, flush=True)
+    return tenant, member
+
+
+@events.register('change_external_contact/add_external_contact',
+                 'change_external_contact/add_half_external_contact')
+def handle_add_external_contact(event):
+    change_type = event.change_type
+    userid = event.text('UserID')
+    auth_corp_id = event.text('AuthCorpId')
+    welcome_code = event.text('WelcomeCode')
+    received_at = event.received_at
+
+    tenant, member = load_external_contact_context(event)
+    if not tenant:
+        return
+
+    event_name = '添加外部联系人' if change_type == 'add_external_contact' else '外部联系人免验证添加成员'
+    print(f'➕ 处理{event_name}事件', file=sys.stderr, flush=True)
+
+    # ✅ 检查成员OAuth授权状态
+    if member and not member.oauth_authorized:
+        if not member.name or member.name == userid or not member.avatar_url:
+            print(f'⚠️ 成员尚未完成OAuth授权，推送名片可能显示不完整: userid={userid}, name={member.name}, has_avatar={bool(member.avatar_url)}', file=sys.stderr, flush=True)
+
+    # 只有在有welcome_code且员工存在的情况下才推送名片
+    if welcome_code and member:
+        # 1. 构建卡片预览链接（用于推送消息）
+        card_preview_url = f'https://zjemail.cn/card-preview/{tenant.id}/{member.id}'
+        # 2. 构建完整名片链接（点击后跳转）
+        card_url = f'https://zjemail.cn/card/{tenant.id}/{member.id}'
+        print(f'🎨 构建卡片预览链接: {card_preview_url}', file=sys.stderr, flush=True)
+        print(f'🎨 构建完整名片链接: {card_url}', file=sys.stderr, flush=True)
+
+        # 2. 获取推送配置（从租户配置中读取，如果没有使用默认值）
+        try:
+            config = json.loads(tenant.config or '{}')
+            push_config = config.get('push_config', {})
+            card_title = push_config.get('cardTitle', f'{member.name}的电子名片')
+
+            print(f'📋 推送配置: title={card_title}', file=sys.stderr, flush=True)
+        except Exception as e:
+            print(f'⚠️ 读取推送配置失败，使用默认值: {e}', file=sys.stderr, flush=True)
+            card_title = f'{member.name}的电子名片'
+
+        # 3. 加入欢迎语推送队列（按WelcomeCode接收时间优先推送，过期丢弃）
+        enqueue_welcome_push(
+            corp_id=auth_corp_id,
+            tenant_id=tenant.id,
+            welcome_code=welcome_code,
+            card_preview_url=card_preview_url,  # 卡片预览链接
+            card_title=card_title,  # 第一条文字消息的标题
+            received_at=received_at
+        )
+        print(f'📮 名片推送已加入队列: {member.name}', file=sys.stderr, flush=True)
+    else:
+        if not welcome_code:
+            print(f'⚠️ 缺少welcome_code，无法发送欢迎语', file=sys.stderr, flush=True)
+        if not member:
+            print(f'⚠️ 员工不存在，无法推送名片', file=sys.stderr, flush=True)
+
+
+@events.register('change_external_contact/del_external_contact')
+def handle_del_external_contact(event):
+    load_external_contact_context(event)
+    print(f'➖ 处理删除外部联系人事件', file=sys.stderr, flush=True)
+
+
+@events.register('change_external_contact/del_follow_user')
+def handle_del_follow_user(event):
+    load_external_contact_context(event)
+    print(f'🗑️ 处理成员被客户删除事件', file=sys.stderr, flush=True)
+
+
+@events.register('change_external_contact')
+def handle_other_external_contact(event):
+    load_external_contact_context(event)
+
+
+def load_contact_tenant(event):
+    corp_id = event.text('AuthCorpId')
+    tenant = Tenant.query.filter_by(corp_id=corp_id).first()
+    if not tenant:
+        print(f'❌ 通讯录变更：租户不存在 corp_id={corp_id}', file=sys.stderr, flush=True)
+    return tenant
+
+
+@events.register('change_contact/create_user', 'change_contact/update_user', 'change_contact/delete_user')
+def handle_contact_user(event):
+    """成员变更：增量更新 Member，并清除该成员的名片缓存和权限决策缓存"""
+    tenant = load_contact_tenant(event)
+    if not tenant:
+        return
+    note_contact_activity(tenant.id)
+    try:
+        member = apply_user_event(tenant, event)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if not member:
+        return
+    invalidate_org_tree(tenant.id)
+    invalidate_member_cards(tenant.id, [member.id])
+    delete_cache(permission_cache_key(tenant.id, event.text('UserID')))
+    print(f'👥 {event.change_type}: tenant_id={tenant.id}, userid={member.userid}, active={member.is_active}',
+          file=sys.stderr, flush=True)
+
+
+@events.register('change_contact/create_party', 'change_contact/update_party', 'change_contact/delete_party')
+def handle_contact_party(event):
+    """部门变更：维护 departments 表，清除部门树缓存"""
+    tenant = load_contact_tenant(event)
+    if not tenant:
+        return
+    note_contact_activity(tenant.id)
+    try:
+        department = apply_party_event(tenant, event)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_org_tree(tenant.id)
+    if department is not None and event.change_type == 'update_party':
+        # 部门改名会更新成员上的部门名称，清除这些成员的名片缓存
+        member_ids = [member_id for (member_id,) in db.session.query(Member.id).filter_by(
+            tenant_id=tenant.id, department=department.name)]
+        invalidate_member_cards(tenant.id, member_ids)
+    print(f'🏢 {event.change_type}: tenant_id={tenant.id}, dept_id={event.text("Id")}', file=sys.stderr, flush=True)
+
+
+@events.register('change_contact')
+def handle_change_contact(event):
+    """其他通讯录变更（update_tag等），暂不处理"""
+    print(f'👥 通讯录变更事件: {event.type_key}, corp_id={event.text("AuthCorpId")}', file=sys.stderr, flush=True)
+
+
+def callback_crypto(token=None):
+    """回调加解密实例（按配置缓存，密钥只解码一次）"""
+    return get_crypto(token or WECOM_CONFIG['token'], WECOM_CONFIG['encoding_aes_key'], WECOM_CONFIG['suite_id'])
+
+
+def verify_signature(token, timestamp, nonce, data, signature):
+    try:
+        return callback_crypto(token).verify_signature(signature, timestamp, nonce, data)
+    except WeComCryptoError as exc:
         current_app.logger.error(f'Verify signature error: {exc}')
         return False
 
 
-def decrypt_message(encrypted):
+def receive_id_allowed(receive_id, plaintext):
+    """
+    校验解密出的 ReceiveId：指令回调为 suite_id，数据回调为授权企业的 corp_id
+    未配置 suite_id 时不校验
+    """
+    suite_id = WECOM_CONFIG['suite_id']
+    if not suite_id or receive_id == suite_id:
+        return True
     try:
-        from Crypto.Cipher import AES
-        import struct
-        data = base64.b64decode(encrypted)
-        aes_key = base64.b64decode(WECOM_CONFIG['encoding_aes_key'] + '=')
-        cipher = AES.new(aes_key, AES.MODE_CBC, aes_key[:16])
-        decrypted = cipher.decrypt(data)
-        pad = decrypted[-1]
-        if isinstance(pad, str):
-            pad = ord(pad)
-        decrypted = decrypted[:-pad]
-        msg_len = struct.unpack('!I', decrypted[16:20])[0]
-        msg = decrypted[20:20 + msg_len].decode('utf-8')
-        return msg
-    except Exception as exc:
+        root = ET.fromstring(plaintext)
+    except ET.ParseError:
+        return False
+    return receive_id in {root.findtext(tag) for tag in ('AuthCorpId', 'ToUserName', 'CorpId')} - {None, ''}
+
+
+def decrypt_message(encrypted, validate_receive_id=False):
+    """解密回调消息，失败（含 ReceiveId 不匹配）返回None"""
+    try:
+        plaintext, receive_id = callback_crypto().decrypt(encrypted)
+    except WeComCryptoError as exc:
         current_app.logger.error(f'decrypt error: {exc}')
-        return encrypted
+        return None
+    if validate_receive_id and not receive_id_allowed(receive_id, plaintext):
+        current_app.logger.error(f'decrypt error: unexpected receive_id {receive_id}')
+        return None
+    return plaintext
 
 
 def generate_jwt_token(payload, expires_in=JWT_EXPIRATION):
@@ -653,7 +888,25 @@ def generate_oauth_url(redirect_uri, state='oauth_login'):
     return oauth_url
 
 
-def fetch_oauth_user_info(auth_code, tenant):
+def oauth_member_login(auth_code, tenant):
+    """
+    兑换OAuth code并保存成员资料（见 exchange_oauth_code / save_oauth_member），返回 {'member_id', 'userid'}
+    code只能兑换一次：同一个code的并发回调（重复跳转、刷新页面、多个Worker）合并为一次兑换和保存，
+    Redis中只保存成员ID和userid，user_ticket、手机号等资料不离开兑换它的进程
+    每个新code都会重新兑换和保存，新的 user_ticket 不会被之前的结果挡住
+    """
+    def load():
+        user_info = exchange_oauth_code(auth_code, tenant)
+        if not user_info or not user_info.get('userid'):
+            return None
+        return save_oauth_member(tenant, user_info)
+
+    code_digest = hashlib.sha256(auth_code.encode('utf-8')).hexdigest()[:32]
+    return single_flight(make_key('oauth_user', tenant.id, code_digest), load,
+                         ttl=PROFILE_COALESCE_TTL, stat='oauth_user_info')
+
+
+def exchange_oauth_code(auth_code, tenant):
     """通过OAuth code获取用户完整信息
     
     流程：
@@ -687,20 +940,12 @@ def fetch_oauth_user_info(auth_code, tenant):
         
         # Step 3: 调用getuserinfo3rd获取user_ticket
         print(f'🔑 调用getuserinfo3rd获取user_ticket, code={auth_code}', file=sys.stderr, flush=True)
-        resp1 = requests.get(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/getuserinfo3rd',
-            params={
-                'suite_access_token': suite_token,
-                'code': auth_code
-            },
-            timeout=10
-        )
-        data1 = resp1.json()
-        print(f'📥 getuserinfo3rd响应: {data1}', file=sys.stderr, flush=True)
-        
-        if data1.get('errcode') != 0:
-            print(f'❌ getuserinfo3rd失败: {data1}', file=sys.stderr, flush=True)
+        try:
+            data1 = wecom_client.getuserinfo3rd(suite_token, auth_code)
+        except WeComAPIError as exc:
+            print(f'❌ getuserinfo3rd失败: {exc.data or exc}', file=sys.stderr, flush=True)
             return None
+        print(f'📥 getuserinfo3rd响应: {data1}', file=sys.stderr, flush=True)
         
         userid = data1.get('userid') or data1.get('UserId')
         open_userid = data1.get('open_userid')  # 服务商主体下的加密userid
@@ -718,18 +963,12 @@ def fetch_oauth_user_info(auth_code, tenant):
         
         # Step 4: 使用user_ticket调用getuserdetail3rd获取完整信息
         print(f'🎫 使用user_ticket获取完整信息', file=sys.stderr, flush=True)
-        resp2 = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/getuserdetail3rd',
-            params={'suite_access_token': suite_token},
-            json={'user_ticket': user_ticket},
-            timeout=10
-        )
-        data2 = resp2.json()
-        print(f'📥 getuserdetail3rd完整响应: {json.dumps(data2, ensure_ascii=False, indent=2)}', file=sys.stderr, flush=True)
-        
-        if data2.get('errcode') != 0:
-            print(f'❌ getuserdetail3rd失败: {data2}', file=sys.stderr, flush=True)
+        try:
+            data2 = wecom_client.getuserdetail3rd(suite_token, user_ticket)
+        except WeComAPIError as exc:
+            print(f'❌ getuserdetail3rd失败: {exc.data or exc}', file=sys.stderr, flush=True)
             return {'userid': userid}
+        print(f'📥 getuserdetail3rd完整响应: {json.dumps(data2, ensure_ascii=False, indent=2)}', file=sys.stderr, flush=True)
         
         # ✅ 提取完整信息（注意：这里的name就是对外显示名称）
         user_info = {
@@ -768,31 +1007,120 @@ def fetch_oauth_user_info(auth_code, tenant):
         return None
 
 
-def get_corp_access_token(corp_id, permanent_code):
-    """获取企业的access_token"""
+def fetch_corp_access_token(corp_id, permanent_code):
+    """调用 service/get_corp_token 获取企业access_token，返回 (token, expires_in)"""
     suite_access_token = get_suite_access_token()
     if not suite_access_token:
         return None
     
     try:
-        resp = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/get_corp_token?suite_access_token={suite_access_token}',
-            json={
-                'auth_corpid': corp_id,
-                'permanent_code': permanent_code
-            },
-            timeout=5
-        )
-        data = resp.json()
-        # 企微成功响应：有access_token字段且无errcode，或errcode=0
-        if 'access_token' in data and data.get('errcode', 0) == 0:
-            return data['access_token']
-        current_app.logger.error(f'get_corp_access_token error: {data}')
+        return wecom_client.get_corp_token(suite_access_token, corp_id, permanent_code)
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_corp_access_token error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_corp_access_token exception: {exc}')
     return None
 
 
+def get_corp_access_token(corp_id, permanent_code=None, force_refresh=False):
+    """
+    获取企业的access_token（按corp_id缓存在Redis）
+    过期后只有一个Worker负责刷新，其它Worker等待或复用旧token
+    permanent_code 为空时，仅在缓存未命中时查询数据库
+    """
+    if not corp_id:
+        return None
+
+    def loader():
+        code = permanent_code
+        if not code:
+            tenant = Tenant.query.filter_by(corp_id=corp_id).first()
+            code = tenant.permanent_code if tenant else None
+        if not code:
+            return None
+        return fetch_corp_access_token(corp_id, code)
+
+    return get_or_refresh(
+        f'corp_access_token:{corp_id}',
+        loader,
+        margin=TOKEN_REFRESH_MARGIN,
+        stat='corp_token',
+        force=force_refresh
+    )
+
+
+def evict_corp_access_token(corp_id, access_token):
+    """企微拒绝了缓存的 access_token：仍是这个token时清除（含旧值备份），其它Worker已刷新的新token保留"""
+    key = f'corp_access_token:{corp_id}'
+    if get_cache(key, local=False) in (access_token, None):
+        delete_cache(key, f'{key}:stale', f'{key}:issued')
+
+
+def call_with_corp_token(corp_id, permanent_code, call):
+    """
+    用企业access_token调用企微接口：call(access_token)
+    返回 40014/42001（token无效或已过期）时清除缓存的token，重新获取后重试一次
+    取不到token时返回None；其它 WeComAPIError 原样抛出
+    """
+    access_token = get_corp_access_token(corp_id, permanent_code)
+    if not access_token:
+        return None
+    try:
+        return call(access_token)
+    except WeComAPIError as exc:
+        if exc.errcode not in INVALID_TOKEN_ERRCODES:
+            raise
+        current_app.logger.warning(f'corp access_token rejected: corp_id={corp_id}, errcode={exc.errcode}')
+        incr_stat('corp_token', 'rejected')
+    evict_corp_access_token(corp_id, access_token)
+    access_token = get_corp_access_token(corp_id, permanent_code)
+    if not access_token:
+        return None
+    return call(access_token)
+
+
+def invalidate_corp_access_token(corp_id):
+    """授权变更/取消时清除企业access_token及jsapi_ticket缓存"""
+    keys = []
+    for name in ('corp_access_token', 'jsapi_ticket', 'agent_ticket'):
+        key = f'{name}:{corp_id}'
+        keys.extend([key, f'{key}:stale', f'{key}:issued'])
+    delete_cache(*keys)
+
+
+def get_jsapi_ticket(corp_id, permanent_code=None, ticket_type='corp', force_refresh=False):
+    """
+    获取企业jsapi_ticket（按corp_id缓存在Redis，提前刷新）
+    ticket_type: corp=企业的jsapi_ticket（wx.config），agent=应用的jsapi_ticket（wx.agentConfig）
+    permanent_code 为空时，仅在缓存未命中时查询数据库
+    """
+    name = 'agent_ticket' if ticket_type == 'agent' else 'jsapi_ticket'
+
+    def loader():
+        fetch = wecom_client.get_agent_ticket if ticket_type == 'agent' else wecom_client.get_jsapi_ticket
+        try:
+            return call_with_corp_token(corp_id, permanent_code, fetch)
+        except WeComAPIError as exc:
+            current_app.logger.error(f'get {name} error: {exc.data or exc}')
+        except Exception as exc:
+            current_app.logger.error(f'get {name} exception: {exc}')
+        return None
+
+    return get_or_refresh(
+        f'{name}:{corp_id}',
+        loader,
+        margin=TOKEN_REFRESH_MARGIN,
+        stat=name,
+        force=force_refresh
+    )
+
+
+def build_jssdk_signature(ticket, nonce_str, timestamp, url):
+    """按照企微规范生成JS-SDK签名"""
+    sign_str = f"jsapi_ticket={ticket}&noncestr={nonce_str}&timestamp={timestamp}&url={url}"
+    return hashlib.sha1(sign_str.encode()).hexdigest()
+
+
 def send_welcome_message(corp_id, permanent_code, welcome_code, card_preview_url, card_title):
     """
     发送欢迎语（推送名片）
@@ -812,15 +1140,7 @@ def send_welcome_message(corp_id, permanent_code, welcome_code, card_preview_url
     """
     import sys
     
-    # 1. 获取企业access_token
-    access_token = get_corp_access_token(corp_id, permanent_code)
-    if not access_token:
-        print(f'❌ 获取access_token失败: corp_id={corp_id}', file=sys.stderr, flush=True)
-        return False
-    
-    print(f'✅ 获取access_token成功', file=sys.stderr, flush=True)
-    
-    # 2. 构建欢迎语消息（发送两条消息）
+    # 1. 构建欢迎语消息（发送两条消息）
     # 第一条：纯文字消息
     # 第二条：卡片消息（链接）
     message_data = {
@@ -845,20 +1165,20 @@ def send_welcome_message(corp_id, permanent_code, welcome_code, card_preview_url
     
     print(f'📤 准备发送欢迎语: 第一条文字={card_title}, 第二条卡片链接={card_preview_url}', file=sys.stderr, flush=True)
     
-    # 3. 调用企微API发送欢迎语
+    # 2. 调用企微API发送欢迎语（企业access_token失效时刷新后重试一次）
     try:
-        api_url = f'https://qyapi.weixin.qq.com/cgi-bin/externalcontact/send_welcome_msg?access_token={access_token}'
-        resp = requests.post(api_url, json=message_data, timeout=10)
-        result = resp.json()
-        
-        if result.get('errcode') == 0:
-            print(f'✅ 名片推送成功！', file=sys.stderr, flush=True)
-            return True
-        else:
-            print(f'❌ 名片推送失败: errcode={result.get("errcode")}, errmsg={result.get("errmsg")}', 
-                  file=sys.stderr, flush=True)
-            current_app.logger.error(f'send_welcome_message error: {result}')
+        sent = call_with_corp_token(corp_id, permanent_code,
+                                    lambda access_token: wecom_client.send_welcome_msg(access_token, message_data))
+        if sent is None:
+            print(f'❌ 获取access_token失败: corp_id={corp_id}', file=sys.stderr, flush=True)
             return False
+        print(f'✅ 名片推送成功！', file=sys.stderr, flush=True)
+        return True
+    except WeComAPIError as exc:
+        print(f'❌ 名片推送失败: errcode={exc.errcode}, errmsg={exc.errmsg}', 
+              file=sys.stderr, flush=True)
+        current_app.logger.error(f'send_welcome_message error: {exc.data or exc}')
+        return False
     except Exception as exc:
         print(f'❌ 发送欢迎语异常: {exc}', file=sys.stderr, flush=True)
         current_app.logger.error(f'send_welcome_message exception: {exc}')
@@ -867,66 +1187,80 @@ def send_welcome_message(corp_id, permanent_code, welcome_code, card_preview_url
 
 def get_user_info_by_code(corp_id, permanent_code, code):
     """通过code获取用户信息"""
-    access_token = get_corp_access_token(corp_id, permanent_code)
-    if not access_token:
-        return None
-    
     try:
-        resp = requests.get(
-            f'https://qyapi.weixin.qq.com/cgi-bin/auth/getuserinfo?access_token={access_token}&code={code}',
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            return data
-        current_app.logger.error(f'get_user_info_by_code error: {data}')
+        return call_with_corp_token(corp_id, permanent_code,
+                                    lambda access_token: wecom_client.auth_getuserinfo(access_token, code))
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_user_info_by_code error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_user_info_by_code exception: {exc}')
     return None
 
 
-def get_user_info(access_token, userid):
+def get_user_info(corp_id, permanent_code, userid):
     """
-    通过企业access_token获取单个成员的详细信息
+    通过企业access_token获取单个成员的详细信息（取不到token或接口失败返回None）
     """
     try:
-        resp = requests.get(
-            'https://qyapi.weixin.qq.com/cgi-bin/user/get',
-            params={
-                'access_token': access_token,
-                'userid': userid
-            },
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            return data
-        current_app.logger.error(f'get_user_info error: {data}')
+        return call_with_corp_token(corp_id, permanent_code,
+                                    lambda access_token: wecom_client.get_user(access_token, userid))
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_user_info error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_user_info exception: {exc}')
     return None
 
 
+def member_role_fields(role):
+    """(role, is_installer)"""
+    return ('admin' if role in ('installer', 'super_admin') else 'user'), role == 'installer'
+
+
 def sync_member_profile(tenant, userid, role, member=None):
     """
     使用企微API同步成员资料，确保名片展示信息完整
+    同一成员的并发调用（多次打开名片、多个Worker同时处理）合并为一次 user/get 和一次写库，
+    其它调用方等待后重新加载刚写入的记录
     """
+    refreshed = {}
+
+    def load():
+        refreshed['member'] = refresh_member_profile(tenant, userid, role, member)
+        return refreshed['member'] and {'member_id': refreshed['member'].id}
+
+    result = single_flight(make_key('member_profile', tenant.id, userid), load,
+                           ttl=PROFILE_COALESCE_TTL, stat='member_profile')
+    if 'member' in refreshed:
+        return refreshed['member'] or member
+    if not result:
+        # 等锁超时：沿用现有记录
+        return member
+
+    synced = db.session.get(Member, result['member_id'])
+    if synced is None:
+        return member
+    db.session.refresh(synced)
+    role_fields = member_role_fields(role)
+    if (synced.role, synced.is_installer) != role_fields:
+        synced.role, synced.is_installer = role_fields
+        try:
+            db.session.commit()
+        except Exception as exc:
+            current_app.logger.error(f'sync_member_profile role update error: {exc}')
+            db.session.rollback()
+    return synced
+
+
+def refresh_member_profile(tenant, userid, role, member=None):
+    """调用 user/get 更新成员记录并提交，失败返回None"""
     try:
         print(f'🔄 开始同步成员资料: tenant_id={tenant.id}, userid={userid}', file=sys.stderr, flush=True)
         
-        corp_access_token = get_corp_access_token(tenant.corp_id, tenant.permanent_code)
-        if not corp_access_token:
-            current_app.logger.warning(f'sync_member_profile: failed to get corp access token for tenant {tenant.id}')
-            print(f'❌ 获取corp_access_token失败', file=sys.stderr, flush=True)
-            return member
-        
-        print(f'✅ 获取到corp_access_token: {corp_access_token[:20]}...', file=sys.stderr, flush=True)
-        
-        user_info = get_user_info(corp_access_token, userid)
+        user_info = get_user_info(tenant.corp_id, tenant.permanent_code, userid)
         if not user_info:
             current_app.logger.warning(f'sync_member_profile: empty user_info for userid={userid}')
             print(f'❌ 从企微API获取用户信息失败', file=sys.stderr, flush=True)
-            return member
+            return None
         
         print(f'✅ 从企微API获取到用户信息: {user_info}', file=sys.stderr, flush=True)
         
@@ -981,35 +1315,37 @@ def sync_member_profile(tenant, userid, role, member=None):
         if position_value:
             member.position = position_value
         
-        department_name = (
-            user_info.get('main_department_name')
-            or user_info.get('main_department')
-            or user_info.get('department_name')
-        )
-        if department_name:
-            member.department = str(department_name)
-        elif isinstance(user_info.get('department'), list) and user_info.get('department'):
-            member.department = ' / '.join(str(dep) for dep in user_info.get('department'))
+        # 部门：user/get 只返回部门ID，名称从部门树（departments 表）解析
+        department_links = user_department_links(user_info)
+        if department_links:
+            main_dept_id = next(dept_id for dept_id, is_main, _ in department_links if is_main)
+            department_name = department_names(tenant.id).get(main_dept_id)
+            if department_name:
+                member.department = department_name
         
         status = user_info.get('status')
         if status is not None:
             member.is_active = (status == 1)
         
-        member.role = 'admin' if role in ('installer', 'super_admin') else 'user'
-        member.is_installer = (role == 'installer')
+        member.role, member.is_installer = member_role_fields(role)
         member.in_visible_range = True
+        set_member_departments(member, department_links)
         
         db.session.commit()
+        invalidate_member_cards(tenant.id, [member.id])
+        if department_links is not None:
+            invalidate_org_tree(tenant.id)
         
         if created:
             current_app.logger.info(f'sync_member_profile: created member record for userid={userid}')
         else:
             current_app.logger.info(f'sync_member_profile: updated member record for userid={userid}')
         
+        return member
     except Exception as exc:
         current_app.logger.error(f'sync_member_profile error: {exc}', exc_info=True)
         db.session.rollback()
-    return member
+        return None
 
 
 def get_admin_list(corp_id, permanent_code):
@@ -1018,58 +1354,112 @@ def get_admin_list(corp_id, permanent_code):
     返回格式: [{"userid": "xxx", "auth_type": 0/1}, ...]
     auth_type: 0=发消息权限, 1=管理权限
     """
-    access_token = get_corp_access_token(corp_id, permanent_code)
-    if not access_token:
-        return None
-    
     try:
-        resp = requests.post(
-            f'https://qyapi.weixin.qq.com/cgi-bin/agent/get_admin_list?access_token={access_token}',
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            return data.get('admin', [])
-        current_app.logger.error(f'get_admin_list error: {data}')
+        return call_with_corp_token(corp_id, permanent_code, wecom_client.get_admin_list)
+    except WeComAPIError as exc:
+        current_app.logger.error(f'get_admin_list error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'get_admin_list exception: {exc}')
     return None
 
 
-def check_user_admin_permission(corp_id, permanent_code, userid):
+def is_in_admin_list(corp_id, permanent_code, userid):
+    """
+    用户是否在应用管理员列表中（auth_type=1）
+    管理员列表按企业缓存为Redis Set，缓存命中时不调用企微接口
+    返回 True/False；管理员列表获取失败时返回None
+    """
+    key = f'{CACHE_PREFIX}:admin_list:{corp_id}'
+    try:
+        pipe = redis_client.pipeline()
+        pipe.exists(key)
+        pipe.sismember(key, userid)
+        loaded, is_member = pipe.execute()
+        if loaded:
+            incr_stat('admin_list', 'hit')
+            return bool(is_member)
+    except Exception as exc:
+        current_app.logger.error(f'Redis admin_list error: {exc}')
+    incr_stat('admin_list', 'miss')
+
+    admin_list = get_admin_list(corp_id, permanent_code)
+    if admin_list is None:
+        return None
+    # auth_type=1 表示管理权限
+    admins = {admin.get('userid') for admin in admin_list if admin.get('auth_type') == 1 and admin.get('userid')}
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(key)
+        # 占位成员：区分"列表为空"和"未缓存"
+        pipe.sadd(key, ADMIN_LIST_PLACEHOLDER, *admins)
+        pipe.expire(key, ADMIN_LIST_TTL)
+        pipe.execute()
+    except Exception as exc:
+        current_app.logger.error(f'Redis admin_list error: {exc}')
+    return userid in admins
+
+
+def resolve_admin_permission(corp_id, permanent_code, userid):
     """
     检查用户是否有管理员权限
     优先使用get_admin_list，降级到user/get的is_leader字段
+    返回 True/False；接口均失败、无法判断时返回None
     """
     # 方案1：使用管理员列表（推荐，官方接口）
-    admin_list = get_admin_list(corp_id, permanent_code)
-    if admin_list:
-        # auth_type=1 表示管理权限
-        for admin in admin_list:
-            if admin.get('userid') == userid and admin.get('auth_type') == 1:
-                return True
+    in_admin_list = is_in_admin_list(corp_id, permanent_code, userid)
+    if in_admin_list:
+        return True
     
     # 方案2：降级方案，使用is_leader字段
-    access_token = get_corp_access_token(corp_id, permanent_code)
-    if not access_token:
-        return False
-    
     try:
         # 获取用户详情
-        resp = requests.get(
-            f'https://qyapi.weixin.qq.com/cgi-bin/user/get?access_token={access_token}&userid={userid}',
-            timeout=5
-        )
-        data = resp.json()
-        if data.get('errcode') == 0:
-            # 检查是否是管理员（isleader=1 或在特定管理部门）
-            is_leader = data.get('isleader') == 1
-            # 可以根据需要添加更多权限检查逻辑
-            return is_leader
-        current_app.logger.error(f'check_user_admin_permission error: {data}')
+        data = call_with_corp_token(corp_id, permanent_code,
+                                    lambda access_token: wecom_client.get_user(access_token, userid))
+        if data is None:
+            return None
+        # 检查是否是管理员（isleader=1 或在特定管理部门）
+        is_leader = data.get('isleader') == 1
+        # 可以根据需要添加更多权限检查逻辑
+        return is_leader
+    except WeComAPIError as exc:
+        current_app.logger.error(f'check_user_admin_permission error: {exc.data or exc}')
     except Exception as exc:
         current_app.logger.error(f'check_user_admin_permission exception: {exc}')
-    return False
+    return None
+
+
+def check_user_admin_permission(corp_id, permanent_code, userid):
+    """检查用户是否有管理员权限"""
+    return bool(resolve_admin_permission(corp_id, permanent_code, userid))
+
+
+def permission_cache_key(tenant_id, userid):
+    """权限决策缓存键：带租户版本号，授权变更时整体失效"""
+    version = get_cache(f'perm_ver:{tenant_id}') or 0
+    return f'perm:{tenant_id}:{version}:{userid}'
+
+
+def invalidate_permission_cache(tenant_id, corp_id=None):
+    """授权变更（change_auth等回调）时清除权限决策缓存和管理员列表缓存"""
+    incr_cache(f'perm_ver:{tenant_id}')
+    if corp_id:
+        delete_cache(f'admin_list:{corp_id}')
+
+
+def get_visible_userids(tenant):
+    """解析 tenant.auth_info 中各应用的可见范围 allow_user"""
+    visible = set()
+    if not tenant.auth_info:
+        return visible
+    try:
+        auth_info = json.loads(tenant.auth_info)
+        if auth_info and 'agent' in auth_info:
+            for agent in auth_info['agent']:
+                privilege = agent.get('privilege', {})
+                visible.update(privilege.get('allow_user', []))
+    except Exception:
+        pass
+    return visible
 
 
 def check_user_permission(tenant_id, userid):
@@ -1082,6 +1472,8 @@ def check_user_permission(tenant_id, userid):
     3. 应用可见范围内 → 使用权限
     4. 不在可见范围 → 无权限
     
+    决策结果按 (tenant_id, userid) 缓存 PERMISSION_CACHE_TTL 秒，授权变更回调时失效
+    
     返回格式：
     {
         'has_access': bool,      # 是否有访问权限
@@ -1090,10 +1482,25 @@ def check_user_permission(tenant_id, userid):
         'in_visible_range': bool # 是否在可见范围内
     }
     """
+    cache_key = permission_cache_key(tenant_id, userid)
+    cached = get_cache(cache_key)
+    if isinstance(cached, dict):
+        incr_stat('permission', 'hit')
+        return cached
+    incr_stat('permission', 'miss')
+
     tenant = Tenant.query.get(tenant_id)
     if not tenant:
         return {'has_access': False, 'is_admin': False, 'role': 'none', 'in_visible_range': False}
-    
+
+    permission, cacheable = resolve_user_permission(tenant, userid)
+    if cacheable:
+        set_cache(cache_key, permission, ttl=PERMISSION_CACHE_TTL)
+    return permission
+
+
+def resolve_user_permission(tenant, userid):
+    """计算权限决策，返回 (permission, cacheable)；企微接口失败时结果不缓存"""
     # 1. 检查是否是安装者（最高优先级）
     if tenant.installer_userid and tenant.installer_userid == userid:
         return {
@@ -1101,39 +1508,27 @@ def check_user_permission(tenant_id, userid):
             'is_admin': True,
             'role': 'installer',
             'in_visible_range': True
-        }
+        }, True
     
     # 2. 检查是否是企业超管
-    if check_user_admin_permission(tenant.corp_id, tenant.permanent_code, userid):
+    is_admin = resolve_admin_permission(tenant.corp_id, tenant.permanent_code, userid)
+    if is_admin:
         return {
             'has_access': True,
             'is_admin': True,
             'role': 'super_admin',
             'in_visible_range': True
-        }
+        }, True
+    cacheable = is_admin is not None
     
     # 3. 检查是否在可见范围内
-    in_visible_range = False
-    if tenant.auth_info:
-        try:
-            auth_info = json.loads(tenant.auth_info)
-            if auth_info and 'agent' in auth_info:
-                for agent in auth_info['agent']:
-                    privilege = agent.get('privilege', {})
-                    allow_users = privilege.get('allow_user', [])
-                    if userid in allow_users:
-                        in_visible_range = True
-                        break
-        except:
-            pass
-    
-    if in_visible_range:
+    if userid in get_visible_userids(tenant):
         return {
             'has_access': True,
             'is_admin': False,
             'role': 'user',
             'in_visible_range': True
-        }
+        }, cacheable
     
     # 4. 无权限
     return {
@@ -1141,7 +1536,7 @@ def check_user_permission(tenant_id, userid):
         'is_admin': False,
         'role': 'none',
         'in_visible_range': False
-    }
+    }, cacheable
 
 
 @bp.route('/oauth/authorize', methods=['GET'])
@@ -1206,21 +1601,13 @@ def verify_user():
     
     # 2. 使用第三方接口获取用户身份（官方推荐）
     try:
-        resp = requests.get(
-            f'https://qyapi.weixin.qq.com/cgi-bin/service/auth/getuserinfo3rd',
-            params={
-                'suite_access_token': suite_access_token,
-                'code': code
-            },
-            timeout=5
-        )
-        user_data = resp.json()
-        
-        if user_data.get('errcode') != 0:
-            current_app.logger.error(f'getuserinfo3rd error: {user_data}')
+        try:
+            user_data = wecom_client.auth_getuserinfo3rd(suite_access_token, code)
+        except WeComAPIError as exc:
+            current_app.logger.error(f'getuserinfo3rd error: {exc.data or exc}')
             return jsonify({
                 'error': '获取用户信息失败',
-                'message': user_data.get('errmsg', 'code可能已过期，请刷新页面重试')
+                'message': exc.errmsg or 'code可能已过期，请刷新页面重试'
             }), 400
         
         # 从返回结果中获取corpid（自动识别企业）
@@ -1317,6 +1704,105 @@ def verify_user():
     })
 
 
+def save_oauth_member(tenant, user_info):
+    """
+    OAuth取到的成员资料写入 Member 并标记已授权
+    返回 {'member_id', 'userid'}（userid 为成员记录上的真实userid，用于签发token），保存失败返回None
+    """
+    userid = user_info.get('userid')
+    open_userid = user_info.get('open_userid')
+    
+    # ⚠️ 注意：OAuth授权时，userid实际是open_userid（加密ID）
+    # 先用open_userid查询成员，如果找不到则创建
+    member = Member.query.filter_by(tenant_id=tenant.id, open_userid=open_userid).first()
+    
+    # 通讯录同步时保存的 userid<->open_userid 映射中有真实userid：按真实userid精确查找
+    real_userid = userid_for_open_userid(tenant.id, open_userid)
+    if not member and real_userid:
+        member = Member.query.filter_by(tenant_id=tenant.id, userid=real_userid).first()
+    
+    # 如果通过open_userid没找到，尝试通过userid查找（兼容旧数据）
+    if not member and userid:
+        member = Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
+    
+    # 如果还是没找到，创建新成员（没有映射时userid暂时等于open_userid，后续同步时按映射更新）
+    if not member:
+        member = Member(
+            tenant_id=tenant.id,
+            userid=real_userid or userid,  # 没有映射时暂时使用返回的userid（实际是open_userid）
+            open_userid=open_userid
+        )
+        db.session.add(member)
+        print(f'📝 创建新成员记录: userid={userid}, open_userid={open_userid}', file=sys.stderr, flush=True)
+    else:
+        # 更新open_userid字段（如果之前没有）
+        if not member.open_userid:
+            member.open_userid = open_userid
+            print(f'📝 更新成员open_userid: userid={member.userid}, open_userid={open_userid}', file=sys.stderr, flush=True)
+    
+    # 🔍 详细调试：检查user_info的每个字段
+    print(f'🔍 user_info完整内容:', file=sys.stderr, flush=True)
+    print(f'  - userid: {user_info.get("userid")}', file=sys.stderr, flush=True)
+    print(f'  - open_userid: {user_info.get("open_userid")}', file=sys.stderr, flush=True)
+    print(f'  - name: {user_info.get("name")} (类型: {type(user_info.get("name"))}, 长度: {len(user_info.get("name") or "")})', file=sys.stderr, flush=True)
+    print(f'  - mobile: {user_info.get("mobile")} (类型: {type(user_info.get("mobile"))})', file=sys.stderr, flush=True)
+    print(f'  - avatar: {user_info.get("avatar")}', file=sys.stderr, flush=True)
+    print(f'  - position: {user_info.get("position")}', file=sys.stderr, flush=True)
+    print(f'  - external_position: {user_info.get("external_position")}', file=sys.stderr, flush=True)
+    print(f'  - email: {user_info.get("email")}', file=sys.stderr, flush=True)
+    print(f'  - user_ticket: {user_info.get("user_ticket") is not None}', file=sys.stderr, flush=True)
+    
+    # ✅ 更新成员信息（优先使用external_position）
+    if user_info.get('name'):
+        member.name = user_info['name']  # 对外显示名称
+        print(f'  ✅ 更新name: {member.name}', file=sys.stderr, flush=True)
+    else:
+        print(f'  ⚠️  name为空，不更新', file=sys.stderr, flush=True)
+    
+    if user_info.get('avatar'):
+        member.avatar_url = user_info['avatar']
+        print(f'  ✅ 更新avatar_url', file=sys.stderr, flush=True)
+    else:
+        print(f'  ⚠️  avatar为空，不更新', file=sys.stderr, flush=True)
+    
+    if user_info.get('mobile'):
+        member.mobile = user_info['mobile']
+        print(f'  ✅ 更新mobile: {member.mobile}', file=sys.stderr, flush=True)
+    else:
+        print(f'  ⚠️  mobile为空，不更新', file=sys.stderr, flush=True)
+    
+    if user_info.get('external_position'):
+        member.position = user_info['external_position']
+        print(f'  ✅ 更新position(external): {member.position}', file=sys.stderr, flush=True)
+    elif user_info.get('position'):
+        member.position = user_info['position']
+        print(f'  ✅ 更新position: {member.position}', file=sys.stderr, flush=True)
+    else:
+        print(f'  ⚠️  position为空，不更新', file=sys.stderr, flush=True)
+    
+    if user_info.get('email'):
+        member.email = user_info['email']
+        print(f'  ✅ 更新email: {member.email}', file=sys.stderr, flush=True)
+    else:
+        print(f'  ⚠️  email为空，不更新', file=sys.stderr, flush=True)
+    
+    # 标记已授权
+    member.oauth_authorized = True
+    member.oauth_authorized_at = datetime.now()
+    if user_info.get('user_ticket'):
+        member.user_ticket = user_info['user_ticket']
+    
+    try:
+        db.session.commit()
+        invalidate_member_cards(tenant.id, [member.id])
+        print(f'✅ 成员信息已更新并标记授权: userid={userid}, name={member.name}, has_avatar={bool(member.avatar_url)}, has_mobile={bool(member.mobile)}', file=sys.stderr, flush=True)
+        return {'member_id': member.id, 'userid': member.userid}
+    except Exception as e:
+        db.session.rollback()
+        print(f'❌ 保存成员信息失败: {e}', file=sys.stderr, flush=True)
+        return None
+
+
 @bp.route('/oauth/callback', methods=['GET'])
 def oauth_callback():
     """
@@ -1347,98 +1833,12 @@ def oauth_callback():
     if state == 'oauth_member_info':
         print(f'🎫 OAuth获取成员完整信息: corp_id={corp_id}, code={code}', file=sys.stderr, flush=True)
         
-        # 调用fetch_oauth_user_info获取完整信息
-        user_info = fetch_oauth_user_info(code, tenant)
-        if not user_info:
-            return jsonify({'error': '获取用户完整信息失败'}), 502
-        
-        userid = user_info.get('userid')
-        open_userid = user_info.get('open_userid')
-        if not userid:
-            return jsonify({'error': '无法获取用户ID'}), 502
-        
-        # ⚠️ 注意：OAuth授权时，userid实际是open_userid（加密ID）
-        # 先用open_userid查询成员，如果找不到则创建
-        member = Member.query.filter_by(tenant_id=tenant.id, open_userid=open_userid).first()
-        
-        # 如果通过open_userid没找到，尝试通过userid查找（兼容旧数据）
-        if not member and userid:
-            member = Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
-        
-        # 如果还是没找到，创建新成员（userid暂时等于open_userid，后续同步时会更新）
-        if not member:
-            member = Member(
-                tenant_id=tenant.id,
-                userid=userid,  # 暂时使用返回的userid（实际是open_userid）
-                open_userid=open_userid
-            )
-            db.session.add(member)
-            print(f'📝 创建新成员记录: userid={userid}, open_userid={open_userid}', file=sys.stderr, flush=True)
-        else:
-            # 更新open_userid字段（如果之前没有）
-            if not member.open_userid:
-                member.open_userid = open_userid
-                print(f'📝 更新成员open_userid: userid={member.userid}, open_userid={open_userid}', file=sys.stderr, flush=True)
-        
-        # 🔍 详细调试：检查user_info的每个字段
-        print(f'🔍 user_info完整内容:', file=sys.stderr, flush=True)
-        print(f'  - userid: {user_info.get("userid")}', file=sys.stderr, flush=True)
-        print(f'  - open_userid: {user_info.get("open_userid")}', file=sys.stderr, flush=True)
-        print(f'  - name: {user_info.get("name")} (类型: {type(user_info.get("name"))}, 长度: {len(user_info.get("name") or "")})', file=sys.stderr, flush=True)
-        print(f'  - mobile: {user_info.get("mobile")} (类型: {type(user_info.get("mobile"))})', file=sys.stderr, flush=True)
-        print(f'  - avatar: {user_info.get("avatar")}', file=sys.stderr, flush=True)
-        print(f'  - position: {user_info.get("position")}', file=sys.stderr, flush=True)
-        print(f'  - external_position: {user_info.get("external_position")}', file=sys.stderr, flush=True)
-        print(f'  - email: {user_info.get("email")}', file=sys.stderr, flush=True)
-        print(f'  - user_ticket: {user_info.get("user_ticket") is not None}', file=sys.stderr, flush=True)
-        
-        # ✅ 更新成员信息（优先使用external_position）
-        if user_info.get('name'):
-            member.name = user_info['name']  # 对外显示名称
-            print(f'  ✅ 更新name: {member.name}', file=sys.stderr, flush=True)
-        else:
-            print(f'  ⚠️  name为空，不更新', file=sys.stderr, flush=True)
-            
-        if user_info.get('avatar'):
-            member.avatar_url = user_info['avatar']
-            print(f'  ✅ 更新avatar_url', file=sys.stderr, flush=True)
-        else:
-            print(f'  ⚠️  avatar为空，不更新', file=sys.stderr, flush=True)
-            
-        if user_info.get('mobile'):
-            member.mobile = user_info['mobile']
-            print(f'  ✅ 更新mobile: {member.mobile}', file=sys.stderr, flush=True)
-        else:
-            print(f'  ⚠️  mobile为空，不更新', file=sys.stderr, flush=True)
-            
-        if user_info.get('external_position'):
-            member.position = user_info['external_position']
-            print(f'  ✅ 更新position(external): {member.position}', file=sys.stderr, flush=True)
-        elif user_info.get('position'):
-            member.position = user_info['position']
-            print(f'  ✅ 更新position: {member.position}', file=sys.stderr, flush=True)
-        else:
-            print(f'  ⚠️  position为空，不更新', file=sys.stderr, flush=True)
-            
-        if user_info.get('email'):
-            member.email = user_info['email']
-            print(f'  ✅ 更新email: {member.email}', file=sys.stderr, flush=True)
-        else:
-            print(f'  ⚠️  email为空，不更新', file=sys.stderr, flush=True)
-        
-        # 标记已授权
-        member.oauth_authorized = True
-        member.oauth_authorized_at = datetime.now()
-        if user_info.get('user_ticket'):
-            member.user_ticket = user_info['user_ticket']
-        
-        try:
-            db.session.commit()
-            print(f'✅ 成员信息已更新并标记授权: userid={userid}, name={member.name}, has_avatar={bool(member.avatar_url)}, has_mobile={bool(member.mobile)}', file=sys.stderr, flush=True)
-        except Exception as e:
-            db.session.rollback()
-            print(f'❌ 保存成员信息失败: {e}', file=sys.stderr, flush=True)
-            return jsonify({'error': '保存用户信息失败'}), 500
+        # 兑换code获取完整信息并保存成员（同一个code的并发回调只处理一次）
+        saved = oauth_member_login(code, tenant)
+        if not saved:
+            return jsonify({'error': '获取或保存用户完整信息失败'}), 502
+        # token 中使用成员记录上的真实userid（OAuth返回的userid实际是open_userid），/card/my 按它查找成员
+        userid = saved['userid']
         
         # 检查用户权限
         is_admin = check_user_admin_permission(corp_id, tenant.permanent_code, userid)
@@ -1850,9 +2250,10 @@ def save_workspace_config():
 @bp.route('/sync-members', methods=['POST'])
 def sync_members():
     """
-    从企业微信同步成员信息
+    从企业微信同步成员信息（后台任务）
     POST /api/v1/wecom/sync-members
     Headers: Authorization: Bearer <token>
+    返回 202 + job_id，通过 GET /sync-members/jobs/<job_id> 查询进度；未开启异步时直接返回结果（200）
     """
     import sys
     
@@ -1914,186 +2315,76 @@ def sync_members():
             'code': 'PERMANENT_CODE_MISSING'
         }), 400
     
-    print(f'🔄 开始同步成员: tenant_id={tenant_id}, corp_id={corp_id}, tenant_name={tenant.name}', file=sys.stderr, flush=True)
-    
+    # 同步在后台任务中执行，请求只创建任务；同一租户已有同步在进行时返回该任务
     try:
-        # 获取企业access_token
-        corp_access_token = get_corp_access_token(corp_id, tenant.permanent_code)
-        if not corp_access_token:
-            return jsonify({'error': '获取企业access_token失败'}), 502
-        
-        # 获取部门列表
-        dept_url = 'https://qyapi.weixin.qq.com/cgi-bin/department/list'
-        dept_resp = requests.get(dept_url, params={'access_token': corp_access_token}, timeout=10)
-        dept_data = dept_resp.json()
-        
-        if dept_data.get('errcode') != 0:
-            print(f'❌ 获取部门列表失败: {dept_data}', file=sys.stderr, flush=True)
-            return jsonify({'error': f'获取部门列表失败: {dept_data.get("errmsg")}'}), 502
-        
-        departments = dept_data.get('department', [])
-        print(f'📂 获取到 {len(departments)} 个部门', file=sys.stderr, flush=True)
-        
-        # 遍历部门获取成员
-        synced_count = 0
-        updated_count = 0
-        created_count = 0
-        synced_userids = set()  # 记录本次同步到的userid，用于标记离职/不可见用户
-        
-        for dept in departments:
-            dept_id = dept.get('id')
-            dept_name = dept.get('name')
-            print(f'  📁 同步部门: {dept_name} (id={dept_id})', file=sys.stderr, flush=True)
-            
-            # 获取部门成员详细信息
-            user_url = 'https://qyapi.weixin.qq.com/cgi-bin/user/list'
-            user_resp = requests.get(user_url, params={
-                'access_token': corp_access_token,
-                'department_id': dept_id,
-                'fetch_child': 0
-            }, timeout=10)
-            user_data = user_resp.json()
-            
-            if user_data.get('errcode') != 0:
-                print(f'  ⚠️ 获取部门成员失败: {user_data.get("errmsg")}', file=sys.stderr, flush=True)
-                continue
-            
-            userlist = user_data.get('userlist', [])
-            print(f'    👥 部门成员数: {len(userlist)}', file=sys.stderr, flush=True)
-            
-            for user_info in userlist:
-                userid = user_info.get('userid')  # ✅ 这是企业内部真实userid
-                if not userid:
-                    continue
-                
-                synced_userids.add(userid)  # 记录本次同步到的用户
-                
-                # 查找成员：优先通过真实userid，如果找不到尝试通过name+mobile匹配
-                member = Member.query.filter_by(tenant_id=tenant_id, userid=userid).first()
-                
-                # 如果通过userid没找到，尝试通过name或mobile匹配（可能是OAuth创建的成员）
-                if not member:
-                    name = user_info.get('name')
-                    mobile = user_info.get('mobile')
-                    
-                    if name and mobile:
-                        # 通过name+mobile精确匹配
-                        member = Member.query.filter_by(
-                            tenant_id=tenant_id,
-                            name=name,
-                            mobile=mobile
-                        ).first()
-                        if member:
-                            print(f'    🔗 通过name+mobile匹配到成员，更新真实userid: {name} ({member.userid} → {userid})', file=sys.stderr, flush=True)
-                            member.userid = userid  # 更新为真实userid
-                    elif mobile:
-                        # 仅通过mobile匹配
-                        member = Member.query.filter_by(
-                            tenant_id=tenant_id,
-                            mobile=mobile
-                        ).first()
-                        if member:
-                            print(f'    🔗 通过mobile匹配到成员，更新真实userid: {mobile} ({member.userid} → {userid})', file=sys.stderr, flush=True)
-                            member.userid = userid  # 更新为真实userid
-                
-                # 从企微API获取成员状态
-                status = user_info.get('status', 1)  # 1=激活，2=禁用，4=未激活，5=退出企业
-                is_active = (status == 1)
-                
-                if member:
-                    # 更新现有成员
-                    member.name = user_info.get('name') or member.name
-                    member.mobile = user_info.get('mobile') or member.mobile
-                    member.email = user_info.get('email') or member.email
-                    member.avatar_url = user_info.get('avatar') or member.avatar_url
-                    member.position = user_info.get('position') or member.position
-                    member.department = dept_name
-                    member.is_active = is_active  # 更新在职状态
-                    member.in_visible_range = True  # 能获取到说明在可见范围内
-                    member.updated_at = db.func.now()
-                    updated_count += 1
-                    status_emoji = "✅" if is_active else "⚠️"
-                    print(f'    {status_emoji} 更新成员: {member.name} ({userid})', file=sys.stderr, flush=True)
-                else:
-                    # 创建新成员
-                    member = Member(
-                        tenant_id=tenant_id,
-                        userid=userid,  # ✅ 存储真实的企业内部userid
-                        open_userid=None,  # open_userid将在OAuth授权时填充
-                        name=user_info.get('name', userid),
-                        mobile=user_info.get('mobile'),
-                        email=user_info.get('email'),
-                        avatar_url=user_info.get('avatar'),
-                        position=user_info.get('position'),
-                        department=dept_name,
-                        role='user',
-                        is_installer=False,
-                        in_visible_range=True,
-                        is_active=is_active
-                    )
-                    db.session.add(member)
-                    created_count += 1
-                    status_emoji = "✅" if is_active else "⚠️"
-                    print(f'    {status_emoji} 创建成员: {member.name} ({userid})', file=sys.stderr, flush=True)
-                
-                synced_count += 1
-        
-        # 标记本次未同步到的成员为"不可见"或"离职"
-        # 这些成员可能已离职或不在应用可见范围内
-        deactivated_count = 0
-        all_members = Member.query.filter_by(tenant_id=tenant_id).all()
-        for member in all_members:
-            if member.userid not in synced_userids:
-                # 本次同步未获取到此成员，标记为不可见
-                if member.in_visible_range or member.is_active:
-                    member.in_visible_range = False
-                    member.is_active = False  # 保守起见，同时标记为离职
-                    member.updated_at = db.func.now()
-                    deactivated_count += 1
-                    print(f'  🚫 标记为不可见: {member.name} ({member.userid})', file=sys.stderr, flush=True)
-        
-        # 提交到数据库
-        db.session.commit()
-        
-        # 更新租户配置中的同步时间
-        try:
-            config = json.loads(tenant.config or '{}')
-            if 'workspace' not in config:
-                config['workspace'] = {}
-            config['workspace']['last_member_sync'] = datetime.now().isoformat()
-            tenant.config = json.dumps(config, ensure_ascii=False)
-            db.session.commit()
-        except Exception as e:
-            print(f'⚠️ 更新同步时间失败: {e}', file=sys.stderr, flush=True)
-        
-        print(f'✅ 同步完成: 总计={synced_count}, 新增={created_count}, 更新={updated_count}, 停用={deactivated_count}', file=sys.stderr, flush=True)
-        
+        job, created = create_job(tenant_id)
+    except Exception as e:
+        current_app.logger.error(f'create member sync job failed: {e}')
+        return jsonify({'error': '同步服务暂不可用，请稍后重试'}), 503
+    if not created:
+        print(f'⏳ 已有同步任务进行中: tenant_id={tenant_id}, job_id={job and job["job_id"]}', file=sys.stderr, flush=True)
         return jsonify({
-            'success': True,
-            'count': synced_count,
-            'created': created_count,
-            'updated': updated_count,
-            'deactivated': deactivated_count,
-            'synced_at': datetime.now().isoformat(),
-            'message': f'成功同步 {synced_count} 位成员（新增{created_count}，更新{updated_count}，停用{deactivated_count}）'
+            'error': '同步正在进行中',
+            'message': '其他管理员正在同步通讯录，请稍后查看结果',
+            'code': 'SYNC_IN_PROGRESS',
+            'job': job
+        }), 409
+
+    print(f'🔄 开始同步成员: tenant_id={tenant_id}, corp_id={corp_id}, tenant_name={tenant.name}, job_id={job["job_id"]}', 
+          file=sys.stderr, flush=True)
+    job = enqueue_job(job['job_id'])
+    if job.get('status') == 'failed':
+        return jsonify({'success': False, 'error': f'同步失败: {job.get("error")}', 'job': job}), 500
+    return jsonify(sync_job_response(job)), 200 if job.get('status') == 'done' else 202
+
+
+def sync_job_response(job):
+    """任务进度；完成时带上与同步接口一致的统计字段"""
+    data = {'success': job.get('status') != 'failed', 'job_id': job['job_id'], 'job': job}
+    if job.get('status') == 'done':
+        data.update({
+            'count': job.get('count', 0),
+            'created': job.get('created', 0),
+            'updated': job.get('updated', 0),
+            'unchanged': job.get('unchanged', 0),
+            'written': job.get('written', 0),
+            'deactivated': job.get('deactivated', 0),
+            'synced_at': job.get('finished_at'),
+            'message': job.get('message'),
         })
-        
-    except requests.Timeout:
-        return jsonify({'error': '企业微信API请求超时'}), 504
-    except Exception as e:
-        db.session.rollback()
-        print(f'❌ 同步失败: {e}', file=sys.stderr, flush=True)
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'同步失败: {str(e)}'}), 500
+    return data
+
+
+@bp.route('/sync-members/jobs/<job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """
+    查询同步任务进度
+    GET /api/v1/wecom/sync-members/jobs/<job_id>
+    Headers: Authorization: Bearer <token>
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': '需要认证'}), 401
+    payload = verify_jwt_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'error': '认证token无效或已过期'}), 401
+    if not payload.get('is_admin', False):
+        return jsonify({'error': '权限不足，仅管理员可访问'}), 403
+
+    job = get_job(job_id)
+    if not job or job.get('tenant_id') != payload.get('tenant_id'):
+        return jsonify({'error': '同步任务不存在或已过期'}), 404
+    return jsonify(sync_job_response(job))
 
 
 @bp.route('/members', methods=['GET'])
 def get_members():
     """
     获取租户下的所有成员列表
-    GET /api/v1/wecom/members
+    GET /api/v1/wecom/members[?department_id=2&recursive=0]
     Headers: Authorization: Bearer <token>
+    
+    department_id：只返回该部门（默认含下级部门，recursive=0 时只含直属成员）的成员
     """
     import sys
     print('📋 收到获取成员列表请求', file=sys.stderr, flush=True)
@@ -2117,8 +2408,13 @@ def get_members():
         return jsonify({'error': '权限不足，仅管理员可访问'}), 403
     
     try:
-        # 查询该租户下的所有成员
-        members = Member.query.filter_by(tenant_id=tenant_id).all()
+        # 查询该租户下的所有成员（按部门筛选时走 member_departments 索引）
+        query = Member.query.filter_by(tenant_id=tenant_id)
+        department_id = request.args.get('department_id', type=int)
+        if department_id is not None:
+            recursive = request.args.get('recursive', '1') not in ('0', 'false', 'False')
+            query = query.filter(Member.id.in_(member_ids_in_department(tenant_id, department_id, recursive)))
+        members = query.all()
         
         members_data = []
         for m in members:
@@ -2152,23 +2448,58 @@ def get_members():
         return jsonify({'error': f'获取成员列表失败: {str(e)}'}), 500
 
 
+@bp.route('/departments', methods=['GET'])
+def get_departments():
+    """
+    获取租户的部门树（含各部门直属成员数，缓存在Redis，部门/成员变更时清除）
+    GET /api/v1/wecom/departments
+    Headers: Authorization: Bearer <token>
+    
+    返回: {"departments": [{"id", "name", "parent_id", "order", "member_count", "children": [...]}], "total": N}
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': '需要认证'}), 401
+    
+    payload = verify_jwt_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'error': '认证token无效或已过期'}), 401
+    if not payload.get('is_admin', False):
+        return jsonify({'error': '权限不足，仅管理员可访问'}), 403
+    
+    tenant_id = payload.get('tenant_id')
+    try:
+        tree = get_org_tree(tenant_id)
+        total, stack = 0, list(tree)
+        while stack:
+            node = stack.pop()
+            total += 1
+            stack.extend(node['children'])
+        return jsonify({'departments': tree, 'total': total})
+    except Exception as e:
+        current_app.logger.error(f'get_departments error: {e}', exc_info=True)
+        return jsonify({'error': f'获取部门列表失败: {str(e)}'}), 500
+
+
 @bp.route('/jssdk/signature', methods=['GET'])
 def get_jssdk_signature():
     """
     获取企微JSSDK签名（用于管理后台 open-data 组件）
-    GET /api/v1/wecom/jssdk/signature?url=<当前页面URL>
+    GET /api/v1/wecom/jssdk/signature?url=<当前页面URL>[&agent=1]
     Headers: Authorization: Bearer <token>
     
+    jsapi_ticket 按企业缓存在Redis，缓存命中时只做本地SHA1计算
+    
     返回:
     {
         "corpid": "ww...",
         "agentid": "1000002",
         "timestamp": "1234567890",
         "nonceStr": "abc123",
-        "signature": "sha1..."
+        "signature": "sha1...",
+        "agentSignature": "sha1..."   // agent=1 时返回，用于 wx.agentConfig
     }
     """
-    print(f'🔐 收到JSSDK签名请求', file=sys.stderr, flush=True)
     
     # 验证认证token
     auth_header = request.headers.get('Authorization')
@@ -2182,61 +2513,46 @@ def get_jssdk_signature():
         return jsonify({'error': '认证token无效或已过期'}), 401
     
     tenant_id = payload.get('tenant_id')
+    corp_id = payload.get('corp_id')
     
     # 获取URL参数
     url = request.args.get('url')
     if not url:
         return jsonify({'error': '缺少url参数'}), 400
-    
-    print(f'📝 请求签名的URL: {url}', file=sys.stderr, flush=True)
+    with_agent = request.args.get('agent') in ('1', 'true', 'True')
     
     try:
-        # 查询租户
-        tenant = Tenant.query.filter_by(id=tenant_id).first()
-        if not tenant:
-            return jsonify({'error': '租户不存在'}), 404
-        
-        # 获取 corp_access_token
-        corp_token = get_corp_access_token(tenant.corp_id, tenant.permanent_code)
-        if not corp_token:
-            print(f'❌ 获取corp_access_token失败', file=sys.stderr, flush=True)
-            return jsonify({'error': '获取企业凭证失败'}), 500
-        
-        # 获取 jsapi_ticket
-        print(f'🎫 获取jsapi_ticket...', file=sys.stderr, flush=True)
-        resp = requests.get(
-            'https://qyapi.weixin.qq.com/cgi-bin/get_jsapi_ticket',
-            params={'access_token': corp_token},
-            timeout=5
-        )
-        ticket_data = resp.json()
-        print(f'📥 jsapi_ticket响应: {ticket_data}', file=sys.stderr, flush=True)
-        
-        if ticket_data.get('errcode') != 0:
-            return jsonify({'error': f'获取jsapi_ticket失败: {ticket_data.get("errmsg")}'}), 500
+        # 旧token中可能没有corp_id，回退到查询租户
+        if not corp_id:
+            tenant = Tenant.query.filter_by(id=tenant_id).first()
+            if not tenant:
+                return jsonify({'error': '租户不存在'}), 404
+            corp_id = tenant.corp_id
         
-        ticket = ticket_data['ticket']
+        ticket = get_jsapi_ticket(corp_id)
+        if not ticket:
+            print(f'❌ 获取jsapi_ticket失败: corp_id={corp_id}', file=sys.stderr, flush=True)
+            return jsonify({'error': '获取jsapi_ticket失败'}), 500
         
         # 生成签名参数
         timestamp = str(int(time.time()))
         nonce_str = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
         
-        # 按照企微规范生成签名字符串
-        sign_str = f"jsapi_ticket={ticket}&noncestr={nonce_str}&timestamp={timestamp}&url={url}"
-        signature = hashlib.sha1(sign_str.encode()).hexdigest()
-        
-        print(f'✅ 签名生成成功', file=sys.stderr, flush=True)
-        print(f'  - timestamp: {timestamp}', file=sys.stderr, flush=True)
-        print(f'  - nonceStr: {nonce_str}', file=sys.stderr, flush=True)
-        print(f'  - signature: {signature}', file=sys.stderr, flush=True)
-        
-        return jsonify({
-            'corpid': tenant.corp_id,
+        result = {
+            'corpid': corp_id,
             'agentid': current_app.config.get('WECOM_AGENT_ID', '1000002'),
             'timestamp': timestamp,
             'nonceStr': nonce_str,
-            'signature': signature
-        })
+            'signature': build_jssdk_signature(ticket, nonce_str, timestamp, url)
+        }
+        
+        if with_agent:
+            agent_ticket = get_jsapi_ticket(corp_id, ticket_type='agent')
+            if not agent_ticket:
+                return jsonify({'error': '获取应用jsapi_ticket失败'}), 500
+            result['agentSignature'] = build_jssdk_signature(agent_ticket, nonce_str, timestamp, url)
+        
+        return jsonify(result)
         
     except Exception as e:
         print(f'❌ 生成签名失败: {e}', file=sys.stderr, flush=True)
@@ -2314,6 +2630,7 @@ def update_member(member_id):
         
         # 保存到数据库
         db.session.commit()
+        invalidate_member_cards(tenant_id, [member.id])
         
         print(f'✅ 成员更新成功: {updated_fields}', file=sys.stderr, flush=True)
         
@@ -2369,6 +2686,11 @@ def get_my_card():
         
         # 查询成员信息
         member = Member.query.filter_by(tenant_id=tenant_id, userid=userid).first()
+        if not member:
+            # 旧token中的userid可能是open_userid：按映射换成真实userid
+            real_userid = userid_for_open_userid(tenant_id, userid)
+            if real_userid:
+                member = Member.query.filter_by(tenant_id=tenant_id, userid=real_userid).first()
         
         # ✅ OAuth授权检测：检查是否需要用户手动授权获取完整信息
         needs_oauth = False
@@ -0,0 +1,383 @@
+"""
+通讯录同步后台任务
+- POST /sync-members 只创建任务并投递到 Celery（队列 WECOM_SYNC_QUEUE），立即返回 job_id
+- 进度写在 Redis 哈希 wecom:sync:job:<job_id>（部门完成数、拉取/同步成员数、新增/更新/未变化/停用数），前端轮询
+- 各部门的 user/list 在有界线程池中并发拉取（并发数可按租户配置），结果汇总到当前线程统一写库
+- 每个部门（crawl 模式为每个根部门）写入并提交后记录检查点：已完成的部门、已写入的userid
+  Worker 被杀后任务重新投递（acks_late），或管理员重新发起同步时，从检查点继续
+- 并发拉取和逐部门检查点只在 department 模式下有效：crawl 模式通常只有一个根部门，
+  一次 fetch_child=1 请求拉取全部成员，只有一个拉取线程，中断后从头重新拉取
+- 每个租户同时只有一个同步任务：Redis 锁 wecom:sync:lock:<tenant_id>
+  创建任务时锁的值为 job_id，Worker 开始执行时换成 <job_id>:<run_id>（同一任务被重复投递时只有一个能执行），
+  每拉取完一个部门、每写入一块成员前续期（锁已被其他任务取得时中止），Worker 异常退出后锁在 WECOM_SYNC_LOCK_TTL 秒后自动释放
+- 排队/执行中的租户记在 wecom:sync:running（定时调度据此限制并发），每次执行的耗时和结果写入 member_sync_runs
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+from flask import current_app
+
+from .cache import CACHE_PREFIX, redis_client, incr_stat
+from .celery_client import send_task
+from .contact_events import sync_departments
+from .id_mapping import open_userids_for
+from .member_sync import MemberSync, sync_targets, resolve_department_name
+from .models import db, Tenant, MemberSyncRun
+
+logger = logging.getLogger(__name__)
+
+SYNC_LOCK_TTL = int(os.getenv('WECOM_SYNC_LOCK_TTL', 300))
+# 任务进度和检查点的保留时间
+SYNC_JOB_TTL = int(os.getenv('WECOM_SYNC_JOB_TTL', 86400))
+# 逐部门拉取成员的默认并发数和上限（可按租户配置，见 tenant_sync_concurrency）
+SYNC_CONCURRENCY = int(os.getenv('WECOM_SYNC_CONCURRENCY', 4))
+SYNC_CONCURRENCY_MAX = int(os.getenv('WECOM_SYNC_CONCURRENCY_MAX', 16))
+
+# 可以从检查点继续的状态
+RESUMABLE_STATUSES = ('queued', 'running', 'failed')
+# 持有锁时视为进行中的状态
+ACTIVE_STATUSES = ('queued', 'running')
+
+# 值等于 ARGV[1] 时续期；等于 ARGV[3]（创建任务时占的锁）时接管；否则仅在不存在时获取
+ACQUIRE_LOCK_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if current == false or (ARGV[3] ~= '' and current == ARGV[3]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_acquire_script = redis_client.register_script(ACQUIRE_LOCK_SCRIPT)
+_release_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+
+class SyncLockLost(Exception):
+    """同步锁已过期并被其他任务获取"""
+
+
+RUNNING_KEY = f'{CACHE_PREFIX}:sync:running'
+
+
+def lock_key(tenant_id):
+    return f'{CACHE_PREFIX}:sync:lock:{tenant_id}'
+
+
+def job_key(job_id):
+    return f'{CACHE_PREFIX}:sync:job:{job_id}'
+
+
+def tenant_job_key(tenant_id):
+    return f'{CACHE_PREFIX}:sync:tenant:{tenant_id}'
+
+
+def acquire_sync_lock(tenant_id, owner, takeover=''):
+    """获取或续期租户同步锁；takeover 为创建任务时占锁的值，Worker 用它接管锁"""
+    return bool(_acquire_script(keys=[lock_key(tenant_id)], args=[owner, SYNC_LOCK_TTL * 1000, takeover],
+                                client=redis_client))
+
+
+def lock_owner_job(tenant_id):
+    """当前持有锁的 job_id"""
+    owner = redis_client.get(lock_key(tenant_id))
+    return owner.split(':', 1)[0] if owner else None
+
+
+def release_sync_lock(tenant_id, owner):
+    try:
+        _release_script(keys=[lock_key(tenant_id)], args=[owner], client=redis_client)
+    except Exception as e:
+        logger.error(f'release sync lock error: {e}')
+
+
+def get_job(job_id):
+    """任务进度，不存在时返回None"""
+    data = redis_client.hgetall(job_key(job_id))
+    if not data:
+        return None
+    job = {'job_id': job_id}
+    for field, value in data.items():
+        job[field] = int(value) if value.lstrip('-').isdigit() else value
+    return job
+
+
+def update_job(job_id, **fields):
+    key = job_key(job_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={field: value for field, value in fields.items() if value is not None})
+    pipe.expire(key, SYNC_JOB_TTL)
+    pipe.execute()
+
+
+def create_job(tenant_id, mode=None, trigger='manual'):
+    """
+    创建（或恢复）租户的同步任务
+    trigger: manual（管理员发起）/ scheduled（定时校正，见 sync_scheduler）
+    返回 (job, created)：已有任务排队或正在运行时返回该任务和 False；
+    上次任务未完成且锁已释放（Worker被杀、投递丢失、失败）时沿用其 job_id，从检查点继续
+    """
+    # 锁的值等于上次的 job_id 时获取锁会走续期分支，须先按任务状态判断是否进行中
+    running_id = lock_owner_job(tenant_id)
+    running = get_job(running_id) if running_id else None
+    if running and running.get('status') in ACTIVE_STATUSES:
+        return running, False
+
+    previous_id = redis_client.get(tenant_job_key(tenant_id))
+    previous = get_job(previous_id) if previous_id else None
+    if previous and previous.get('status') in RESUMABLE_STATUSES:
+        job_id = previous_id
+    else:
+        job_id = uuid.uuid4().hex
+
+    if not acquire_sync_lock(tenant_id, job_id):
+        running_id = lock_owner_job(tenant_id)
+        return get_job(running_id) if running_id else None, False
+
+    resumed = job_id == previous_id
+    update_job(job_id, tenant_id=tenant_id, status='queued', error='', trigger=trigger,
+               mode=mode or '', created_at=datetime.now().isoformat())
+    # 排队和执行中的任务都计入并发（定时调度按此限流）
+    redis_client.zadd(RUNNING_KEY, {tenant_id: time.time()})
+    if resumed:
+        redis_client.hincrby(job_key(job_id), 'resumed', 1)
+    redis_client.set(tenant_job_key(tenant_id), job_id, ex=SYNC_JOB_TTL)
+    incr_stat('member_sync', 'resumed' if resumed else 'created')
+    return get_job(job_id), True
+
+
+def enqueue_job(job_id):
+    """投递到同步队列；未开启异步或投递失败时在当前进程执行"""
+    if current_app.config.get('WECOM_EVENT_ASYNC'):
+        try:
+            send_task('wecom.sync_members', args=[job_id], queue=current_app.config['WECOM_SYNC_QUEUE'])
+            return get_job(job_id)
+        except Exception as e:
+            logger.error(f'enqueue member sync failed, run inline: {e}')
+    return run_sync_job(job_id)
+
+
+def record_checkpoint(job_id, dept_id, written_userids, fetched, stats_delta):
+    """部门写入并提交后记录检查点和进度"""
+    key = job_key(job_id)
+    pipe = redis_client.pipeline()
+    pipe.sadd(f'{key}:done', dept_id)
+    if written_userids:
+        pipe.sadd(f'{key}:users', *written_userids)
+    pipe.hincrby(key, 'departments_done', 1)
+    pipe.hincrby(key, 'users_fetched', fetched)
+    pipe.hincrby(key, 'users_synced', len(written_userids))
+    for field, value in stats_delta.items():
+        if value:
+            pipe.hincrby(key, field, value)
+    pipe.hset(key, 'updated_at', datetime.now().isoformat())
+    for suffix in ('', ':done', ':users'):
+        pipe.expire(f'{key}{suffix}', SYNC_JOB_TTL)
+    pipe.execute()
+
+
+def tenant_sync_concurrency(tenant):
+    """
+    拉取部门成员的并发数：租户配置 member_sync.concurrency，未配置时用 WECOM_SYNC_CONCURRENCY
+    上限 WECOM_SYNC_CONCURRENCY_MAX；实际调用频率仍受 rate_limit 的企业令牌桶约束
+    实际线程数不超过待拉取的部门数，crawl 模式只有根部门可拉取，基本没有并发
+    """
+    try:
+        value = json.loads(tenant.config or '{}').get('member_sync', {}).get('concurrency')
+        value = int(value) if value else SYNC_CONCURRENCY
+    except (TypeError, ValueError, AttributeError):
+        value = SYNC_CONCURRENCY
+    return max(1, min(value, SYNC_CONCURRENCY_MAX))
+
+
+def write_department(job_id, member_sync, dept_id, userlist, dept_names, open_userids=None):
+    """
+    写入一个部门拉取到的成员（跳过已写入的），提交后记录检查点
+    大部门按 MemberSync 的块分批提交，每块写入前由 member_sync.before_write 续期同步锁
+    open_userids：{userid: open_userid}，用于匹配 OAuth 先创建的成员（user/list 已返回 open_userid 的不覆盖）
+    """
+    open_userids = open_userids or {}
+    before = dict(member_sync.stats)
+    written = []
+    for user_info in userlist:
+        userid = user_info.get('userid')
+        if not userid or userid in member_sync.synced_userids:
+            continue
+        if not user_info.get('open_userid') and userid in open_userids:
+            user_info = dict(user_info, open_userid=open_userids[userid])
+        member_sync.add(user_info, resolve_department_name(user_info, dept_names, dept_id))
+        written.append(userid)
+    member_sync.flush()
+    delta = {field: member_sync.stats[field] - before[field] for field in ('created', 'updated', 'unchanged')}
+    record_checkpoint(job_id, dept_id, written, len(userlist), delta)
+
+
+def run_sync_job(job_id):
+    """
+    执行同步任务（Celery Worker 或请求内降级执行），返回最终进度
+    已完成的部门和已写入的成员直接跳过；锁被其他任务取得时放弃
+    """
+    from .routes.wecom import call_with_corp_token
+    from .wecom_client import wecom_client, WeComAPIError
+
+    job = get_job(job_id)
+    if not job:
+        logger.error(f'member sync job not found: {job_id}')
+        return None
+    if job.get('status') == 'done':
+        return job
+
+    tenant_id = job['tenant_id']
+    owner = f'{job_id}:{uuid.uuid4().hex[:8]}'
+    if not acquire_sync_lock(tenant_id, owner, takeover=job_id):
+        # 同一任务被重复投递（另一个Worker正在执行）时不改状态
+        if lock_owner_job(tenant_id) != job_id:
+            update_job(job_id, status='failed', error='另一个同步任务正在进行')
+        return get_job(job_id)
+
+    key = job_key(job_id)
+    started_at, started = datetime.now(), time.monotonic()
+    try:
+        tenant = Tenant.query.get(tenant_id)
+        if not tenant or not tenant.permanent_code:
+            raise RuntimeError('企业不存在或授权信息不完整')
+        update_job(job_id, status='running', started_at=job.get('started_at') or datetime.now().isoformat())
+
+        corp_id = tenant.corp_id
+        # 部门列表请求顺带校验token：被企微拒绝（40014/42001）时刷新一次，后续拉取成员沿用有效的token
+        fetched = call_with_corp_token(corp_id, tenant.permanent_code, lambda token: (
+            token, wecom_client.department_list(token, corp_id=corp_id)))
+        if not fetched:
+            raise RuntimeError('获取企业access_token失败')
+        access_token, departments = fetched
+        sync_departments(tenant_id, departments)
+        db.session.commit()
+
+        dept_names = {department.get('id'): department.get('name') for department in departments}
+        targets, fetch_child = sync_targets(departments, job.get('mode') or None)
+        done = {int(dept_id) for dept_id in redis_client.smembers(f'{key}:done')}
+        def renew_lock():
+            if not acquire_sync_lock(tenant_id, owner):
+                raise SyncLockLost(f'sync lock of tenant {tenant_id} taken by another job')
+
+        member_sync = MemberSync(tenant_id, synced_userids=redis_client.smembers(f'{key}:users'),
+                                 before_write=renew_lock)
+        update_job(job_id, departments_total=len(targets))
+        logger.info(f'member sync {job_id}: tenant={tenant_id}, targets={len(targets)}, resume_from={len(done)}')
+
+        def fetch(dept_id):
+            try:
+                return dept_id, wecom_client.user_list(access_token, dept_id, fetch_child=fetch_child,
+                                                       corp_id=corp_id), None
+            except (WeComAPIError, requests.RequestException) as exc:
+                # 超时等网络异常和接口报错一样只算本部门失败，不记检查点，恢复或下次同步时重新拉取
+                return dept_id, None, exc
+
+        # 拉取并发执行，写库和检查点只在当前线程（单一写入方），按完成顺序处理
+        # 线程数不超过待拉取的部门数（crawl 模式通常只有一个根部门）
+        pending = [dept_id for dept_id in targets if dept_id not in done]
+        concurrency = min(tenant_sync_concurrency(tenant), max(len(pending), 1))
+        update_job(job_id, concurrency=concurrency)
+        failed = []
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='member-sync') as pool:
+            futures = [pool.submit(fetch, dept_id) for dept_id in pending]
+            try:
+                for future in as_completed(futures):
+                    dept_id, userlist, error = future.result()
+                    renew_lock()
+                    if error is not None:
+                        logger.warning(f'member sync {job_id}: department {dept_id} failed: '
+                                       f'{getattr(error, "errmsg", error)}')
+                        failed.append(dept_id)
+                        continue
+                    # 本部门新出现的成员批量转换 open_userid（已保存的映射不再调用接口）
+                    open_userids = open_userids_for(
+                        tenant_id, [user_info.get('userid') for user_info in userlist
+                                    if not user_info.get('open_userid')
+                                    and user_info.get('userid') not in member_sync.synced_userids],
+                        access_token=access_token, corp_id=corp_id)
+                    write_department(job_id, member_sync, dept_id, userlist, dept_names, open_userids)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # 有部门拉取失败时不停用，失败的部门不记检查点，下次同步时重试
+        stats = member_sync.finish(deactivate=not failed)
+        update_tenant_sync_time(tenant)
+        synced = redis_client.scard(f'{key}:users')
+        progress = get_job(job_id)
+        written = progress.get('created', 0) + progress.get('updated', 0)
+        update_job(job_id, status='done', finished_at=datetime.now().isoformat(),
+                   deactivated=stats['deactivated'], count=synced, written=written,
+                   failed_departments=json.dumps(failed),
+                   message=f'成功同步 {synced} 位成员（写入{written}，未变化{progress.get("unchanged", 0)}，'
+                           f'停用{stats["deactivated"]}）' +
+                           (f'，{len(failed)} 个部门拉取失败' if failed else ''))
+        redis_client.delete(f'{key}:done', f'{key}:users')
+        incr_stat('member_sync', 'done')
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f'member sync {job_id} failed: {e}')
+        update_job(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+        incr_stat('member_sync', 'failed')
+    finally:
+        release_sync_lock(tenant_id, owner)
+        redis_client.zrem(RUNNING_KEY, tenant_id)
+    job = get_job(job_id)
+    record_sync_run(job, started_at, int((time.monotonic() - started) * 1000))
+    return job
+
+
+def record_sync_run(job, started_at, duration_ms):
+    """记录本次执行的耗时和结果（member_sync_runs），失败不影响同步本身"""
+    try:
+        db.session.add(MemberSyncRun(
+            tenant_id=job['tenant_id'],
+            job_id=job['job_id'],
+            trigger=job.get('trigger') or 'manual',
+            status=job.get('status'),
+            started_at=started_at,
+            finished_at=datetime.now(),
+            duration_ms=duration_ms,
+            departments=job.get('departments_total'),
+            failed_departments=len(json.loads(job.get('failed_departments') or '[]')),
+            concurrency=job.get('concurrency'),
+            users_synced=job.get('count', job.get('users_synced')),
+            written=job.get('written'),
+            unchanged=job.get('unchanged', 0),
+            deactivated=job.get('deactivated'),
+            error=(job.get('error') or '')[:512] or None,
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'record member sync run failed: {e}')
+
+
+def update_tenant_sync_time(tenant):
+    """租户配置中记录最近一次同步时间"""
+    try:
+        config = json.loads(tenant.config or '{}')
+        config.setdefault('workspace', {})['last_member_sync'] = datetime.now().isoformat()
+        tenant.config = json.dumps(config, ensure_ascii=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'update last_member_sync failed: {e}')
@@ -0,0 +1,109 @@
+"""
+通讯录定时校正同步的调度
+change_contact 回调负责日常增量更新，定时全量同步只用来校正遗漏；调度原则：
+- 每个租户每 WECOM_SYNC_RECONCILE_INTERVAL 秒同步一次，开始时间按租户ID打散到整个周期内，
+  不会所有租户在同一时刻开始
+- 同时排队/执行的同步任务数有全局上限，并可按套餐（tenant.plan）单独限制
+- 最近收到过 change_contact 回调的租户数据本来就较新，排在安静租户之后
+- 到期但本轮没有名额的租户留到下一轮（beat 每 WECOM_SYNC_SCHEDULE_INTERVAL 秒扫描一次）
+"""
+import logging
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy import func
+
+from .cache import CACHE_PREFIX, redis_client
+from .models import db, MemberSyncRun
+from .sync_jobs import RUNNING_KEY, lock_key
+
+logger = logging.getLogger(__name__)
+
+CONTACT_ACTIVITY_KEY = f'{CACHE_PREFIX}:sync:contact_activity'
+
+
+def note_contact_activity(tenant_id):
+    """收到 change_contact 回调时记录（调度时降低该租户的优先级）"""
+    try:
+        redis_client.zadd(CONTACT_ACTIVITY_KEY, {tenant_id: time.time()})
+    except Exception as e:
+        logger.error(f'note contact activity error: {e}')
+
+
+def parse_plan_limits(text):
+    """'free:1,trial:1,pro:4' -> {'free': 1, 'trial': 1, 'pro': 4}"""
+    limits = {}
+    for part in (text or '').split(','):
+        plan, _, value = part.partition(':')
+        if plan.strip() and value.strip().isdigit():
+            limits[plan.strip()] = int(value)
+    return limits
+
+
+def current_slot(tenant_id, interval, now):
+    """租户本周期的计划开始时间：周期内的偏移量由租户ID决定，各租户均匀分布"""
+    offset = zlib.crc32(str(tenant_id).encode('ascii')) % interval
+    return now - ((now - offset) % interval)
+
+
+def running_tenants():
+    """排队/执行中的租户；锁已不存在的（Worker崩溃、任务丢失）从集合中清除"""
+    tenant_ids = [int(tenant_id) for tenant_id in redis_client.zrange(RUNNING_KEY, 0, -1)]
+    if not tenant_ids:
+        return set()
+    pipe = redis_client.pipeline()
+    for tenant_id in tenant_ids:
+        pipe.exists(lock_key(tenant_id))
+    alive = pipe.execute()
+    stale = [tenant_id for tenant_id, exists in zip(tenant_ids, alive) if not exists]
+    if stale:
+        redis_client.zrem(RUNNING_KEY, *stale)
+    return {tenant_id for tenant_id, exists in zip(tenant_ids, alive) if exists}
+
+
+def last_sync_started():
+    """各租户最近一次同步的开始时间（手动同步也算）"""
+    rows = db.session.query(MemberSyncRun.tenant_id, func.max(MemberSyncRun.started_at)) \
+        .group_by(MemberSyncRun.tenant_id).all()
+    return {tenant_id: started_at.timestamp() for tenant_id, started_at in rows if started_at}
+
+
+def plan_member_syncs(tenants, interval, max_concurrent, plan_limits, active_window, now=None):
+    """
+    选出本轮要启动同步的租户
+    tenants: [(tenant_id, plan)]；返回按优先级排序的 tenant_id 列表
+    """
+    now = now or time.time()
+    running = running_tenants()
+    last_started = last_sync_started()
+    activity = {int(tenant_id): score for tenant_id, score in
+                redis_client.zrangebyscore(CONTACT_ACTIVITY_KEY, now - active_window, '+inf', withscores=True)}
+    redis_client.zremrangebyscore(CONTACT_ACTIVITY_KEY, '-inf', now - active_window)
+
+    plans = dict(tenants)
+    due = [tenant_id for tenant_id, _ in tenants
+           if tenant_id not in running and last_started.get(tenant_id, 0) < current_slot(tenant_id, interval, now)]
+    # 安静的租户优先，其次距上次同步最久的优先
+    due.sort(key=lambda tenant_id: (tenant_id in activity, last_started.get(tenant_id, 0)))
+
+    capacity = max_concurrent - len(running)
+    running_by_plan = {}
+    for tenant_id in running:
+        plan = plans.get(tenant_id)
+        running_by_plan[plan] = running_by_plan.get(plan, 0) + 1
+
+    selected = []
+    for tenant_id in due:
+        if len(selected) >= capacity:
+            break
+        plan = plans.get(tenant_id)
+        limit = plan_limits.get(plan)
+        if limit is not None and running_by_plan.get(plan, 0) >= limit:
+            continue
+        running_by_plan[plan] = running_by_plan.get(plan, 0) + 1
+        selected.append(tenant_id)
+
+    logger.info(f'member sync schedule at {datetime.fromtimestamp(now).isoformat()}: '
+                f'due={len(due)}, running={len(running)}, selected={len(selected)}, contact_active={len(activity)}')
+    return selected
@@ -0,0 +1,172 @@
+"""
+Celery 后台任务
+"""
+import random
+import time
+
+from celery.utils.log import get_task_logger
+from flask import current_app
+
+from .celery_app import celery
+from .cache import token_age_ratio, incr_stat
+from .models import Tenant
+from .wecom_events import latency_bucket
+
+logger = get_task_logger(__name__)
+
+
+def active_tenants_query():
+    """已授权且未取消的租户"""
+    return Tenant.query.filter(
+        Tenant.permanent_code.isnot(None),
+        Tenant.permanent_code != '',
+        Tenant.plan != 'cancelled'
+    )
+
+
+def token_needs_refresh(key, ratio):
+    """凭证不存在或已使用的有效期超过 ratio 时需要续期"""
+    age = token_age_ratio(key)
+    return age is None or age >= ratio
+
+
+def corp_credentials_to_refresh(corp_id, ratio):
+    """
+    需要续期的企业凭证
+    access_token 总是保持有效；jsapi_ticket 只续期曾经用过（已有缓存）的企业
+    """
+    names = []
+    if token_needs_refresh(f'corp_access_token:{corp_id}', ratio):
+        names.append('corp_access_token')
+    for name in ('jsapi_ticket', 'agent_ticket'):
+        age = token_age_ratio(f'{name}:{corp_id}')
+        if age is not None and age >= ratio:
+            names.append(name)
+    return names
+
+
+@celery.task(name='wecom.refresh_tokens')
+def refresh_tokens():
+    """
+    定时扫描：提前续期 suite_access_token 和各租户的企业 access_token
+    企业token的续期拆分为单独任务，并加随机延迟，避免所有租户在同一秒请求qyapi
+    """
+    from .routes.wecom import get_suite_access_token
+
+    ratio = current_app.config['WECOM_TOKEN_REFRESH_RATIO']
+    jitter = current_app.config['WECOM_TOKEN_REFRESH_JITTER']
+
+    if token_needs_refresh('suite_access_token', ratio):
+        if not get_suite_access_token(force_refresh=True):
+            logger.error('refresh suite_access_token failed, skip corp tokens')
+            return {'scheduled': 0}
+
+    scheduled = 0
+    rows = active_tenants_query().with_entities(Tenant.id, Tenant.corp_id).all()
+    for tenant_id, corp_id in rows:
+        if not corp_credentials_to_refresh(corp_id, ratio):
+            continue
+        refresh_corp_token.apply_async(args=[tenant_id], countdown=random.uniform(0, jitter))
+        scheduled += 1
+
+    logger.info(f'refresh_tokens: {scheduled}/{len(rows)} tenants scheduled')
+    return {'scheduled': scheduled}
+
+
+@celery.task(name='wecom.refresh_corp_token')
+def refresh_corp_token(tenant_id):
+    """续期单个租户的企业access_token / jsapi_ticket，写入共享Redis缓存"""
+    from .routes.wecom import get_corp_access_token, get_jsapi_ticket
+
+    tenant = Tenant.query.get(tenant_id)
+    if not tenant or not tenant.permanent_code or tenant.plan == 'cancelled':
+        return False
+    ratio = current_app.config['WECOM_TOKEN_REFRESH_RATIO']
+    # 延迟执行期间可能已被其它Worker或用户请求刷新
+    names = corp_credentials_to_refresh(tenant.corp_id, ratio)
+    ok = True
+    if 'corp_access_token' in names:
+        if not get_corp_access_token(tenant.corp_id, tenant.permanent_code, force_refresh=True):
+            logger.error(f'refresh corp token failed: tenant_id={tenant_id}, corp_id={tenant.corp_id}')
+            return False
+    for name, ticket_type in (('jsapi_ticket', 'corp'), ('agent_ticket', 'agent')):
+        if name in names and not get_jsapi_ticket(tenant.corp_id, tenant.permanent_code,
+                                                  ticket_type=ticket_type, force_refresh=True):
+            logger.error(f'refresh {name} failed: tenant_id={tenant_id}, corp_id={tenant.corp_id}')
+            ok = False
+    return ok
+
+
+@celery.task(name='wecom.process_event', bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_wecom_event(self, xml_plaintext, source='callback', received_at=None, dedup_key=None):
+    """
+    处理回调接口入队的企微事件（已验签解密的明文XML）
+    处理函数出错时按 WECOM_EVENT_MAX_RETRIES 重试，重试用尽后任务失败并释放去重标记（企微重推时可重新处理）；
+    成功后去重标记改为已完成
+    """
+    from .routes.wecom import process_event, finish_event, release_event
+
+    if received_at and not self.request.retries:
+        lag_ms = int((time.time() - received_at) * 1000)
+        incr_stat('event_queue_lag', latency_bucket(lag_ms))
+        logger.info(f'wecom event from {source}: queue lag {lag_ms}ms')
+    try:
+        process_event(xml_plaintext, received_at)
+    except Exception as exc:
+        config = current_app.config
+        if self.request.retries < config['WECOM_EVENT_MAX_RETRIES']:
+            incr_stat('events', 'retried')
+            raise self.retry(exc=exc, countdown=config['WECOM_EVENT_RETRY_DELAY'] * (self.request.retries + 1))
+        incr_stat('events', 'failed')
+        logger.error(f'wecom event from {source} failed after {self.request.retries} retries: {exc}')
+        release_event(dedup_key)
+        raise
+    finish_event(dedup_key)
+    incr_stat('events', 'processed')
+
+
+@celery.task(name='wecom.drain_welcome_pushes')
+def drain_welcome_pushes():
+    """消费欢迎语推送队列（见 welcome_push）"""
+    from .welcome_push import drain_welcome_pushes as drain
+
+    return drain()
+
+
+@celery.task(name='wecom.sync_members', acks_late=True, reject_on_worker_lost=True)
+def sync_members(job_id):
+    """通讯录同步任务（见 sync_jobs）；Worker被杀后重新投递，从检查点继续"""
+    from .sync_jobs import run_sync_job
+
+    job = run_sync_job(job_id)
+    return job and job.get('status')
+
+
+@celery.task(name='wecom.schedule_member_syncs')
+def schedule_member_syncs():
+    """定时校正同步：按打散的时间、并发上限和回调活跃度选出租户，依次错开投递（见 sync_scheduler）"""
+    from .sync_jobs import create_job
+    from .sync_scheduler import plan_member_syncs, parse_plan_limits
+
+    config = current_app.config
+    if not config['WECOM_SYNC_SCHEDULE_ENABLED']:
+        return {'scheduled': 0}
+
+    tenants = active_tenants_query().with_entities(Tenant.id, Tenant.plan).all()
+    selected = plan_member_syncs(
+        tenants,
+        interval=config['WECOM_SYNC_RECONCILE_INTERVAL'],
+        max_concurrent=config['WECOM_SYNC_MAX_CONCURRENT'],
+        plan_limits=parse_plan_limits(config['WECOM_SYNC_PLAN_CONCURRENCY']),
+        active_window=config['WECOM_SYNC_CONTACT_ACTIVE_WINDOW'],
+    )
+    scheduled = 0
+    for tenant_id in selected:
+        job, created = create_job(tenant_id, trigger='scheduled')
+        if not created:
+            continue
+        sync_members.apply_async(args=[job['job_id']], countdown=scheduled * config['WECOM_SYNC_STAGGER'])
+        scheduled += 1
+
+    logger.info(f'schedule_member_syncs: {scheduled}/{len(tenants)} tenants scheduled')
+    return {'scheduled': scheduled}
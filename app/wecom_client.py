@@ -0,0 +1,242 @@
+"""
+企业微信 qyapi 客户端
+每个Worker进程复用一个带连接池的 requests.Session（keep-alive），避免每次调用都重新握手
+统一解析 errcode：errcode 非0 时抛出 WeComAPIError
+调用前经过 Redis 令牌桶限流（见 rate_limit），遇到 45009/45033 自动退避重试
+"""
+import hashlib
+import os
+import threading
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .rate_limit import RATE_LIMIT_ERRCODES, WECOM_RATE_LIMIT_ENABLED, RateLimiter
+
+WECOM_API_BASE = os.getenv('WECOM_API_BASE', 'https://qyapi.weixin.qq.com/cgi-bin').rstrip('/')
+WECOM_HTTP_POOL_SIZE = int(os.getenv('WECOM_HTTP_POOL_SIZE', 20))
+WECOM_HTTP_TIMEOUT = float(os.getenv('WECOM_HTTP_TIMEOUT', 5))
+WECOM_HTTP_CONNECT_TIMEOUT = float(os.getenv('WECOM_HTTP_CONNECT_TIMEOUT', 3))
+# 命中限流错误码后的最大重试次数
+WECOM_RATE_LIMIT_RETRIES = int(os.getenv('WECOM_RATE_LIMIT_RETRIES', 3))
+
+# access_token 无效 / 已过期（如被其它渠道重新获取），需要清除缓存后重新获取
+INVALID_TOKEN_ERRCODES = (40014, 42001)
+
+# 凭证类接口的返回：token + 有效期（秒）
+TokenResult = namedtuple('TokenResult', ['token', 'expires_in'])
+
+
+class WeComAPIError(Exception):
+    """企微接口返回 errcode != 0"""
+
+    def __init__(self, errcode, errmsg='', api=None, data=None):
+        self.errcode = errcode
+        self.errmsg = errmsg
+        self.api = api
+        self.data = data or {}
+        super().__init__(f'{api} errcode={errcode}, errmsg={errmsg}')
+
+
+class WeComClient:
+    """qyapi 客户端（进程内单例，见 wecom_client）"""
+
+    def __init__(self, base_url=WECOM_API_BASE, pool_size=WECOM_HTTP_POOL_SIZE,
+                 timeout=WECOM_HTTP_TIMEOUT, connect_timeout=WECOM_HTTP_CONNECT_TIMEOUT,
+                 limiter=None, rate_limit_retries=WECOM_RATE_LIMIT_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """按进程创建Session：gunicorn fork 后不复用父进程的连接"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    # 仅对建连失败重试，已发出的请求不重放
+                    retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    @staticmethod
+    def rate_scope(params, corp_id=None):
+        """
+        限流维度：服务商接口按 suite 计；企业接口按 corp_id 计
+        未显式传 corp_id 时用 access_token 的摘要代替（同一时刻每个企业只有一个有效token）
+        """
+        if corp_id:
+            return corp_id
+        params = params or {}
+        if 'suite_access_token' in params or 'access_token' not in params:
+            return 'suite'
+        return hashlib.sha1(str(params['access_token']).encode()).hexdigest()[:16]
+
+    def request(self, method, api, params=None, json=None, timeout=None, corp_id=None):
+        """
+        调用 qyapi 接口并解析 errcode
+        api: 相对路径，如 'service/get_corp_token'
+        corp_id: 限流维度（可选）
+        返回解析后的JSON；网络异常（requests.RequestException）原样抛出
+        """
+        scope = self.rate_scope(params, corp_id) if self.limiter else None
+        attempt = 0
+        while True:
+            if self.limiter and not self.limiter.acquire(scope, api):
+                raise WeComAPIError(45009, 'local rate limit wait timeout', api=api)
+            try:
+                data = self._send(method, api, params, json, timeout)
+            except WeComAPIError as e:
+                if not self.limiter or e.errcode not in RATE_LIMIT_ERRCODES or attempt >= self.rate_limit_retries:
+                    raise
+                # 进入惩罚期，下一次 acquire 会等待退避结束
+                self.limiter.penalize(scope, api)
+                attempt += 1
+                continue
+            if attempt:
+                self.limiter.reset(scope, api)
+            return data
+
+    def _send(self, method, api, params, json, timeout):
+        resp = self.session.request(
+            method,
+            f'{self.base_url}/{api}',
+            params=params,
+            json=json,
+            timeout=(self.connect_timeout, timeout or self.timeout)
+        )
+        try:
+            data = resp.json()
+        except ValueError:
+            raise WeComAPIError(-1, f'invalid response: HTTP {resp.status_code}', api=api)
+        errcode = data.get('errcode', 0)
+        if errcode:
+            raise WeComAPIError(errcode, data.get('errmsg', ''), api=api, data=data)
+        return data
+
+    def get(self, api, params=None, timeout=None, corp_id=None):
+        return self.request('GET', api, params=params, timeout=timeout, corp_id=corp_id)
+
+    def post(self, api, params=None, json=None, timeout=None, corp_id=None):
+        return self.request('POST', api, params=params, json=json, timeout=timeout, corp_id=corp_id)
+
+    # ------------------------------------------------------------
+    # 服务商凭证
+    # ------------------------------------------------------------
+
+    def get_suite_token(self, suite_id, suite_secret, suite_ticket):
+        data = self.post('service/get_suite_token', json={
+            'suite_id': suite_id,
+            'suite_secret': suite_secret,
+            'suite_ticket': suite_ticket
+        })
+        return TokenResult(data['suite_access_token'], int(data.get('expires_in', 7200)))
+
+    def get_pre_auth_code(self, suite_id, suite_access_token):
+        data = self.post('service/get_pre_auth_code',
+                         params={'suite_id': suite_id, 'suite_access_token': suite_access_token})
+        return TokenResult(data['pre_auth_code'], int(data.get('expires_in', 1200)))
+
+    def get_permanent_code(self, suite_access_token, auth_code):
+        return self.post('service/get_permanent_code', params={'access_token': suite_access_token},
+                         json={'auth_code': auth_code})
+
+    def get_auth_info(self, suite_access_token, corp_id, permanent_code):
+        return self.post('service/get_auth_info', params={'access_token': suite_access_token},
+                         json={'auth_corpid': corp_id, 'permanent_code': permanent_code})
+
+    def get_corp_token(self, suite_access_token, corp_id, permanent_code):
+        data = self.post('service/get_corp_token', params={'suite_access_token': suite_access_token},
+                         json={'auth_corpid': corp_id, 'permanent_code': permanent_code})
+        return TokenResult(data['access_token'], int(data.get('expires_in', 7200)))
+
+    # ------------------------------------------------------------
+    # 身份认证
+    # ------------------------------------------------------------
+
+    def auth_getuserinfo3rd(self, suite_access_token, code):
+        """service/auth/getuserinfo3rd：返回 corpid/userid/open_userid"""
+        return self.get('service/auth/getuserinfo3rd',
+                        params={'suite_access_token': suite_access_token, 'code': code})
+
+    def getuserinfo3rd(self, suite_access_token, code, timeout=10):
+        """service/getuserinfo3rd：返回 user_ticket（用于getuserdetail3rd）"""
+        return self.get('service/getuserinfo3rd',
+                        params={'suite_access_token': suite_access_token, 'code': code}, timeout=timeout)
+
+    def getuserdetail3rd(self, suite_access_token, user_ticket, timeout=10):
+        return self.post('service/getuserdetail3rd', params={'suite_access_token': suite_access_token},
+                         json={'user_ticket': user_ticket}, timeout=timeout)
+
+    def auth_getuserinfo(self, access_token, code):
+        return self.get('auth/getuserinfo', params={'access_token': access_token, 'code': code})
+
+    # ------------------------------------------------------------
+    # 通讯录 / 应用
+    # ------------------------------------------------------------
+
+    def get_user(self, access_token, userid):
+        return self.get('user/get', params={'access_token': access_token, 'userid': userid})
+
+    def department_list(self, access_token, department_id=None, timeout=10, corp_id=None):
+        params = {'access_token': access_token}
+        if department_id is not None:
+            params['id'] = department_id
+        return self.get('department/list', params=params, timeout=timeout,
+                        corp_id=corp_id).get('department', [])
+
+    def user_list(self, access_token, department_id, fetch_child=0, timeout=10, corp_id=None):
+        return self.get('user/list', params={
+            'access_token': access_token,
+            'department_id': department_id,
+            'fetch_child': fetch_child
+        }, timeout=timeout, corp_id=corp_id).get('userlist', [])
+
+    def userid_to_openuserid(self, access_token, userid_list, timeout=10, corp_id=None):
+        """batch/userid_to_openuserid：每次最多1000个，返回 open_userid_list / invalid_userid_list"""
+        return self.post('batch/userid_to_openuserid', params={'access_token': access_token},
+                         json={'userid_list': list(userid_list)}, timeout=timeout, corp_id=corp_id)
+
+    def get_admin_list(self, access_token):
+        return self.post('agent/get_admin_list', params={'access_token': access_token}).get('admin', [])
+
+    def get_jsapi_ticket(self, access_token):
+        data = self.get('get_jsapi_ticket', params={'access_token': access_token})
+        return TokenResult(data['ticket'], int(data.get('expires_in', 7200)))
+
+    def get_agent_ticket(self, access_token):
+        """应用的jsapi_ticket（wx.agentConfig 使用）"""
+        data = self.get('ticket/get', params={'access_token': access_token, 'type': 'agent_config'})
+        return TokenResult(data['ticket'], int(data.get('expires_in', 7200)))
+
+    # ------------------------------------------------------------
+    # 客户联系
+    # ------------------------------------------------------------
+
+    def send_welcome_msg(self, access_token, payload, timeout=10):
+        return self.post('externalcontact/send_welcome_msg', params={'access_token': access_token},
+                         json=payload, timeout=timeout)
+
+
+def _default_limiter():
+    if not WECOM_RATE_LIMIT_ENABLED:
+        return None
+    from .cache import redis_client
+    return RateLimiter(redis_client)
+
+
+wecom_client = WeComClient(limiter=_default_limiter())
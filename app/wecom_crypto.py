@@ -0,0 +1,163 @@
+"""
+企业微信回调加解密（WXBizMsgCrypt）
+密钥在构造时解码一次并完成AES轮密钥扩展（ECB对象无状态，可跨请求/线程复用），
+解密时用 ECB 解密整段密文后与前一块异或得到 CBC 明文，不再每次 AES.new
+签名比较使用 hmac.compare_digest（常量时间）
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from Crypto.Cipher import AES
+
+# 与官方 WXBizMsgCrypt 一致的错误码
+VALIDATE_SIGNATURE_ERROR = -40001
+PARSE_XML_ERROR = -40002
+COMPUTE_SIGNATURE_ERROR = -40003
+ILLEGAL_AES_KEY = -40004
+VALIDATE_RECEIVE_ID_ERROR = -40005
+ENCRYPT_AES_ERROR = -40006
+DECRYPT_AES_ERROR = -40007
+ILLEGAL_BUFFER = -40008
+
+BLOCK_SIZE = 32  # 企微使用 32 字节块的 PKCS#7 填充
+
+REPLY_TEMPLATE = (
+    '<xml><Encrypt><![CDATA[{encrypt}]]></Encrypt>'
+    '<MsgSignature><![CDATA[{signature}]]></MsgSignature>'
+    '<TimeStamp>{timestamp}</TimeStamp>'
+    '<Nonce><![CDATA[{nonce}]]></Nonce></xml>'
+)
+
+
+class WeComCryptoError(Exception):
+    """加解密/验签失败"""
+
+    def __init__(self, code, message=''):
+        self.code = code
+        super().__init__(f'{code}: {message}')
+
+
+class WXBizMsgCrypt:
+    """
+    回调消息加解密
+    receive_id: 加密时写入的接收方ID（第三方应用为suite_id）
+    """
+
+    def __init__(self, token, encoding_aes_key, receive_id=''):
+        try:
+            key = base64.b64decode(encoding_aes_key + '=')
+        except Exception:
+            raise WeComCryptoError(ILLEGAL_AES_KEY, 'invalid EncodingAESKey')
+        if len(key) != 32:
+            raise WeComCryptoError(ILLEGAL_AES_KEY, 'EncodingAESKey must decode to 32 bytes')
+        self.token = token
+        self.key = key
+        self.iv = key[:16]
+        self.receive_id = receive_id or ''
+        self._ecb = AES.new(key, AES.MODE_ECB)
+
+    # ------------------------------------------------------------
+    # 签名
+    # ------------------------------------------------------------
+
+    def signature(self, timestamp, nonce, encrypt):
+        try:
+            parts = sorted([self.token, str(timestamp), str(nonce), encrypt])
+            return hashlib.sha1(''.join(parts).encode('utf-8')).hexdigest()
+        except Exception as e:
+            raise WeComCryptoError(COMPUTE_SIGNATURE_ERROR, str(e))
+
+    def verify_signature(self, msg_signature, timestamp, nonce, encrypt):
+        """常量时间比较签名，返回bool"""
+        expected = self.signature(timestamp, nonce, encrypt)
+        return hmac.compare_digest(expected.encode('ascii'), (msg_signature or '').encode('ascii', 'ignore'))
+
+    # ------------------------------------------------------------
+    # 加解密
+    # ------------------------------------------------------------
+
+    def decrypt(self, encrypt, receive_ids=None):
+        """
+        解密 Encrypt 字段，返回 (明文, receive_id)
+        receive_ids: 可接受的接收方ID集合，为空时不校验
+        """
+        try:
+            data = base64.b64decode(encrypt)
+            if not data or len(data) % 16:
+                raise ValueError('ciphertext length must be a multiple of 16')
+            # CBC: P_i = D(C_i) xor C_{i-1}，C_0 为 IV
+            blocks = self._ecb.decrypt(data)
+            previous = self.iv + data[:-16]
+            decrypted = (int.from_bytes(blocks, 'big') ^ int.from_bytes(previous, 'big')).to_bytes(len(data), 'big')
+        except Exception as e:
+            raise WeComCryptoError(DECRYPT_AES_ERROR, str(e))
+
+        pad = decrypted[-1] if decrypted else 0
+        if pad < 1 or pad > BLOCK_SIZE:
+            raise WeComCryptoError(ILLEGAL_BUFFER, 'invalid padding')
+        content = decrypted[16:-pad]
+        if len(content) < 4:
+            raise WeComCryptoError(ILLEGAL_BUFFER, 'content too short')
+        msg_len = struct.unpack('!I', content[:4])[0]
+        if msg_len > len(content) - 4:
+            raise WeComCryptoError(ILLEGAL_BUFFER, 'invalid message length')
+        try:
+            msg = content[4:4 + msg_len].decode('utf-8')
+            receive_id = content[4 + msg_len:].decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise WeComCryptoError(ILLEGAL_BUFFER, str(e))
+
+        if receive_ids and receive_id not in receive_ids:
+            raise WeComCryptoError(VALIDATE_RECEIVE_ID_ERROR, f'unexpected receive_id {receive_id}')
+        return msg, receive_id
+
+    def encrypt(self, plaintext, receive_id=None):
+        """加密明文，返回 Encrypt 字段（base64）"""
+        receive_id = self.receive_id if receive_id is None else receive_id
+        try:
+            msg = plaintext.encode('utf-8')
+            body = os.urandom(16) + struct.pack('!I', len(msg)) + msg + receive_id.encode('utf-8')
+            pad = BLOCK_SIZE - len(body) % BLOCK_SIZE
+            body += bytes([pad]) * pad
+            return base64.b64encode(AES.new(self.key, AES.MODE_CBC, self.iv).encrypt(body)).decode('ascii')
+        except Exception as e:
+            raise WeComCryptoError(ENCRYPT_AES_ERROR, str(e))
+
+    # ------------------------------------------------------------
+    # 回调封装
+    # ------------------------------------------------------------
+
+    def decrypt_callback(self, msg_signature, timestamp, nonce, encrypt, receive_ids=None):
+        """验签并解密，返回 (明文, receive_id)"""
+        if not self.verify_signature(msg_signature, timestamp, nonce, encrypt):
+            raise WeComCryptoError(VALIDATE_SIGNATURE_ERROR, 'signature mismatch')
+        return self.decrypt(encrypt, receive_ids)
+
+    def encrypt_reply(self, plaintext, nonce=None, timestamp=None):
+        """生成被动回复的加密XML"""
+        timestamp = str(timestamp or int(time.time()))
+        nonce = nonce or str(struct.unpack('!I', os.urandom(4))[0])
+        encrypt = self.encrypt(plaintext)
+        return REPLY_TEMPLATE.format(
+            encrypt=encrypt,
+            signature=self.signature(timestamp, nonce, encrypt),
+            timestamp=timestamp,
+            nonce=nonce
+        )
+
+
+_engines = {}
+
+
+def get_crypto(token, encoding_aes_key, receive_id=''):
+    """按配置缓存的加解密实例（每个进程只解码一次密钥）"""
+    cache_key = (token, encoding_aes_key, receive_id)
+    engine = _engines.get(cache_key)
+    if engine is None:
+        engine = WXBizMsgCrypt(token, encoding_aes_key, receive_id)
+        _engines[cache_key] = engine
+    return engine
@@ -0,0 +1,124 @@
+"""
+企微回调事件分发表
+每种事件（InfoType，或 InfoType/ChangeType）注册一个处理函数，并声明：
+- inline=True：在回调请求内直接处理（只适合极轻量的事件，如 suite_ticket）
+- inline=False：投递到事件队列，由后台Worker处理
+每个事件类型单独统计调用次数、错误数和耗时分布（stats 分组 event_handlers / event_latency）
+"""
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+from .cache import incr_stat
+
+logger = logging.getLogger(__name__)
+
+# 处理耗时直方图的桶（毫秒）
+HANDLER_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class WeComEvent:
+    """解析后的回调事件"""
+
+    def __init__(self, root, xml_plaintext, received_at=None):
+        self.root = root
+        self.xml = xml_plaintext
+        self.info_type = root.findtext('InfoType') or root.findtext('Event')
+        self.change_type = root.findtext('ChangeType')
+        self.received_at = received_at or time.time()
+
+    @classmethod
+    def parse(cls, xml_plaintext, received_at=None):
+        """解析明文XML，格式错误返回None"""
+        try:
+            return cls(ET.fromstring(xml_plaintext), xml_plaintext, received_at)
+        except (ET.ParseError, TypeError):
+            return None
+
+    @property
+    def type_key(self):
+        """统计/路由使用的事件类型：InfoType 或 InfoType/ChangeType"""
+        if self.change_type:
+            return f'{self.info_type}/{self.change_type}'
+        return self.info_type or 'unknown'
+
+    def text(self, tag, default=None):
+        value = self.root.findtext(tag)
+        return default if value is None else value
+
+
+class EventHandler:
+    def __init__(self, key, func, inline):
+        self.key = key
+        self.func = func
+        self.inline = inline
+
+
+class EventRegistry:
+    """事件类型 -> 处理函数；先匹配 InfoType/ChangeType，再匹配 InfoType"""
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, *keys, inline=False):
+        """
+        装饰器：@events.register('change_external_contact/add_external_contact', inline=False)
+        同一个函数可以注册多个事件类型
+        """
+        def decorator(func):
+            for key in keys:
+                if key in self._handlers:
+                    raise ValueError(f'duplicate wecom event handler: {key}')
+                self._handlers[key] = EventHandler(key, func, inline)
+            return func
+        return decorator
+
+    def resolve(self, event):
+        if event.change_type:
+            handler = self._handlers.get(f'{event.info_type}/{event.change_type}')
+            if handler:
+                return handler
+        return self._handlers.get(event.info_type)
+
+    def is_inline(self, event):
+        handler = self.resolve(event)
+        return bool(handler and handler.inline)
+
+    def keys(self):
+        return sorted(self._handlers)
+
+    def dispatch(self, event):
+        """
+        调用事件对应的处理函数并记录指标
+        返回处理函数的返回值，没有处理函数时返回None
+        处理出错时记录错误数后继续抛出：请求内处理时回调返回失败由企微重推，Worker中由任务重试
+        """
+        handler = self.resolve(event)
+        type_key = event.type_key
+        if not handler:
+            incr_stat('event_handlers', f'{type_key}:unhandled')
+            logger.info(f'unhandled wecom event: {type_key}')
+            return None
+
+        started = time.perf_counter()
+        try:
+            return handler.func(event)
+        except Exception as e:
+            incr_stat('event_handlers', f'{type_key}:error')
+            logger.exception(f'wecom event handler {handler.key} failed for {type_key}: {e}')
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            incr_stat('event_handlers', f'{type_key}:count')
+            incr_stat('event_handlers', f'{type_key}:total_ms', int(round(elapsed_ms)))
+            incr_stat('event_latency', f'{type_key}:{latency_bucket(elapsed_ms)}')
+
+
+def latency_bucket(latency_ms):
+    for bound in HANDLER_LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f'le_{bound}'
+    return 'le_inf'
+
+
+events = EventRegistry()
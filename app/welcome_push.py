@@ -0,0 +1,186 @@
+"""
+欢迎语（名片推送）流水线
+
+WelcomeCode 只在添加客户后的短时间内有效，排队时间直接决定推送能否成功：
+- 待推送任务放在 Redis 有序集合中，按回调接收时间排序，最早收到（最接近过期）的先推
+- 每个企业同时推送的数量有上限，避免一个大企业占满Worker（名额按任务占用，超时自动回收）
+- 已超过有效期的任务直接丢弃，不再调用 send_welcome_msg
+- 从回调接收到推送成功的端到端耗时记录为直方图（stats 分组 welcome_latency）
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+from flask import current_app
+
+from .cache import CACHE_PREFIX, redis_client, incr_stat
+from .celery_client import send_task
+
+logger = logging.getLogger(__name__)
+
+# WelcomeCode 有效期（秒），企微文档为20秒
+WELCOME_CODE_TTL = float(os.getenv('WECOM_WELCOME_CODE_TTL', 20))
+# 每个企业同时进行的推送数上限
+WELCOME_CORP_CONCURRENCY = int(os.getenv('WECOM_WELCOME_CORP_CONCURRENCY', 4))
+# 每次从队首取多少个候选任务挑选可执行的（跳过已达并发上限的企业）
+WELCOME_SCAN_SIZE = 50
+# 端到端耗时直方图的桶（毫秒）
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 20000)
+
+QUEUE_KEY = f'{CACHE_PREFIX}:welcome:queue'
+# 推送名额的最长占用时间（秒），超过后视为Worker已退出、名额回收
+SLOT_TTL = WELCOME_CODE_TTL * 2
+
+# KEYS[1] 企业推送中的任务集合；ARGV: job_id, now, 名额过期时间, 并发上限, 集合过期秒数
+ACQUIRE_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+_acquire_slot_script = redis_client.register_script(ACQUIRE_SLOT_SCRIPT)
+
+
+def latency_bucket(latency_ms):
+    """耗时所在的直方图桶：le_100 / le_250 / ... / le_inf"""
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f'le_{bound}'
+    return 'le_inf'
+
+
+def enqueue_welcome_push(corp_id, tenant_id, welcome_code, card_preview_url, card_title, received_at=None):
+    """加入推送队列并触发消费；Redis不可用时直接推送"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'corp_id': corp_id,
+        'tenant_id': tenant_id,
+        'welcome_code': welcome_code,
+        'card_preview_url': card_preview_url,
+        'card_title': card_title,
+        'received_at': received_at or time.time(),
+    }
+    try:
+        redis_client.zadd(QUEUE_KEY, {json.dumps(job, ensure_ascii=False): job['received_at']})
+    except Exception as e:
+        logger.error(f'enqueue welcome push failed, send directly: {e}')
+        return deliver(job)
+    incr_stat('welcome_push', 'enqueued')
+    schedule_drain()
+    return True
+
+
+def schedule_drain():
+    """投递一个消费任务到推送队列；未开启异步或投递失败时在当前进程消费"""
+    if current_app.config.get('WECOM_EVENT_ASYNC'):
+        try:
+            send_task(
+                'wecom.drain_welcome_pushes',
+                queue=current_app.config['WECOM_PUSH_QUEUE'],
+                retry_policy={'max_retries': 2, 'interval_start': 0, 'interval_step': 0.2, 'interval_max': 0.5}
+            )
+            return
+        except Exception as e:
+            logger.error(f'schedule welcome push drain failed, drain inline: {e}')
+    drain_welcome_pushes()
+
+
+def slot_key(corp_id):
+    return f'{CACHE_PREFIX}:welcome:inflight:{corp_id}'
+
+
+def acquire_slot(corp_id, job_id, now=None):
+    """
+    为任务占用企业的一个推送并发名额：名额是有序集合中的任务ID，分数为名额过期时间
+    计数前先清除已过期的名额，Worker异常退出没有释放的名额在 SLOT_TTL 秒后自动回收
+    """
+    now = now or time.time()
+    return bool(_acquire_slot_script(keys=[slot_key(corp_id)],
+                                     args=[job_id, now, now + SLOT_TTL, WELCOME_CORP_CONCURRENCY, int(SLOT_TTL) + 1],
+                                     client=redis_client))
+
+
+def release_slot(corp_id, job_id):
+    try:
+        redis_client.zrem(slot_key(corp_id), job_id)
+    except Exception as e:
+        logger.error(f'release welcome push slot error: {e}')
+
+
+def note_deferred(job):
+    """企业名额已满、任务留在队列中：每个任务只计一次（多个消费者会反复扫描到同一任务）"""
+    if redis_client.set(f'{CACHE_PREFIX}:welcome:deferred:{job["id"]}', 1, nx=True, ex=int(WELCOME_CODE_TTL) + 1):
+        incr_stat('welcome_push', 'deferred')
+
+
+def claim_next_job():
+    """
+    按接收时间从早到晚挑选下一个可执行的任务（ZREM 成功才算领取，多Worker不会重复推送）
+    过期任务顺手丢弃；已达并发上限的企业跳过，留给释放名额后的消费者
+    返回任务dict（已占用并发名额），没有可执行任务时返回None
+    """
+    candidates = redis_client.zrange(QUEUE_KEY, 0, WELCOME_SCAN_SIZE - 1)
+    now = time.time()
+    for member in candidates:
+        job = json.loads(member)
+        if now - job['received_at'] > WELCOME_CODE_TTL:
+            if redis_client.zrem(QUEUE_KEY, member):
+                incr_stat('welcome_push', 'expired')
+            continue
+        if not acquire_slot(job['corp_id'], job['id'], now):
+            note_deferred(job)
+            continue
+        if not redis_client.zrem(QUEUE_KEY, member):
+            release_slot(job['corp_id'], job['id'])
+            continue
+        return job
+    return None
+
+
+def drain_welcome_pushes():
+    """消费推送队列直到没有可执行的任务，返回本次推送的数量"""
+    delivered = 0
+    while True:
+        try:
+            job = claim_next_job()
+        except Exception as e:
+            logger.error(f'claim welcome push error: {e}')
+            break
+        if not job:
+            break
+        try:
+            deliver(job)
+            delivered += 1
+        finally:
+            release_slot(job['corp_id'], job['id'])
+    return delivered
+
+
+def deliver(job):
+    """发送欢迎语；企业token走缓存（未命中时才查库取permanent_code）"""
+    from .routes.wecom import send_welcome_message
+
+    if time.time() - job['received_at'] > WELCOME_CODE_TTL:
+        incr_stat('welcome_push', 'expired')
+        return False
+    success = send_welcome_message(
+        corp_id=job['corp_id'],
+        permanent_code=None,
+        welcome_code=job['welcome_code'],
+        card_preview_url=job['card_preview_url'],
+        card_title=job['card_title']
+    )
+    if not success:
+        incr_stat('welcome_push', 'failed')
+        return False
+    latency_ms = (time.time() - job['received_at']) * 1000
+    incr_stat('welcome_push', 'sent')
+    incr_stat('welcome_latency', latency_bucket(latency_ms))
+    logger.info(f'welcome push sent: corp_id={job["corp_id"]}, latency={latency_ms:.0f}ms')
+    return True
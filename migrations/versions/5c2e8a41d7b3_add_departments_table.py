@@ -0,0 +1,41 @@
+"""add departments table
+
+Revision ID: 5c2e8a41d7b3
+Revises: 991b15609084
+Create Date: 2026-10-18 10:12:04.512311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8a41d7b3'
+down_revision = '991b15609084'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('departments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('dept_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=256), nullable=True),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('order', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tenant_id', 'dept_id', name='uq_tenant_dept')
+    )
+    with op.batch_alter_table('departments', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_departments_tenant_id'), ['tenant_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('departments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_departments_tenant_id'))
+
+    op.drop_table('departments')
@@ -0,0 +1,26 @@
+"""add member sync fingerprint
+
+Revision ID: 8f1d3b6a9c20
+Revises: 5c2e8a41d7b3
+Create Date: 2026-10-18 14:36:51.208734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f1d3b6a9c20'
+down_revision = '5c2e8a41d7b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('members', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_fingerprint', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('members', schema=None) as batch_op:
+        batch_op.drop_column('sync_fingerprint')
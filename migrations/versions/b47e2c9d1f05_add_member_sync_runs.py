@@ -0,0 +1,50 @@
+"""add member sync runs
+
+Revision ID: b47e2c9d1f05
+Revises: 8f1d3b6a9c20
+Create Date: 2026-10-18 16:02:17.934410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47e2c9d1f05'
+down_revision = '8f1d3b6a9c20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('member_sync_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.String(length=32), nullable=False),
+    sa.Column('trigger', sa.String(length=16), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('duration_ms', sa.Integer(), nullable=True),
+    sa.Column('departments', sa.Integer(), nullable=True),
+    sa.Column('failed_departments', sa.Integer(), nullable=True),
+    sa.Column('concurrency', sa.Integer(), nullable=True),
+    sa.Column('users_synced', sa.Integer(), nullable=True),
+    sa.Column('written', sa.Integer(), nullable=True),
+    sa.Column('unchanged', sa.Integer(), nullable=True),
+    sa.Column('deactivated', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=512), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('member_sync_runs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_member_sync_runs_job_id'), ['job_id'], unique=False)
+        batch_op.create_index('idx_sync_run_tenant_started', ['tenant_id', 'started_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('member_sync_runs', schema=None) as batch_op:
+        batch_op.drop_index('idx_sync_run_tenant_started')
+        batch_op.drop_index(batch_op.f('ix_member_sync_runs_job_id'))
+
+    op.drop_table('member_sync_runs')
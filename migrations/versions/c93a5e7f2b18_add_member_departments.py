@@ -0,0 +1,38 @@
+"""add member departments
+
+Revision ID: c93a5e7f2b18
+Revises: b47e2c9d1f05
+Create Date: 2026-10-18 17:25:40.116902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93a5e7f2b18'
+down_revision = 'b47e2c9d1f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('member_departments',
+    sa.Column('member_id', sa.Integer(), nullable=False),
+    sa.Column('dept_id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('is_main', sa.Boolean(), nullable=True),
+    sa.Column('is_leader', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['member_id'], ['members.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('member_id', 'dept_id')
+    )
+    with op.batch_alter_table('member_departments', schema=None) as batch_op:
+        batch_op.create_index('idx_member_dept_tenant_dept', ['tenant_id', 'dept_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('member_departments', schema=None) as batch_op:
+        batch_op.drop_index('idx_member_dept_tenant_dept')
+
+    op.drop_table('member_departments')
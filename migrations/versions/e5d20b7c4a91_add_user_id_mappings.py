@@ -0,0 +1,39 @@
+"""add user id mappings
+
+Revision ID: e5d20b7c4a91
+Revises: c93a5e7f2b18
+Create Date: 2026-10-18 18:52:09.417235
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5d20b7c4a91'
+down_revision = 'c93a5e7f2b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_id_mappings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('userid', sa.String(length=128), nullable=False),
+    sa.Column('open_userid', sa.String(length=128), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tenant_id', 'userid', name='uq_idmap_tenant_userid')
+    )
+    with op.batch_alter_table('user_id_mappings', schema=None) as batch_op:
+        batch_op.create_index('idx_idmap_tenant_open_userid', ['tenant_id', 'open_userid'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_id_mappings', schema=None) as batch_op:
+        batch_op.drop_index('idx_idmap_tenant_open_userid')
+
+    op.drop_table('user_id_mappings')
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+/jssdk/signature 接口压测：统计延迟分位数（p50/p90/p99）
+
+用法：
+    python scripts/bench_jssdk_signature.py \
+        --base-url https://zjemail.cn --token <JWT> -n 2000 -c 20
+
+对比改造前后：分别对旧版本和新版本部署执行同样的参数，比较输出中的 p99。
+改造前每次请求都要调用 get_corp_token + get_jsapi_ticket，p99 约等于两次 qyapi 往返；
+改造后缓存命中时只做本地SHA1计算，p99 只剩 JWT 校验 + 一次 Redis 读取。
+
+本地对比（不访问企微）：启动 scripts/fake_qyapi.py（如 --tenants wwfake001:50:5 --latency-ms 50
+--latency-jitter-ms 20），两个版本都设置 WECOM_API_BASE 指向它，-c 1 时 p99 基本就是单次请求的开销；
+GET /fake/stats 可确认每次请求是否还在调用 get_jsapi_ticket。
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run(base_url, token, page_url, total, concurrency, agent):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    endpoint = f'{base_url.rstrip("/")}/api/v1/wecom/jssdk/signature'
+    params = {'url': page_url}
+    if agent:
+        params['agent'] = '1'
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            resp = session.get(endpoint, params=params, headers=headers, timeout=30)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(ms for ms, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': total / elapsed if elapsed else 0.0,
+        'mean': statistics.mean(latencies),
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/v1/wecom/jssdk/signature')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--token', required=True, help='工作台登录后获取的JWT')
+    parser.add_argument('--page-url', default='https://zjemail.cn/wecom/workspace')
+    parser.add_argument('-n', '--requests', type=int, default=1000)
+    parser.add_argument('-c', '--concurrency', type=int, default=10)
+    parser.add_argument('--agent', action='store_true', help='同时请求 agentConfig 签名')
+    args = parser.parse_args()
+
+    stats = run(args.base_url, args.token, args.page_url, args.requests, args.concurrency, args.agent)
+    print(f"requests={stats['requests']} errors={stats['errors']} rps={stats['rps']:.1f}")
+    print(f"latency ms: mean={stats['mean']:.2f} p50={stats['p50']:.2f} "
+          f"p90={stats['p90']:.2f} p99={stats['p99']:.2f} max={stats['max']:.2f}")
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
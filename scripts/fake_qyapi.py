@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+本地模拟企微 qyapi（压测 / CI 使用）
+
+实现本项目用到的接口：get_suite_token、get_corp_token、getuserinfo3rd、getuserdetail3rd、
+department/list、user/list、user/get、batch/userid_to_openuserid、agent/get_admin_list、get_jsapi_ticket、send_welcome_msg 等，
+支持配置延迟、错误率、频率限制和合成企业规模。
+
+启动：
+    python scripts/fake_qyapi.py --port 8900 --tenants wwfake001:5000:120,wwfake002:300:10 \
+        --latency-ms 80 --latency-jitter-ms 40 --error-rate 0.01
+
+应用侧指向模拟服务：
+    WECOM_API_BASE=http://127.0.0.1:8900/cgi-bin
+
+约定：
+- OAuth code 格式为 "<corp_id>:<userid>"，否则随机返回第一个企业的成员
+- 租户 permanent_code 任意，corp_id 需在 --tenants 中
+- GET /fake/stats 查看各接口调用次数；POST /fake/config 运行时调整延迟/错误率
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+SETTINGS = {
+    'latency_ms': 0.0,
+    'latency_jitter_ms': 0.0,
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'qps_per_corp': 0,
+}
+
+CORPS = {}
+CALLS = Counter()
+_calls_lock = threading.Lock()
+_token_seq = itertools.count(1)
+_qps_windows = {}
+_qps_lock = threading.Lock()
+
+
+class FakeCorp:
+    """合成企业：部门树 + 成员（约10%成员属于多个部门）"""
+
+    def __init__(self, corp_id, member_count, department_count, seed=0):
+        rnd = random.Random(f'{corp_id}:{seed}')
+        self.corp_id = corp_id
+        self.name = f'模拟企业{corp_id[-3:]}'
+        self.departments = [{'id': 1, 'name': self.name, 'parentid': 0, 'order': 100000000}]
+        for dept_id in range(2, department_count + 1):
+            parent = rnd.randint(1, dept_id - 1)
+            self.departments.append({
+                'id': dept_id,
+                'name': f'部门{dept_id}',
+                'parentid': parent,
+                'order': 100000000 - dept_id
+            })
+        self.children = {}
+        for dept in self.departments:
+            self.children.setdefault(dept['parentid'], []).append(dept['id'])
+
+        self.users = {}
+        self.dept_users = {dept['id']: [] for dept in self.departments}
+        for index in range(1, member_count + 1):
+            userid = f'user{index:05d}'
+            main_dept = rnd.randint(1, department_count)
+            depts = [main_dept]
+            if department_count > 1 and rnd.random() < 0.1:
+                extra = rnd.randint(1, department_count)
+                if extra != main_dept:
+                    depts.append(extra)
+            status = 1 if rnd.random() > 0.02 else rnd.choice([2, 4, 5])
+            self.users[userid] = {
+                'userid': userid,
+                'name': f'员工{index}',
+                'mobile': f'138{index:08d}',
+                'email': f'{userid}@{corp_id}.example.com',
+                'avatar': f'https://wework.qpic.cn/fake/{corp_id}/{userid}/0',
+                'position': rnd.choice(['工程师', '产品经理', '销售', '设计师', '运营']),
+                'department': depts,
+                'main_department': main_dept,
+                'status': status,
+                'isleader': 1 if index <= 3 else 0,
+            }
+            for dept_id in depts:
+                self.dept_users[dept_id].append(userid)
+        self.admins = [{'userid': f'user{i:05d}', 'auth_type': 1} for i in range(1, min(member_count, 3) + 1)]
+
+    def subtree(self, dept_id):
+        stack, result = [dept_id], []
+        while stack:
+            current = stack.pop()
+            result.append(current)
+            stack.extend(self.children.get(current, []))
+        return result
+
+
+def parse_tenants(spec):
+    """corp_id:members:departments[,corp_id:members:departments...]"""
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        parts = item.split(':')
+        corp_id = parts[0]
+        members = int(parts[1]) if len(parts) > 1 else 100
+        departments = int(parts[2]) if len(parts) > 2 else max(1, members // 50)
+        CORPS[corp_id] = FakeCorp(corp_id, members, departments)
+
+
+def new_token(kind, corp_id=''):
+    return f'fake-{kind}-{corp_id}-{next(_token_seq)}'
+
+
+def corp_from_token(token):
+    """fake-corp-<corp_id>-<seq>"""
+    if not token or not token.startswith('fake-corp-'):
+        return None
+    return CORPS.get(token[len('fake-corp-'):].rsplit('-', 1)[0])
+
+
+def ok(**data):
+    return jsonify({'errcode': 0, 'errmsg': 'ok', **data})
+
+
+def err(errcode, errmsg):
+    return jsonify({'errcode': errcode, 'errmsg': errmsg})
+
+
+def over_qps(key):
+    limit = SETTINGS['qps_per_corp']
+    if not limit:
+        return False
+    now = int(time.time())
+    with _qps_lock:
+        window, count = _qps_windows.get(key, (now, 0))
+        if window != now:
+            window, count = now, 0
+        count += 1
+        _qps_windows[key] = (window, count)
+    return count > limit
+
+
+@app.before_request
+def simulate_network():
+    if request.path.startswith('/fake/'):
+        return None
+    with _calls_lock:
+        CALLS[request.path] += 1
+    latency = SETTINGS['latency_ms'] + random.uniform(-1, 1) * SETTINGS['latency_jitter_ms']
+    if latency > 0:
+        time.sleep(latency / 1000.0)
+    if SETTINGS['error_rate'] and random.random() < SETTINGS['error_rate']:
+        return err(-1, 'system busy')
+    if SETTINGS['rate_limit_rate'] and random.random() < SETTINGS['rate_limit_rate']:
+        return err(45009, 'api freq out of limit')
+    corp = corp_from_token(request.args.get('access_token'))
+    if corp and over_qps(f'{corp.corp_id}:{request.path}'):
+        return err(45009, 'api freq out of limit')
+    return None
+
+
+def require_corp():
+    corp = corp_from_token(request.args.get('access_token'))
+    if not corp:
+        return None, err(40014, 'invalid access_token')
+    return corp, None
+
+
+# ------------------------------------------------------------
+# 服务商凭证
+# ------------------------------------------------------------
+
+@app.route('/cgi-bin/service/get_suite_token', methods=['POST'])
+def get_suite_token():
+    return jsonify({'suite_access_token': new_token('suite'), 'expires_in': 7200})
+
+
+@app.route('/cgi-bin/service/get_pre_auth_code', methods=['GET', 'POST'])
+def get_pre_auth_code():
+    return ok(pre_auth_code=new_token('preauth'), expires_in=1200)
+
+
+@app.route('/cgi-bin/service/get_permanent_code', methods=['POST'])
+def get_permanent_code():
+    corp = next(iter(CORPS.values()))
+    return ok(
+        permanent_code=f'fake-permanent-{corp.corp_id}',
+        auth_corp_info={'corpid': corp.corp_id, 'corp_name': corp.name},
+        auth_info={'agent': [{'agentid': 1000002, 'privilege': {'allow_user': list(corp.users)[:200]}}]},
+        auth_user_info={'userid': 'user00001'}
+    )
+
+
+@app.route('/cgi-bin/service/get_auth_info', methods=['POST'])
+def get_auth_info():
+    corp = CORPS.get((request.get_json(silent=True) or {}).get('auth_corpid'))
+    if not corp:
+        return err(40001, 'invalid auth_corpid')
+    return ok(auth_corp_info={'corpid': corp.corp_id, 'corp_name': corp.name})
+
+
+@app.route('/cgi-bin/service/get_corp_token', methods=['POST'])
+def get_corp_token():
+    corp = CORPS.get((request.get_json(silent=True) or {}).get('auth_corpid'))
+    if not corp:
+        return err(40001, 'invalid auth_corpid')
+    return jsonify({'access_token': new_token('corp', corp.corp_id), 'expires_in': 7200})
+
+
+# ------------------------------------------------------------
+# 身份认证
+# ------------------------------------------------------------
+
+def resolve_code(code):
+    if code and ':' in code:
+        corp_id, userid = code.split(':', 1)
+        corp = CORPS.get(corp_id)
+        if corp and userid in corp.users:
+            return corp, userid
+    corp = next(iter(CORPS.values()))
+    return corp, random.choice(list(corp.users))
+
+
+@app.route('/cgi-bin/service/auth/getuserinfo3rd', methods=['GET'])
+@app.route('/cgi-bin/service/getuserinfo3rd', methods=['GET'])
+def getuserinfo3rd():
+    corp, userid = resolve_code(request.args.get('code'))
+    return ok(
+        corpid=corp.corp_id,
+        CorpId=corp.corp_id,
+        userid=userid,
+        UserId=userid,
+        open_userid=f'wo{corp.corp_id}{userid}',
+        user_ticket=f'fake-ticket-{corp.corp_id}-{userid}',
+        expires_in=1800
+    )
+
+
+@app.route('/cgi-bin/service/getuserdetail3rd', methods=['POST'])
+def getuserdetail3rd():
+    ticket = (request.get_json(silent=True) or {}).get('user_ticket', '')
+    corp_id, _, userid = ticket[len('fake-ticket-'):].rpartition('-')
+    corp = CORPS.get(corp_id) if ticket.startswith('fake-ticket-') else None
+    user = corp.users.get(userid) if corp else None
+    if not user:
+        return err(40107, 'invalid user_ticket')
+    return ok(
+        corpid=corp.corp_id,
+        userid=userid,
+        name=user['name'],
+        avatar=user['avatar'],
+        mobile=user['mobile'],
+        email=user['email'],
+        position=user['position'],
+        gender='1'
+    )
+
+
+@app.route('/cgi-bin/auth/getuserinfo', methods=['GET'])
+def auth_getuserinfo():
+    _, userid = resolve_code(request.args.get('code'))
+    return ok(userid=userid)
+
+
+# ------------------------------------------------------------
+# 通讯录 / 应用
+# ------------------------------------------------------------
+
+@app.route('/cgi-bin/department/list', methods=['GET'])
+def department_list():
+    corp, error = require_corp()
+    if error:
+        return error
+    dept_id = request.args.get('id', type=int)
+    if dept_id:
+        wanted = set(corp.subtree(dept_id))
+        return ok(department=[d for d in corp.departments if d['id'] in wanted])
+    return ok(department=corp.departments)
+
+
+@app.route('/cgi-bin/user/list', methods=['GET'])
+def user_list():
+    corp, error = require_corp()
+    if error:
+        return error
+    dept_id = request.args.get('department_id', type=int) or 1
+    if dept_id not in corp.dept_users:
+        return err(60003, 'department not found')
+    dept_ids = corp.subtree(dept_id) if request.args.get('fetch_child', type=int) else [dept_id]
+    seen, users = set(), []
+    for current in dept_ids:
+        for userid in corp.dept_users[current]:
+            if userid not in seen:
+                seen.add(userid)
+                users.append(corp.users[userid])
+    return ok(userlist=users)
+
+
+@app.route('/cgi-bin/user/get', methods=['GET'])
+def user_get():
+    corp, error = require_corp()
+    if error:
+        return error
+    user = corp.users.get(request.args.get('userid'))
+    if not user:
+        return err(60111, 'userid not found')
+    return ok(**user)
+
+
+@app.route('/cgi-bin/batch/userid_to_openuserid', methods=['POST'])
+def userid_to_openuserid():
+    corp, error = require_corp()
+    if error:
+        return error
+    userids = (request.get_json(silent=True) or {}).get('userid_list') or []
+    if len(userids) > 1000:
+        return err(40058, 'userid_list exceed 1000')
+    return ok(
+        open_userid_list=[{'userid': userid, 'open_userid': f'wo{corp.corp_id}{userid}'}
+                          for userid in userids if userid in corp.users],
+        invalid_userid_list=[userid for userid in userids if userid not in corp.users]
+    )
+
+
+@app.route('/cgi-bin/agent/get_admin_list', methods=['POST'])
+def get_admin_list():
+    corp, error = require_corp()
+    if error:
+        return error
+    return ok(admin=corp.admins)
+
+
+@app.route('/cgi-bin/get_jsapi_ticket', methods=['GET'])
+@app.route('/cgi-bin/ticket/get', methods=['GET'])
+def get_jsapi_ticket():
+    corp, error = require_corp()
+    if error:
+        return error
+    return ok(ticket=new_token('ticket', corp.corp_id), expires_in=7200)
+
+
+# ------------------------------------------------------------
+# 客户联系
+# ------------------------------------------------------------
+
+@app.route('/cgi-bin/externalcontact/send_welcome_msg', methods=['POST'])
+def send_welcome_msg():
+    corp, error = require_corp()
+    if error:
+        return error
+    if not (request.get_json(silent=True) or {}).get('welcome_code'):
+        return err(41051, 'welcome_code missing')
+    return ok()
+
+
+# ------------------------------------------------------------
+# 模拟服务自身的管理接口
+# ------------------------------------------------------------
+
+@app.route('/fake/stats', methods=['GET'])
+def fake_stats():
+    with _calls_lock:
+        calls = dict(CALLS)
+    return jsonify({
+        'settings': SETTINGS,
+        'calls': calls,
+        'total_calls': sum(calls.values()),
+        'tenants': {cid: {'members': len(c.users), 'departments': len(c.departments)} for cid, c in CORPS.items()}
+    })
+
+
+@app.route('/fake/config', methods=['POST'])
+def fake_config():
+    payload = request.get_json(silent=True) or {}
+    for key in SETTINGS:
+        if key in payload:
+            SETTINGS[key] = type(SETTINGS[key])(payload[key])
+    if payload.get('reset_stats'):
+        with _calls_lock:
+            CALLS.clear()
+    return jsonify({'settings': SETTINGS})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local fake WeCom qyapi server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--tenants', default='wwfake001:5000:120',
+                        help='corp_id:members:departments，多个用逗号分隔')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--latency-jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0, help='返回 errcode=-1 的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='随机返回 errcode=45009 的比例')
+    parser.add_argument('--qps-per-corp', type=int, default=0, help='每企业每接口每秒调用上限，0为不限制')
+    args = parser.parse_args()
+
+    SETTINGS.update({
+        'latency_ms': args.latency_ms,
+        'latency_jitter_ms': args.latency_jitter_ms,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'qps_per_corp': args.qps_per_corp,
+    })
+    parse_tenants(args.tenants)
+    print(f'fake qyapi: {len(CORPS)} tenants, listening on http://{args.host}:{args.port}/cgi-bin')
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
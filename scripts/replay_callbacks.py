@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+回放录制的企微回调（压测 / 复现回调风暴）
+
+录制：在应用环境变量中设置 WECOM_EVENT_RECORD_DIR=/tmp/wecom-recordings，
+      回调明文会写入 callbacks-<日期>-<pid>.jsonl.gz
+回放：
+    python scripts/replay_callbacks.py '/tmp/wecom-recordings/*.jsonl.gz' \
+        --base-url http://127.0.0.1:5001 --speed 10 -c 32
+
+每条记录用本地配置的 Token / EncodingAESKey 重新加密、签名后 POST 到 /callback 或 /command，
+走与线上完全相同的验签 -> 解密 -> 去重 -> 分发路径（重新加密后 Encrypt 不同，不会被去重拦截）。
+--speed N 按录制时的时间间隔 N 倍速发送，0 表示不等待、尽快发送。
+
+输出：
+- 回调应答：吞吐量、HTTP 应答耗时分位数
+- 队列延迟 / 处理函数耗时：从 /api/admin/cache-stats 的直方图（回放前后差值）估算分位数
+  （分位数为所在桶的上界；需要事件Worker在回放期间运行并等待队列排空）
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.event_recorder import iter_recorded  # noqa: E402
+from app.wecom_crypto import WXBizMsgCrypt  # noqa: E402
+
+ENDPOINTS = {
+    'callback': '/api/v1/wecom/callback',
+    'command': '/api/v1/wecom/command',
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def histogram_percentiles(buckets, pcts=(50, 90, 99)):
+    """buckets: {'le_100': n, ..., 'le_inf': n} -> {pct: '<=100ms'}（取所在桶的上界）"""
+    def bound(label):
+        return float('inf') if label == 'le_inf' else int(label[3:])
+
+    ordered = sorted(buckets.items(), key=lambda item: bound(item[0]))
+    total = sum(count for _, count in ordered)
+    result = {}
+    for pct in pcts:
+        result[pct] = '-'
+        cumulative = 0
+        for label, count in ordered:
+            cumulative += count
+            if total and cumulative >= total * pct / 100.0:
+                result[pct] = '=inf' if label == 'le_inf' else f'<={label[3:]}ms'
+                break
+    return result
+
+
+def fetch_stats(session, base_url):
+    try:
+        resp = session.get(f'{base_url}/api/admin/cache-stats', timeout=10)
+        return resp.json().get('stats', {})
+    except (requests.RequestException, ValueError):
+        return {}
+
+
+def diff_group(after, before, group):
+    old = before.get(group, {})
+    return {k: v - old.get(k, 0) for k, v in after.get(group, {}).items() if v - old.get(k, 0) > 0}
+
+
+def merge_handler_buckets(latency):
+    """event_latency 的字段为 <type>:<bucket>，合并所有事件类型"""
+    merged = Counter()
+    for field, count in latency.items():
+        merged[field.rsplit(':', 1)[1]] += count
+    return dict(merged)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded WeCom callbacks')
+    parser.add_argument('paths', nargs='+', help='录制文件，支持通配符')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--token', default=os.getenv('WECOM_TOKEN', ''))
+    parser.add_argument('--aes-key', default=os.getenv('WECOM_ENCODING_AES_KEY', ''))
+    parser.add_argument('--suite-id', default=os.getenv('WECOM_SUITE_ID', ''))
+    parser.add_argument('--speed', type=float, default=1.0, help='回放倍速，0为尽快发送')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=0, help='最多回放多少条，0为全部')
+    parser.add_argument('--drain-wait', type=float, default=5.0, help='发送完后等待Worker处理的秒数')
+    args = parser.parse_args()
+
+    if not args.token or not args.aes_key:
+        parser.error('需要 --token / --aes-key（或环境变量 WECOM_TOKEN / WECOM_ENCODING_AES_KEY）')
+
+    records = iter_recorded(args.paths)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print('no records')
+        return 1
+
+    crypto = WXBizMsgCrypt(args.token, args.aes_key, args.suite_id)
+    base_url = args.base_url.rstrip('/')
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+
+    def send(record):
+        timestamp, nonce = str(int(time.time())), os.urandom(6).hex()
+        encrypt = crypto.encrypt(record['xml'])
+        params = {'msg_signature': crypto.signature(timestamp, nonce, encrypt), 'timestamp': timestamp, 'nonce': nonce}
+        body = f'<xml><ToUserName><![CDATA[{args.suite_id}]]></ToUserName><Encrypt><![CDATA[{encrypt}]]></Encrypt></xml>'
+        url = base_url + ENDPOINTS.get(record.get('source'), ENDPOINTS['callback'])
+        started = time.perf_counter()
+        try:
+            status = session.post(url, params=params, data=body.encode('utf-8'), timeout=30).status_code
+        except requests.RequestException:
+            status = 'error'
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] += 1
+
+    before = fetch_stats(session, base_url)
+    first_ts = records[0]['ts']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record in records:
+            if args.speed > 0:
+                delay = (record['ts'] - first_ts) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, record)
+    elapsed = time.perf_counter() - started
+
+    if args.drain_wait > 0:
+        time.sleep(args.drain_wait)
+    after = fetch_stats(session, base_url)
+
+    latencies.sort()
+    span = records[-1]['ts'] - first_ts
+    print(f'records={len(records)} recorded_span={span:.1f}s replay_time={elapsed:.1f}s '
+          f'throughput={len(records) / elapsed if elapsed else 0:.1f} callbacks/s')
+    print(f'status: {dict(statuses)}')
+    print(f'ack latency ms: p50={percentile(latencies, 50):.1f} p90={percentile(latencies, 90):.1f} '
+          f'p99={percentile(latencies, 99):.1f} max={latencies[-1]:.1f}')
+
+    events = diff_group(after, before, 'events')
+    if events:
+        print(f'events: {events}')
+    lag = diff_group(after, before, 'event_queue_lag')
+    if lag:
+        pcts = histogram_percentiles(lag)
+        print(f'queue lag: p50{pcts[50]} p90{pcts[90]} p99{pcts[99]} (n={sum(lag.values())})')
+    handler = merge_handler_buckets(diff_group(after, before, 'event_latency'))
+    if handler:
+        pcts = histogram_percentiles(handler)
+        print(f'handler latency: p50{pcts[50]} p90{pcts[90]} p99{pcts[99]} (n={sum(handler.values())})')
+    errors = {k: v for k, v in diff_group(after, before, 'event_handlers').items() if k.endswith(':error')}
+    if errors:
+        print(f'handler errors: {errors}')
+    return 0 if set(statuses) == {200} else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import importlib
+import sys
+
+import fakeredis
+import pytest
+
+from app import cache
+from app.main import create_app, db as _db
+
+# 先导入所有持有 redis_client 引用的模块，fake_redis 才能替换到
+for _module in ('app.routes.wecom', 'app.sync_jobs', 'app.sync_scheduler', 'app.welcome_push', 'app.id_mapping'):
+    importlib.import_module(_module)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """把各模块引用的 redis_client 换成 fakeredis（关闭L1缓存，不启动失效订阅线程）"""
+    client = fakeredis.FakeRedis(decode_responses=True)
+    original = cache.redis_client
+    for name, module in list(sys.modules.items()):
+        if name.startswith('app') and getattr(module, 'redis_client', None) is original:
+            monkeypatch.setattr(module, 'redis_client', client)
+    monkeypatch.setattr(cache, 'CACHE_L1_ENABLED', False)
+    cache.local_cache.clear()
+    return client
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        yield app
+        _db.session.remove()
+
+
+@pytest.fixture
+def db(app):
+    """SQLite内存库，只建成员同步相关的表（全部表在SQLite上有重名索引）"""
+    from app.models import (
+        Tenant, Member, Department, MemberDepartment, MemberSyncRun, UserIdMapping,
+    )
+    tables = [model.__table__ for model in
+              (Tenant, Member, Department, MemberDepartment, MemberSyncRun, UserIdMapping)]
+    _db.metadata.create_all(bind=_db.engine, tables=tables)
+    yield _db
+    _db.session.rollback()
+    _db.metadata.drop_all(bind=_db.engine, tables=tables)
@@ -0,0 +1,136 @@
+import time
+
+from app.cache import LocalCache, _decode, _encode
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.set('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+
+
+def test_local_cache_never_outlives_redis_ttl():
+    cache = LocalCache(maxsize=10, ttl=60)
+    cache.set('token', 'abc', ttl=0.05)
+    assert cache.get('token') == (True, 'abc')
+    time.sleep(0.06)
+    assert cache.get('token') == (False, None)
+
+
+def test_values_roundtrip_as_python_objects():
+    assert _decode(_encode('plain-token')) == 'plain-token'
+    value = {'is_admin': True, 'role': '超级管理员'}
+    assert _decode(_encode(value)) == value
+
+
+def test_make_key_namespaces_parts():
+    from app.cache import make_key
+    assert make_key('card', 'member', 1, 42) == 'card:member:1:42'
+
+
+def test_single_flight_leader_loads_once_for_concurrent_followers(fake_redis):
+    import threading
+    from app.cache import get_stats, single_flight
+
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'member_id': 7}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight('sf:leader', loader, stat='sf_test')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'member_id': 7}] * 5
+    stats = get_stats('sf_test')
+    assert stats['miss'] == 1 and stats.get('coalesced', 0) + stats.get('hit', 0) == 4
+
+
+def test_single_flight_failed_load_is_not_cached(fake_redis):
+    from app.cache import single_flight
+
+    values = iter([None, {'member_id': 8}])
+    assert single_flight('sf:none', lambda: next(values)) is None
+    assert single_flight('sf:none', lambda: next(values)) == {'member_id': 8}
+    assert single_flight('sf:none', lambda: 1 / 0) == {'member_id': 8}
+
+
+def test_single_flight_lock_timeout_does_not_load(fake_redis):
+    from app.cache import CACHE_PREFIX, single_flight
+
+    held = fake_redis.lock(f'{CACHE_PREFIX}:lock:sf:busy', timeout=5)
+    assert held.acquire()
+    calls = []
+    assert single_flight('sf:busy', lambda: calls.append(1) or 1, wait_timeout=0.1) is None
+    assert calls == []
+    held.release()
+    assert single_flight('sf:busy', lambda: calls.append(1) or 1) == 1
+
+
+def test_get_or_refresh_single_flight(fake_redis):
+    import threading
+    from app.cache import get_or_refresh
+
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'token-1', 7200
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_or_refresh('gor:token', loader)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1] and results == ['token-1'] * 5
+    # 新鲜值提前 margin 秒过期，旧值备份和签发时间按实际有效期保留
+    assert 6800 < fake_redis.ttl('wecom:gor:token') <= 6900
+    assert fake_redis.ttl('wecom:gor:token:stale') > 7000
+    assert fake_redis.get('wecom:gor:token:issued').endswith(':7200')
+
+
+def test_get_or_refresh_falls_back_to_stale_when_refresh_fails(fake_redis):
+    from app.cache import delete_cache, get_or_refresh
+
+    assert get_or_refresh('gor:token', lambda: ('token-1', 7200)) == 'token-1'
+    delete_cache('gor:token')   # 新鲜值到期
+    assert get_or_refresh('gor:token', lambda: None) == 'token-1'
+    assert get_or_refresh('gor:token', lambda: ('token-2', 7200)) == 'token-2'
+    delete_cache('gor:token', 'gor:token:stale')
+    assert get_or_refresh('gor:token', lambda: None) is None
+
+
+def test_get_or_refresh_force_reloads_fresh_value(fake_redis):
+    from app.cache import get_or_refresh
+
+    assert get_or_refresh('gor:token', lambda: ('token-1', 7200)) == 'token-1'
+    assert get_or_refresh('gor:token', lambda: ('token-2', 7200)) == 'token-1'
+    assert get_or_refresh('gor:token', lambda: ('token-2', 7200), force=True) == 'token-2'
+    assert get_or_refresh('gor:token', lambda: 1 / 0) == 'token-2'
+
+
+def test_get_or_refresh_lock_timeout_reuses_stale(fake_redis):
+    from app.cache import CACHE_PREFIX, delete_cache, get_or_refresh
+
+    get_or_refresh('gor:token', lambda: ('token-1', 7200))
+    delete_cache('gor:token')
+    held = fake_redis.lock(f'{CACHE_PREFIX}:lock:gor:token', timeout=5)
+    assert held.acquire()
+    calls = []
+    assert get_or_refresh('gor:token', lambda: calls.append(1) or ('token-2', 7200), wait_timeout=0.1) == 'token-1'
+    assert calls == []
+    held.release()
@@ -0,0 +1,152 @@
+import pytest
+
+from app.card_cache import member_card_key
+from app.cache import get_many
+from app.contact_events import sync_departments
+from app.departments import load_departments
+from app.member_sync import MemberSync
+from app.models import Department, Member, MemberDepartment, Tenant
+from app.routes.card import load_card_data
+from app.routes.wecom import handle_contact_party, handle_contact_user
+from app.wecom_events import WeComEvent
+
+
+@pytest.fixture
+def tenant(db, fake_redis):
+    tenant = Tenant(corp_id='wwcontact', name='通讯录企业')
+    db.session.add(tenant)
+    db.session.commit()
+    return tenant
+
+
+def contact_event(change_type, **fields):
+    body = ''.join(f'<{tag}>{value}</{tag}>' for tag, value in fields.items())
+    return WeComEvent.parse(f'<xml><AuthCorpId>wwcontact</AuthCorpId><InfoType>change_contact</InfoType>'
+                            f'<ChangeType>{change_type}</ChangeType>{body}</xml>')
+
+
+def member(tenant, userid):
+    return Member.query.filter_by(tenant_id=tenant.id, userid=userid).first()
+
+
+def links(member_id):
+    return {(link.dept_id, link.is_main, link.is_leader)
+            for link in MemberDepartment.query.filter_by(member_id=member_id)}
+
+
+def create_departments():
+    handle_contact_party(contact_event('create_party', Id=1, Name='总部', ParentId=0, Order=100))
+    handle_contact_party(contact_event('create_party', Id=2, Name='研发', ParentId=1, Order=50))
+
+
+def test_create_user_with_departments(tenant):
+    create_departments()
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Mobile='138',
+                                      Department='1,2', MainDepartment=2, IsLeaderInDept='0,1', Status=1))
+    created = member(tenant, 'zhangsan')
+    assert (created.name, created.mobile, created.department) == ('张三', '138', '研发')
+    assert created.is_active and created.in_visible_range
+    assert links(created.id) == {(1, False, False), (2, True, True)}
+    counts = {department['id']: department['member_count'] for department in load_departments(tenant.id)}
+    assert counts == {1: 1, 2: 1}
+
+
+def test_update_user_applies_present_fields_only(tenant):
+    create_departments()
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Mobile='138',
+                                      Position='工程师', Department=2))
+    updated = member(tenant, 'zhangsan')
+    load_card_data(tenant.id, updated.id)
+
+    # 第三方应用收不到的字段（Mobile）不出现在回调中：保持原值；不带 Department 时保留所属部门
+    handle_contact_user(contact_event('update_user', UserID='zhangsan', Position='架构师', Status=5))
+    updated = member(tenant, 'zhangsan')
+    assert (updated.mobile, updated.position, updated.is_active) == ('138', '架构师', False)
+    assert links(updated.id) == {(2, True, False)}
+    assert not get_many([member_card_key(tenant.id, updated.id)])
+    assert load_card_data(tenant.id, updated.id)[0]['position'] == '架构师'
+
+
+def test_update_user_clears_sync_fingerprint(tenant):
+    sync = MemberSync(tenant.id)
+    sync.add({'userid': 'zhangsan', 'name': '张三', 'position': '工程师'}, '研发')
+    sync.finish()
+    assert member(tenant, 'zhangsan').sync_fingerprint
+
+    handle_contact_user(contact_event('update_user', UserID='zhangsan', Position='架构师'))
+    assert member(tenant, 'zhangsan').sync_fingerprint is None
+    # 下次全量同步按企微数据重新写入，而不是按指纹跳过
+    sync = MemberSync(tenant.id)
+    sync.add({'userid': 'zhangsan', 'name': '张三', 'position': '工程师'}, '研发')
+    assert sync.finish()['updated'] == 1
+    assert member(tenant, 'zhangsan').position == '工程师'
+
+
+def test_delete_user_deactivates_and_removes_links(tenant):
+    create_departments()
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Department=2))
+    member_id = member(tenant, 'zhangsan').id
+
+    handle_contact_user(contact_event('delete_user', UserID='zhangsan'))
+    deleted = member(tenant, 'zhangsan')
+    assert deleted.id == member_id and not deleted.is_active and not deleted.in_visible_range
+    assert links(member_id) == set()
+    counts = {department['id']: department['member_count'] for department in load_departments(tenant.id)}
+    assert counts == {1: 0, 2: 0}
+
+
+def test_new_userid_renames_member(tenant):
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三'))
+    member_id = member(tenant, 'zhangsan').id
+
+    handle_contact_user(contact_event('update_user', UserID='zhangsan', NewUserID='zhang.san'))
+    assert member(tenant, 'zhangsan') is None
+    assert member(tenant, 'zhang.san').id == member_id
+
+
+def test_new_userid_collision_keeps_both_members(tenant):
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三'))
+    handle_contact_user(contact_event('create_user', UserID='zhang.san', Name='另一个张三'))
+
+    handle_contact_user(contact_event('update_user', UserID='zhangsan', NewUserID='zhang.san', Position='经理'))
+    assert member(tenant, 'zhangsan').position == '经理'
+    assert member(tenant, 'zhang.san').name == '另一个张三'
+    assert Member.query.filter_by(tenant_id=tenant.id).count() == 2
+
+
+def test_party_rename_updates_member_department_names(tenant):
+    create_departments()
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Department=2))
+    handle_contact_user(contact_event('create_user', UserID='lisi', Name='李四', Department=1))
+
+    handle_contact_party(contact_event('update_party', Id=2, Name='平台研发'))
+    assert Department.query.filter_by(tenant_id=tenant.id, dept_id=2).one().parent_id == 1
+    assert member(tenant, 'zhangsan').department == '平台研发'
+    assert member(tenant, 'zhangsan').sync_fingerprint is None
+    assert member(tenant, 'lisi').department == '总部'
+    assert {department['id']: department['name'] for department in load_departments(tenant.id)} == \
+        {1: '总部', 2: '平台研发'}
+
+
+def test_party_delete_removes_department_and_links(tenant):
+    create_departments()
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Department='1,2'))
+
+    handle_contact_party(contact_event('delete_party', Id=2))
+    assert Department.query.filter_by(tenant_id=tenant.id).count() == 1
+    assert links(member(tenant, 'zhangsan').id) == {(1, True, False)}
+    assert [department['id'] for department in load_departments(tenant.id)] == [1]
+
+
+def test_full_sync_reconciles_departments(tenant, db):
+    create_departments()
+    handle_contact_party(contact_event('create_party', Id=3, Name='销售', ParentId=1))
+    handle_contact_user(contact_event('create_user', UserID='zhangsan', Name='张三', Department='3'))
+
+    sync_departments(tenant.id, [{'id': 1, 'name': '总部', 'parentid': 0, 'order': 1},
+                                 {'id': 2, 'name': '研发中心', 'parentid': 1, 'order': 2},
+                                 {'id': 4, 'name': '市场', 'parentid': 1}])
+    db.session.commit()
+    departments = Department.query.filter_by(tenant_id=tenant.id)
+    assert {department.dept_id: department.name for department in departments} == {1: '总部', 2: '研发中心', 4: '市场'}
+    assert links(member(tenant, 'zhangsan').id) == set()
@@ -0,0 +1,64 @@
+import pytest
+
+from app.cache import get_cache, set_cache
+from app.routes import wecom
+from app.wecom_client import TokenResult, WeComAPIError, wecom_client
+
+
+@pytest.fixture
+def corp_tokens(app, fake_redis, monkeypatch):
+    """get_corp_token 的替身：按顺序签发 token-1、token-2 ..."""
+    issued = []
+
+    def fetch_corp_access_token(corp_id, permanent_code):
+        issued.append(f'token-{len(issued) + 1}')
+        return TokenResult(issued[-1], 7200)
+
+    monkeypatch.setattr(wecom, 'fetch_corp_access_token', fetch_corp_access_token)
+    return issued
+
+
+def admin_list_accepting(valid_token, calls):
+    def get_admin_list(access_token):
+        calls.append(access_token)
+        if access_token != valid_token:
+            raise WeComAPIError(40014, 'invalid access_token', api='agent/get_admin_list')
+        return [{'userid': 'boss', 'auth_type': 1}]
+    return get_admin_list
+
+
+def test_rejected_token_is_evicted_and_call_retried(corp_tokens, monkeypatch):
+    assert wecom.get_corp_access_token('wwa', 'perm') == 'token-1'
+    calls = []
+    monkeypatch.setattr(wecom_client, 'get_admin_list', admin_list_accepting('token-2', calls))
+
+    assert wecom.get_admin_list('wwa', 'perm') == [{'userid': 'boss', 'auth_type': 1}]
+    assert calls == ['token-1', 'token-2']
+    # 被拒绝的token及其旧值备份都已清除，后续调用直接使用新token
+    assert get_cache('corp_access_token:wwa') == 'token-2'
+    assert get_cache('corp_access_token:wwa:stale', local=False) == 'token-2'
+    wecom.get_admin_list('wwa', 'perm')
+    assert calls[-1] == 'token-2' and corp_tokens == ['token-1', 'token-2']
+
+
+def test_retry_happens_once(corp_tokens, monkeypatch):
+    calls = []
+    monkeypatch.setattr(wecom_client, 'get_admin_list', admin_list_accepting('never', calls))
+    assert wecom.get_admin_list('wwa', 'perm') is None
+    assert calls == ['token-1', 'token-2']
+
+
+def test_other_errors_keep_cached_token(corp_tokens, monkeypatch):
+    def get_admin_list(access_token):
+        raise WeComAPIError(60011, 'no privilege', api='agent/get_admin_list')
+
+    monkeypatch.setattr(wecom_client, 'get_admin_list', get_admin_list)
+    assert wecom.get_admin_list('wwa', 'perm') is None
+    assert get_cache('corp_access_token:wwa') == 'token-1' and corp_tokens == ['token-1']
+
+
+def test_eviction_keeps_token_refreshed_by_another_worker(corp_tokens):
+    wecom.get_corp_access_token('wwa', 'perm')
+    set_cache('corp_access_token:wwa', 'token-from-other-worker', ttl=600)
+    wecom.evict_corp_access_token('wwa', 'token-1')
+    assert get_cache('corp_access_token:wwa') == 'token-from-other-worker'
@@ -0,0 +1,123 @@
+import pytest
+
+from app.cache import get_cache
+from app.departments import (
+    build_links, get_org_tree, invalidate_org_tree, load_departments, member_ids_in_department,
+    org_tree_cache_key, replace_member_departments, subtree_department_ids,
+)
+from app.models import Department, Member, Tenant
+from app.routes import wecom
+from app.wecom_events import WeComEvent
+
+# 总部 -> 研发 -> 前端；总部 -> 销售
+DEPARTMENTS = [(1, '总部', 0, 100), (2, '研发', 1, 50), (3, '销售', 1, 80), (4, '前端', 2, 10)]
+
+
+@pytest.fixture
+def tenant(db, fake_redis):
+    tenant = Tenant(corp_id='wwdept', name='部门企业')
+    db.session.add(tenant)
+    db.session.flush()
+    db.session.add_all(Department(tenant_id=tenant.id, dept_id=dept_id, name=name, parent_id=parent_id, order=order)
+                       for dept_id, name, parent_id, order in DEPARTMENTS)
+    db.session.commit()
+    return tenant
+
+
+@pytest.fixture
+def members(tenant, db):
+    """alice 属于研发（主）和前端，bob 属于前端，carol 属于销售，dave 在总部但已不在可见范围"""
+    rows = {userid: Member(tenant_id=tenant.id, userid=userid, name=userid, in_visible_range=userid != 'dave')
+            for userid in ('alice', 'bob', 'carol', 'dave')}
+    db.session.add_all(rows.values())
+    db.session.flush()
+    replace_member_departments(tenant.id, {
+        rows['alice'].id: build_links([2, 4], main_dept_id=2),
+        rows['bob'].id: build_links([4]),
+        rows['carol'].id: build_links([3]),
+        rows['dave'].id: build_links([1]),
+    })
+    db.session.commit()
+    return rows
+
+
+def userids_in(tenant, dept_id, recursive=True):
+    query = Member.query.filter(Member.id.in_(member_ids_in_department(tenant.id, dept_id, recursive)))
+    return sorted(m.userid for m in query)
+
+
+def admin_headers(tenant):
+    token = wecom.generate_jwt_token({'tenant_id': tenant.id, 'corp_id': tenant.corp_id, 'is_admin': True})
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_org_tree_nests_and_orders_children(tenant, members):
+    tree = get_org_tree(tenant.id)
+    assert [root['id'] for root in tree] == [1]
+    # 子部门按 order 降序
+    assert [child['id'] for child in tree[0]['children']] == [3, 2]
+    assert [child['id'] for child in tree[0]['children'][1]['children']] == [4]
+
+
+def test_member_counts_are_direct_and_visible_only(tenant, members):
+    counts = {department['id']: department['member_count'] for department in load_departments(tenant.id)}
+    assert counts == {1: 0, 2: 1, 3: 1, 4: 2}
+
+
+def test_subtree_membership(tenant, members):
+    assert subtree_department_ids(tenant.id, 2) == {2, 4}
+    assert subtree_department_ids(tenant.id, 99) == {99}
+    assert userids_in(tenant, 1) == ['alice', 'bob', 'carol', 'dave']
+    assert userids_in(tenant, 2) == ['alice', 'bob']
+    assert userids_in(tenant, 2, recursive=False) == ['alice']
+    assert userids_in(tenant, 4) == ['alice', 'bob']
+
+
+def test_tree_cache_reflects_links_after_invalidation(tenant, members, db):
+    assert load_departments(tenant.id)
+    assert get_cache(org_tree_cache_key(tenant.id)) is not None
+
+    replace_member_departments(tenant.id, {members['bob'].id: build_links([3])})
+    db.session.commit()
+    # 未清除缓存时仍是旧的成员数，成员所属部门变化的写入路径负责清除
+    assert {d['id']: d['member_count'] for d in load_departments(tenant.id)}[3] == 1
+    invalidate_org_tree(tenant.id)
+    assert get_cache(org_tree_cache_key(tenant.id)) is None
+    counts = {d['id']: d['member_count'] for d in load_departments(tenant.id)}
+    assert counts[3] == 2 and counts[4] == 1
+    assert userids_in(tenant, 3) == ['bob', 'carol']
+
+
+def test_member_department_change_event_clears_tree_cache(tenant, members):
+    assert {d['id']: d['member_count'] for d in load_departments(tenant.id)}[4] == 2
+    wecom.handle_contact_user(WeComEvent.parse(
+        '<xml><AuthCorpId>wwdept</AuthCorpId><InfoType>change_contact</InfoType>'
+        '<ChangeType>update_user</ChangeType><UserID>carol</UserID><Department>4</Department></xml>'))
+
+    assert get_cache(org_tree_cache_key(tenant.id)) is None
+    counts = {d['id']: d['member_count'] for d in load_departments(tenant.id)}
+    assert counts[3] == 0 and counts[4] == 3
+    assert userids_in(tenant, 2) == ['alice', 'bob', 'carol']
+
+
+def test_departments_route_returns_tree_and_total(app, tenant, members):
+    resp = app.test_client().get('/api/v1/wecom/departments', headers=admin_headers(tenant))
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['total'] == 4
+    root = data['departments'][0]
+    assert root['name'] == '总部' and [child['name'] for child in root['children']] == ['销售', '研发']
+    assert root['children'][1]['children'][0]['member_count'] == 2
+
+
+def test_members_route_filters_by_department(app, tenant, members):
+    client = app.test_client()
+    resp = client.get('/api/v1/wecom/members?department_id=2', headers=admin_headers(tenant))
+    assert resp.status_code == 200
+    assert sorted(m['userid'] for m in resp.get_json()['members']) == ['alice', 'bob']
+
+    resp = client.get('/api/v1/wecom/members?department_id=2&recursive=0', headers=admin_headers(tenant))
+    assert [m['userid'] for m in resp.get_json()['members']] == ['alice']
+
+    resp = client.get('/api/v1/wecom/members', headers=admin_headers(tenant))
+    assert resp.get_json()['total'] == 4
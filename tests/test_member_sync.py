@@ -0,0 +1,185 @@
+from app.departments import build_links, parse_id_list, user_department_links
+import pytest
+
+from app.cache import get_many
+from app.card_cache import member_card_key
+from app.member_sync import MemberSync, member_fingerprint, resolve_department_name, root_department_ids, sync_targets
+from app.models import Member, Tenant
+from app.routes.card import load_card_data
+from app.wecom_events import WeComEvent
+
+DEPARTMENTS = [
+    {'id': 1, 'name': '总部', 'parentid': 0},
+    {'id': 2, 'name': '研发', 'parentid': 1},
+    {'id': 3, 'name': '销售', 'parentid': 1},
+]
+
+USERS = {
+    1: [{'userid': 'boss', 'department': [1], 'main_department': 1}],
+    2: [{'userid': 'dev', 'department': [2, 3], 'main_department': 3}],
+    3: [{'userid': 'dev', 'department': [2, 3], 'main_department': 3},
+        {'userid': 'sales', 'department': [3]}],
+}
+
+
+def test_crawl_targets_visible_roots_with_fetch_child():
+    assert sync_targets(DEPARTMENTS, mode='crawl') == ([1], 1)
+    assert sync_targets(DEPARTMENTS, mode='department') == ([1, 2, 3], 0)
+
+
+def test_department_name_prefers_main_department():
+    names = {department['id']: department['name'] for department in DEPARTMENTS}
+    assert resolve_department_name(USERS[2][0], names, 2) == '销售'
+    assert resolve_department_name(USERS[3][1], names, 3) == '销售'
+    assert resolve_department_name({'userid': 'x', 'main_department': 99}, names, 2) == '研发'
+
+
+def test_root_departments_of_partial_visible_range():
+    assert root_department_ids([{'id': 5, 'parentid': 1}, {'id': 6, 'parentid': 5}, {'id': 9, 'parentid': 2}]) == [5, 9]
+
+
+def test_fingerprint_ignores_unsynced_fields():
+    user = {'userid': 'dev', 'name': '张三', 'mobile': '138', 'status': 1, 'department': [2, 3]}
+    fingerprint = member_fingerprint(user, '研发')
+    assert member_fingerprint(dict(user, alias='x', english_name='y'), '研发') == fingerprint
+    assert member_fingerprint(user, '销售') != fingerprint
+    assert member_fingerprint(dict(user, department=[3]), '研发') != fingerprint
+    assert member_fingerprint(dict(user, status=5), '研发') != fingerprint
+
+
+def test_department_links():
+    assert user_department_links(USERS[2][0]) == [(2, False, False), (3, True, False)]
+    assert user_department_links({'userid': 'x', 'department': [4, 5], 'is_leader_in_dept': [0, 1]}) == \
+        [(4, True, False), (5, False, True)]
+    assert user_department_links({'userid': 'x'}) is None
+    assert build_links(parse_id_list('7, 8,,x'), 8, parse_id_list('1,0')) == [(7, False, True), (8, True, False)]
+
+
+def test_convert_userids_in_chunks_of_1000(monkeypatch):
+    from app import id_mapping
+    from app.wecom_client import wecom_client
+
+    batches = []
+
+    def convert(access_token, userid_list, corp_id=None):
+        batches.append(len(userid_list))
+        return {'open_userid_list': [{'userid': userid, 'open_userid': f'wo{userid}'} for userid in userid_list[1:]],
+                'invalid_userid_list': userid_list[:1]}
+
+    monkeypatch.setattr(wecom_client, 'userid_to_openuserid', convert)
+    mapping = id_mapping.convert_userids('token', [f'u{i}' for i in range(2500)])
+    assert batches == [1000, 1000, 500]
+    assert len(mapping) == 2497 and mapping['u1'] == 'wou1' and 'u0' not in mapping
+
+
+
+@pytest.fixture
+def tenant(db, fake_redis):
+    tenant = Tenant(corp_id='wwtest', name='测试企业')
+    db.session.add(tenant)
+    db.session.commit()
+    return tenant
+
+
+def sync_users(tenant_id, users, dept_name='研发', deactivate=True):
+    sync = MemberSync(tenant_id)
+    for user_info in users:
+        sync.add(user_info, dept_name)
+    return sync.finish(deactivate=deactivate)
+
+
+def member_id(tenant_id, userid):
+    return Member.query.filter_by(tenant_id=tenant_id, userid=userid).one().id
+
+
+def test_bulk_sync_invalidates_card_snapshots(tenant):
+    sync_users(tenant.id, [{'userid': 'dev', 'name': '张三', 'position': '工程师'},
+                           {'userid': 'ops', 'name': '李四', 'position': '运维'},
+                           {'userid': 'qa', 'name': '王五', 'position': '测试'}])
+    dev, ops, qa = (member_id(tenant.id, userid) for userid in ('dev', 'ops', 'qa'))
+    for mid in (dev, ops, qa):
+        load_card_data(tenant.id, mid)
+
+    # 资料变化的成员和被停用的成员清除快照，未变化的成员保留
+    stats = sync_users(tenant.id, [{'userid': 'dev', 'name': '张三', 'position': '架构师'},
+                                   {'userid': 'qa', 'name': '王五', 'position': '测试'}])
+    assert (stats['updated'], stats['unchanged'], stats['deactivated']) == (1, 1, 1)
+    assert get_many([member_card_key(tenant.id, mid) for mid in (dev, ops, qa)]).keys() == \
+        {member_card_key(tenant.id, qa)}
+    assert load_card_data(tenant.id, dev)[0]['position'] == '架构师'
+
+
+def test_department_rename_invalidates_card_snapshots(tenant):
+    from app.routes.wecom import handle_contact_party
+
+    sync_users(tenant.id, [{'userid': 'dev', 'name': '张三'}])
+    dev = member_id(tenant.id, 'dev')
+    party = ('<xml><AuthCorpId>wwtest</AuthCorpId><InfoType>change_contact</InfoType>'
+             '<ChangeType>{}</ChangeType><Id>2</Id><Name>{}</Name></xml>')
+    handle_contact_party(WeComEvent.parse(party.format('create_party', '研发')))
+    assert load_card_data(tenant.id, dev)[0]['department'] == '研发'
+
+    handle_contact_party(WeComEvent.parse(party.format('update_party', '平台研发')))
+    assert load_card_data(tenant.id, dev)[0]['department'] == '平台研发'
+    assert load_card_data(tenant.id, dev)[1] == {'name': '测试企业'}
+
+
+def test_unchanged_members_are_skipped_by_fingerprint(tenant):
+    users = [{'userid': 'dev', 'name': '张三', 'mobile': '138', 'department': [2]}]
+    assert sync_users(tenant.id, users)['created'] == 1
+    stats = sync_users(tenant.id, users)
+    assert (stats['synced'], stats['unchanged'], stats['updated'], stats['created']) == (1, 1, 0, 0)
+    stats = sync_users(tenant.id, users, dept_name='销售')
+    assert stats['updated'] == 1
+
+
+def test_oauth_member_renamed_by_open_userid(tenant, db):
+    db.session.add(Member(tenant_id=tenant.id, userid='wo_zs', open_userid='wo_zs', name='张三'))
+    db.session.commit()
+    oauth_id = member_id(tenant.id, 'wo_zs')
+
+    stats = sync_users(tenant.id, [{'userid': 'zhangsan', 'name': '张三', 'open_userid': 'wo_zs'}])
+    assert (stats['renamed'], stats['created'], stats['deactivated']) == (1, 0, 0)
+    assert member_id(tenant.id, 'zhangsan') == oauth_id
+    assert Member.query.filter_by(tenant_id=tenant.id).count() == 1
+
+
+def test_member_renamed_by_name_and_mobile_without_open_userid(tenant, db):
+    db.session.add(Member(tenant_id=tenant.id, userid='old', name='李四', mobile='139'))
+    db.session.commit()
+    old_id = member_id(tenant.id, 'old')
+
+    stats = sync_users(tenant.id, [{'userid': 'lisi', 'name': '李四', 'mobile': '139'}])
+    assert stats['renamed'] == 1
+    assert member_id(tenant.id, 'lisi') == old_id
+
+
+def test_open_userid_disables_name_fallback(tenant, db):
+    db.session.add(Member(tenant_id=tenant.id, userid='other', name='李四', mobile='139', open_userid='wo_other'))
+    db.session.commit()
+
+    # 同名同手机号但 open_userid 不同：是另一个成员，不能合并
+    stats = sync_users(tenant.id, [{'userid': 'lisi', 'name': '李四', 'mobile': '139', 'open_userid': 'wo_ls'}])
+    assert (stats['renamed'], stats['created'], stats['deactivated']) == (0, 1, 1)
+    assert {member.userid for member in Member.query.filter_by(tenant_id=tenant.id)} == {'other', 'lisi'}
+
+
+def test_member_departments_written_per_chunk(tenant, db):
+    from app.models import MemberDepartment
+
+    sync = MemberSync(tenant.id, chunk_size=2)
+    sync.add({'userid': 'a', 'department': [1, 2], 'main_department': 2, 'is_leader_in_dept': [1, 0]}, '研发')
+    sync.add({'userid': 'b', 'department': [2]}, '研发')
+    sync.add({'userid': 'c'}, '研发')
+    sync.finish()
+
+    links = {(link.member_id, link.dept_id, link.is_main, link.is_leader)
+             for link in MemberDepartment.query.filter_by(tenant_id=tenant.id)}
+    a, b = member_id(tenant.id, 'a'), member_id(tenant.id, 'b')
+    assert links == {(a, 1, False, True), (a, 2, True, False), (b, 2, True, False)}
+
+    # 再次同步时替换原有关联
+    sync = MemberSync(tenant.id)
+    sync.add({'userid': 'a', 'department': [3]}, '研发')
+    sync.finish(deactivate=False)
+    assert {(link.dept_id, link.is_main) for link in MemberDepartment.query.filter_by(member_id=a)} == {(3, True)}
@@ -0,0 +1,72 @@
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app.id_mapping import store_mappings
+from app.member_sync import MemberSync
+from app.models import Member, Tenant
+from app.routes import wecom
+
+
+@pytest.fixture
+def tenant(db, fake_redis, monkeypatch):
+    tenant = Tenant(corp_id='wwtest', name='测试企业', permanent_code='perm', config='{}')
+    db.session.add(tenant)
+    db.session.commit()
+    monkeypatch.setattr(wecom, 'check_user_admin_permission', lambda corp_id, permanent_code, userid: False)
+    return tenant
+
+
+def oauth_login(app, monkeypatch, tenant, user_info, code='c1'):
+    monkeypatch.setattr(wecom, 'exchange_oauth_code', lambda auth_code, tenant: dict(user_info))
+    resp = app.test_client().get('/api/v1/wecom/oauth/callback',
+                                 query_string={'code': code, 'state': 'oauth_member_info', 'corp_id': tenant.corp_id})
+    assert resp.status_code == 302
+    return parse_qs(urlparse(resp.headers['Location']).query)['token'][0]
+
+
+def test_oauth_after_sync_mints_token_for_synced_member(app, tenant, monkeypatch):
+    # 全量同步已写入真实userid和映射
+    sync = MemberSync(tenant.id)
+    sync.add({'userid': 'zhangsan', 'name': '张三', 'open_userid': 'wo_zs'}, '研发')
+    sync.finish()
+    store_mappings(tenant.id, {'zhangsan': 'wo_zs'})
+
+    # 第三方应用OAuth返回的userid实际是open_userid
+    token = oauth_login(app, monkeypatch, tenant, {
+        'userid': 'wo_zs', 'open_userid': 'wo_zs', 'name': '张三', 'mobile': '13800000000', 'avatar': 'https://a/1.png',
+    })
+    assert wecom.verify_jwt_token(token)['userid'] == 'zhangsan'
+    members = Member.query.filter_by(tenant_id=tenant.id).all()
+    assert [(member.userid, member.oauth_authorized) for member in members] == [('zhangsan', True)]
+
+    resp = app.test_client().get('/api/v1/wecom/card/my', headers={'Authorization': f'Bearer {token}'})
+    data = resp.get_json()
+    assert data['success'] and not data.get('need_oauth')
+    assert data['card_data']['basic_info']['name'] == '张三'
+
+
+def test_card_lookup_resolves_open_userid_in_old_tokens(app, tenant, monkeypatch):
+    sync = MemberSync(tenant.id)
+    sync.add({'userid': 'lisi', 'name': '李四', 'mobile': '139', 'avatar': 'https://a/2.png'}, '研发')
+    sync.finish()
+    store_mappings(tenant.id, {'lisi': 'wo_ls'})
+    Member.query.filter_by(userid='lisi').update({'oauth_authorized': True})
+    wecom.db.session.commit()
+
+    token = wecom.generate_jwt_token({'tenant_id': tenant.id, 'corp_id': tenant.corp_id, 'userid': 'wo_ls'})
+    resp = app.test_client().get('/api/v1/wecom/card/my', headers={'Authorization': f'Bearer {token}'})
+    assert resp.get_json()['card_data']['basic_info']['name'] == '李四'
+
+
+def test_oauth_keeps_user_info_out_of_redis_and_saves_each_new_ticket(app, tenant, fake_redis, monkeypatch):
+    user_info = {'userid': 'wo_ww', 'open_userid': 'wo_ww', 'name': '王五', 'mobile': '13700000000',
+                 'email': 'ww@example.com', 'user_ticket': 'ticket-1'}
+    oauth_login(app, monkeypatch, tenant, user_info, code='c1')
+    # 10秒内用新code再次授权：新的 user_ticket 也要保存
+    oauth_login(app, monkeypatch, tenant, dict(user_info, user_ticket='ticket-2'), code='c2')
+
+    member = Member.query.filter_by(tenant_id=tenant.id, open_userid='wo_ww').one()
+    assert member.user_ticket == 'ticket-2'
+    stored = ' '.join(str(fake_redis.get(key)) for key in fake_redis.keys() if fake_redis.type(key) == 'string')
+    assert 'ticket-' not in stored and '13700000000' not in stored and 'ww@example.com' not in stored
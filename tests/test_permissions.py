@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from app.cache import CACHE_PREFIX
+from app.models import Tenant
+from app.routes import wecom
+
+
+@pytest.fixture
+def admin_lists(fake_redis, monkeypatch):
+    """企微管理员列表接口的替身：{corp_id: [admin...] 或 None（调用失败）}，记录调用次数"""
+    lists, calls = {}, []
+
+    def get_admin_list(corp_id, permanent_code):
+        calls.append(corp_id)
+        return lists.get(corp_id)
+
+    monkeypatch.setattr(wecom, 'get_admin_list', get_admin_list)
+    return lists, calls
+
+
+def test_admin_list_cached_as_set(admin_lists, fake_redis):
+    lists, calls = admin_lists
+    lists['wwa'] = [{'userid': 'boss', 'auth_type': 1}, {'userid': 'viewer', 'auth_type': 0}]
+    assert wecom.is_in_admin_list('wwa', 'perm', 'boss') is True
+    assert wecom.is_in_admin_list('wwa', 'perm', 'viewer') is False
+    assert wecom.is_in_admin_list('wwa', 'perm', 'nobody') is False
+    assert calls == ['wwa']
+    assert fake_redis.smembers(f'{CACHE_PREFIX}:admin_list:wwa') == {wecom.ADMIN_LIST_PLACEHOLDER, 'boss'}
+
+
+def test_empty_admin_list_is_cached_with_placeholder(admin_lists):
+    lists, calls = admin_lists
+    lists['wwa'] = []
+    assert wecom.is_in_admin_list('wwa', 'perm', 'boss') is False
+    assert wecom.is_in_admin_list('wwa', 'perm', 'boss') is False
+    assert calls == ['wwa']
+
+
+def test_failed_admin_list_is_not_cached(admin_lists, fake_redis):
+    _, calls = admin_lists
+    assert wecom.is_in_admin_list('wwa', 'perm', 'boss') is None
+    assert wecom.is_in_admin_list('wwa', 'perm', 'boss') is None
+    assert calls == ['wwa', 'wwa']
+    assert not fake_redis.exists(f'{CACHE_PREFIX}:admin_list:wwa')
+
+
+def test_invalidation_bumps_version_and_drops_admin_list(admin_lists, fake_redis):
+    lists, calls = admin_lists
+    lists['wwa'] = [{'userid': 'boss', 'auth_type': 1}]
+    wecom.is_in_admin_list('wwa', 'perm', 'boss')
+    key = wecom.permission_cache_key(1, 'boss')
+    assert key == 'perm:1:0:boss'
+
+    wecom.invalidate_permission_cache(1, 'wwa')
+    assert wecom.permission_cache_key(1, 'boss') == 'perm:1:1:boss'
+    assert wecom.permission_cache_key(2, 'boss') == 'perm:2:0:boss'
+    wecom.is_in_admin_list('wwa', 'perm', 'boss')
+    assert calls == ['wwa', 'wwa']
+
+
+def test_cached_decision_dropped_after_invalidation(db, admin_lists, monkeypatch):
+    from app.wecom_client import wecom_client
+
+    lists, _ = admin_lists
+    lists['wwa'] = []
+    # 不在管理员列表时降级查询 user/get 的 isleader
+    monkeypatch.setattr(wecom, 'get_corp_access_token', lambda corp_id, permanent_code=None: 'token')
+    monkeypatch.setattr(wecom_client, 'get_user', lambda access_token, userid: {'userid': userid, 'isleader': 0})
+    tenant = Tenant(corp_id='wwa', name='企业', permanent_code='perm', installer_userid='installer',
+                    auth_info=json.dumps({'agent': [{'privilege': {'allow_user': ['zhangsan']}}]}))
+    db.session.add(tenant)
+    db.session.commit()
+
+    assert wecom.check_user_permission(tenant.id, 'installer')['role'] == 'installer'
+    assert wecom.check_user_permission(tenant.id, 'zhangsan')['role'] == 'user'
+    assert wecom.check_user_permission(tenant.id, 'lisi')['has_access'] is False
+
+    # 可见范围变化：决策缓存仍命中，直到授权变更回调清除
+    tenant.auth_info = json.dumps({'agent': [{'privilege': {'allow_user': ['lisi']}}]})
+    db.session.commit()
+    assert wecom.check_user_permission(tenant.id, 'lisi')['has_access'] is False
+    wecom.invalidate_permission_cache(tenant.id, 'wwa')
+    assert wecom.check_user_permission(tenant.id, 'lisi')['role'] == 'user'
+    assert wecom.check_user_permission(tenant.id, 'zhangsan')['has_access'] is False
+
+
+def test_undecidable_permission_is_not_cached(db, fake_redis, monkeypatch):
+    monkeypatch.setattr(wecom, 'get_admin_list', lambda corp_id, permanent_code: None)
+    monkeypatch.setattr(wecom, 'get_corp_access_token', lambda corp_id, permanent_code=None: None)
+    tenant = Tenant(corp_id='wwa', name='企业', permanent_code='perm', auth_info='{}')
+    db.session.add(tenant)
+    db.session.commit()
+
+    assert wecom.check_user_permission(tenant.id, 'zhangsan')['has_access'] is False
+    assert not fake_redis.keys(f'{CACHE_PREFIX}:perm:*')
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from app import rate_limit
+from app.rate_limit import RateLimiter
+
+
+@pytest.fixture
+def limiter(fake_redis):
+    return RateLimiter(fake_redis, rate=20, burst=3, max_wait=1, request_max_wait=0,
+                       backoff_base=0.2, backoff_max=1)
+
+
+def test_token_bucket_allows_burst_then_fails_fast_in_requests(limiter):
+    assert [limiter.acquire('wwcorp', 'user/get') for _ in range(3)] == [True, True, True]
+    started = time.monotonic()
+    assert limiter.acquire('wwcorp', 'user/get') is False
+    assert time.monotonic() - started < 0.05
+    # 其它接口、其它企业各自一个桶
+    assert limiter.acquire('wwcorp', 'user/list') is True
+    assert limiter.acquire('wwother', 'user/get') is True
+
+
+def test_worker_waits_for_refill(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit, '_worker_process', True)
+    for _ in range(3):
+        limiter.acquire('wwcorp', 'user/get')
+    started = time.monotonic()
+    assert limiter.acquire('wwcorp', 'user/get') is True
+    # 每秒20个令牌：约50ms补充一个
+    assert 0.02 < time.monotonic() - started < 0.5
+
+
+def test_penalty_backs_off_exponentially_and_reset_clears_strikes(limiter, fake_redis, monkeypatch):
+    monkeypatch.setattr(rate_limit, '_worker_process', True)
+    assert limiter.penalize('wwcorp', 'user/get') == pytest.approx(0.2)
+    assert limiter.penalize('wwcorp', 'user/get') == pytest.approx(0.4)
+    assert 0 < fake_redis.pttl('wecom:ratelimit:wwcorp:user/get:penalty') <= 400
+
+    # 惩罚期内令牌桶不放行：Worker 等到惩罚期结束，Web 请求立即放弃
+    monkeypatch.setattr(rate_limit, '_worker_process', False)
+    assert limiter.acquire('wwcorp', 'user/get') is False
+    monkeypatch.setattr(rate_limit, '_worker_process', True)
+    started = time.monotonic()
+    assert limiter.acquire('wwcorp', 'user/get') is True
+    assert time.monotonic() - started > 0.2
+
+    limiter.reset('wwcorp', 'user/get')
+    assert limiter.penalize('wwcorp', 'user/get') == pytest.approx(0.2)
+
+
+def test_penalty_longer_than_max_wait_gives_up(fake_redis, monkeypatch):
+    monkeypatch.setattr(rate_limit, '_worker_process', True)
+    limiter = RateLimiter(fake_redis, max_wait=0.1, backoff_base=5, backoff_max=5)
+    limiter.penalize('wwcorp', 'user/get')
+    started = time.monotonic()
+    assert limiter.acquire('wwcorp', 'user/get') is False
+    assert time.monotonic() - started < 0.5
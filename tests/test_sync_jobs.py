@@ -0,0 +1,219 @@
+import functools
+import threading
+import time
+
+import pytest
+import requests
+
+from app import member_sync, sync_jobs
+from app.member_sync import MemberSync
+from app.models import Member, Tenant
+from app.routes import wecom
+from app.wecom_client import WeComAPIError, wecom_client
+
+DEPARTMENTS = [
+    {'id': 1, 'name': '总部', 'parentid': 0},
+    {'id': 2, 'name': '研发', 'parentid': 1},
+    {'id': 3, 'name': '销售', 'parentid': 1},
+    {'id': 4, 'name': '运营', 'parentid': 1},
+]
+
+
+class WorkerKilled(BaseException):
+    """模拟Worker进程在拉取中被杀（不被任务的 except Exception 捕获）"""
+
+
+@pytest.fixture
+def tenant(db, fake_redis, monkeypatch):
+    tenant = Tenant(corp_id='wwsync', name='同步企业', permanent_code='perm',
+                    config='{"member_sync": {"concurrency": 1}}')
+    db.session.add(tenant)
+    db.session.commit()
+    monkeypatch.setattr(wecom, 'get_corp_access_token', lambda corp_id, permanent_code: 'token')
+    monkeypatch.setattr(wecom_client, 'department_list', lambda access_token, corp_id=None: DEPARTMENTS)
+    monkeypatch.setattr(wecom_client, 'userid_to_openuserid', lambda access_token, userid_list, corp_id=None: {
+        'open_userid_list': [{'userid': userid, 'open_userid': f'wo_{userid}'} for userid in userid_list]})
+    return tenant
+
+
+def users_of(dept_id, count=2):
+    return [{'userid': f'u{dept_id}_{i}', 'name': f'成员{dept_id}_{i}', 'department': [dept_id]} for i in range(count)]
+
+
+def test_worker_takes_over_lock_from_queued_job(tenant):
+    job, created = sync_jobs.create_job(tenant.id, mode='department')
+    assert created
+    job_id = job['job_id']
+    assert sync_jobs.lock_owner_job(tenant.id) == job_id
+
+    # 同一任务被重复投递：第一个Worker接管后，第二个不能再接管
+    assert sync_jobs.acquire_sync_lock(tenant.id, f'{job_id}:run1', takeover=job_id)
+    assert not sync_jobs.acquire_sync_lock(tenant.id, f'{job_id}:run2', takeover=job_id)
+    assert sync_jobs.acquire_sync_lock(tenant.id, f'{job_id}:run1')
+
+    # 新发起的同步返回正在执行的任务
+    running, created = sync_jobs.create_job(tenant.id)
+    assert not created and running['job_id'] == job_id
+
+    sync_jobs.release_sync_lock(tenant.id, f'{job_id}:run2')
+    assert sync_jobs.lock_owner_job(tenant.id) == job_id
+    sync_jobs.release_sync_lock(tenant.id, f'{job_id}:run1')
+    assert sync_jobs.lock_owner_job(tenant.id) is None
+
+
+def test_second_create_returns_queued_job(tenant):
+    job, created = sync_jobs.create_job(tenant.id, mode='department')
+    assert created and job['status'] == 'queued'
+
+    # 锁的值仍是排队任务的 job_id：不能走续期分支再创建一次
+    again, created = sync_jobs.create_job(tenant.id, mode='department')
+    assert not created and again['job_id'] == job['job_id']
+    assert 'resumed' not in again
+
+
+def test_second_post_while_queued_returns_409(app, tenant, monkeypatch):
+    sent = []
+    app.config['WECOM_EVENT_ASYNC'] = True
+    monkeypatch.setattr(sync_jobs, 'send_task', lambda name, args, queue: sent.append(args[0]))
+    token = wecom.generate_jwt_token({'tenant_id': tenant.id, 'corp_id': tenant.corp_id, 'is_admin': True})
+    client = app.test_client()
+
+    first = client.post('/api/v1/wecom/sync-members', headers={'Authorization': f'Bearer {token}'})
+    second = client.post('/api/v1/wecom/sync-members', headers={'Authorization': f'Bearer {token}'})
+    assert first.status_code == 202
+    assert second.status_code == 409 and second.get_json()['code'] == 'SYNC_IN_PROGRESS'
+    assert second.get_json()['job']['job_id'] == first.get_json()['job_id']
+    assert sent == [first.get_json()['job_id']]
+
+
+def test_killed_job_resumes_from_checkpoint(tenant, monkeypatch):
+    calls, killed = [], []
+
+    def user_list(access_token, dept_id, fetch_child=0, corp_id=None):
+        calls.append(dept_id)
+        if dept_id == 3 and not killed:
+            killed.append(dept_id)
+            raise WorkerKilled()
+        return users_of(dept_id)
+
+    monkeypatch.setattr(wecom_client, 'user_list', user_list)
+    job, _ = sync_jobs.create_job(tenant.id, mode='department')
+    with pytest.raises(WorkerKilled):
+        sync_jobs.run_sync_job(job['job_id'])
+    assert sync_jobs.get_job(job['job_id'])['status'] == 'running'
+    assert Member.query.filter_by(tenant_id=tenant.id).count() == 4
+
+    # 重新发起时沿用同一任务，只拉取未完成的部门
+    resumed, created = sync_jobs.create_job(tenant.id, mode='department')
+    assert created and resumed['job_id'] == job['job_id'] and resumed['resumed'] == 1
+    calls.clear()
+    done = sync_jobs.run_sync_job(job['job_id'])
+    assert calls == [3, 4]
+    assert done['status'] == 'done' and done['count'] == 8 and done['deactivated'] == 0
+    assert Member.query.filter_by(tenant_id=tenant.id, in_visible_range=True).count() == 8
+
+
+def test_concurrent_fetch_with_single_writer(tenant, monkeypatch):
+    tenant.config = '{"member_sync": {"concurrency": 4}}'
+    sync_jobs.db.session.commit()
+    fetch_threads, write_threads = set(), set()
+
+    def user_list(access_token, dept_id, fetch_child=0, corp_id=None):
+        fetch_threads.add(threading.current_thread().name)
+        time.sleep(0.05)
+        return users_of(dept_id)
+
+    flush = MemberSync.flush
+
+    def recording_flush(self):
+        write_threads.add(threading.current_thread().name)
+        return flush(self)
+
+    monkeypatch.setattr(wecom_client, 'user_list', user_list)
+    monkeypatch.setattr(MemberSync, 'flush', recording_flush)
+    job, _ = sync_jobs.create_job(tenant.id, mode='department')
+    done = sync_jobs.run_sync_job(job['job_id'])
+
+    assert done['status'] == 'done' and done['count'] == 8 and done['concurrency'] == 4
+    assert len(fetch_threads) > 1 and all(name.startswith('member-sync') for name in fetch_threads)
+    assert write_threads == {threading.current_thread().name}
+
+
+def test_lock_renewed_per_chunk_and_lost_lock_stops_writes(tenant, monkeypatch):
+    monkeypatch.setattr(wecom_client, 'user_list', lambda access_token, dept_id, fetch_child=0, corp_id=None:
+                        users_of(dept_id, count=5) if dept_id == 2 else [])
+    monkeypatch.setattr(sync_jobs, 'MemberSync', functools.partial(MemberSync, chunk_size=2))
+    upsert = member_sync.upsert_statement
+    job, _ = sync_jobs.create_job(tenant.id, mode='department')
+
+    def stealing_upsert(rows):
+        # 第一块写入时锁过期并被其他任务取得
+        sync_jobs.redis_client.set(sync_jobs.lock_key(tenant.id), 'other-job:run')
+        return upsert(rows)
+
+    monkeypatch.setattr(member_sync, 'upsert_statement', stealing_upsert)
+    failed = sync_jobs.run_sync_job(job['job_id'])
+    assert failed['status'] == 'failed' and 'taken by another job' in failed['error']
+    assert Member.query.filter_by(tenant_id=tenant.id).count() == 2
+    assert sync_jobs.lock_owner_job(tenant.id) == 'other-job'
+
+
+def test_failed_department_is_not_checkpointed(tenant, monkeypatch):
+    def user_list(access_token, dept_id, fetch_child=0, corp_id=None):
+        if dept_id == 4:
+            raise WeComAPIError(60011, 'no privilege', api='user/list')
+        return users_of(dept_id)
+
+    monkeypatch.setattr(wecom_client, 'user_list', user_list)
+    job, _ = sync_jobs.create_job(tenant.id, mode='department')
+    done = sync_jobs.run_sync_job(job['job_id'])
+    assert done['status'] == 'done' and done['failed_departments'] == '[4]'
+    assert done['departments_done'] == 3
+
+
+def test_timed_out_department_is_retried_on_resume(tenant, monkeypatch):
+    calls, attempts = [], {}
+
+    def user_list(access_token, dept_id, fetch_child=0, corp_id=None):
+        calls.append(dept_id)
+        attempts[dept_id] = attempts.get(dept_id, 0) + 1
+        if dept_id == 3 and attempts[dept_id] == 1:
+            raise requests.Timeout('read timed out')
+        if dept_id == 4 and attempts[dept_id] == 1:
+            raise WorkerKilled()
+        return users_of(dept_id)
+
+    monkeypatch.setattr(wecom_client, 'user_list', user_list)
+    job, _ = sync_jobs.create_job(tenant.id, mode='department')
+    with pytest.raises(WorkerKilled):
+        sync_jobs.run_sync_job(job['job_id'])
+    # 超时的部门没有记检查点
+    done = sync_jobs.redis_client.smembers(f'{sync_jobs.job_key(job["job_id"])}:done')
+    assert done == {'1', '2'}
+
+    sync_jobs.release_sync_lock(tenant.id, sync_jobs.redis_client.get(sync_jobs.lock_key(tenant.id)))
+    resumed, created = sync_jobs.create_job(tenant.id, mode='department')
+    assert created and resumed['job_id'] == job['job_id']
+    calls.clear()
+    finished = sync_jobs.run_sync_job(job['job_id'])
+    assert calls == [3, 4]
+    assert finished['status'] == 'done' and finished['failed_departments'] == '[]' and finished['count'] == 8
+
+
+def test_crawl_mode_fetches_root_once_without_concurrency(tenant, monkeypatch):
+    tenant.config = '{"member_sync": {"concurrency": 4}}'
+    sync_jobs.db.session.commit()
+    calls = []
+
+    def user_list(access_token, dept_id, fetch_child=0, corp_id=None):
+        calls.append((dept_id, fetch_child))
+        return [user for child in (2, 3, 4) for user in users_of(child)]
+
+    monkeypatch.setattr(wecom_client, 'user_list', user_list)
+    job, _ = sync_jobs.create_job(tenant.id, mode='crawl')
+    done = sync_jobs.run_sync_job(job['job_id'])
+
+    # 整个根部门一个请求、一个检查点
+    assert calls == [(1, 1)]
+    assert done['status'] == 'done' and done['count'] == 6
+    assert done['departments_total'] == 1 and done['concurrency'] == 1
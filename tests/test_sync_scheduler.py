@@ -0,0 +1,46 @@
+from app.sync_scheduler import current_slot, parse_plan_limits
+
+
+def test_parse_plan_limits_skips_malformed_entries():
+    assert parse_plan_limits('free:1, pro:4,bad,enterprise:x,') == {'free': 1, 'pro': 4}
+    assert parse_plan_limits('') == {}
+
+
+def test_slots_are_stable_within_a_period_and_spread_across_tenants():
+    interval, now = 86400, 1_760_000_000
+    slot = current_slot(42, interval, now)
+    assert now - interval < slot <= now
+    assert current_slot(42, interval, now + 60) in (slot, slot + interval)
+    offsets = {current_slot(tenant_id, interval, now) % interval for tenant_id in range(100)}
+    assert len(offsets) > 90
+
+
+def test_plan_member_syncs_picks_due_tenants_within_caps(db, fake_redis):
+    import time
+    from datetime import datetime
+
+    from app.models import MemberSyncRun
+    from app.sync_jobs import RUNNING_KEY, lock_key
+    from app.sync_scheduler import note_contact_activity, plan_member_syncs
+
+    interval, now = 86400, time.time()
+
+    def synced_at(tenant_id, timestamp):
+        db.session.add(MemberSyncRun(tenant_id=tenant_id, job_id=f'job{tenant_id}', status='done',
+                                     started_at=datetime.fromtimestamp(timestamp)))
+
+    synced_at(1, current_slot(1, interval, now) + 1)          # 本周期已同步：未到期
+    synced_at(5, current_slot(5, interval, now) - interval)   # 上个周期同步过：排在从未同步的之后
+    db.session.commit()
+    fake_redis.zadd(RUNNING_KEY, {3: now, 8: now})
+    fake_redis.set(lock_key(3), 'job3:run')                    # 8 的锁已不存在：Worker崩溃残留
+    note_contact_activity(4)
+
+    tenants = [(1, 'free'), (2, 'free'), (3, 'pro'), (4, 'pro'), (5, 'pro'), (6, 'pro'), (7, 'pro'), (9, 'free')]
+    # 安静且最久未同步的优先，最近有通讯录回调的排最后；free 套餐最多同时1个
+    assert plan_member_syncs(tenants, interval, 10, {'free': 1}, 3600, now=now) == [2, 6, 7, 5, 4]
+    assert fake_redis.zrange(RUNNING_KEY, 0, -1) == ['3']
+
+    # 全局上限扣除执行中的租户；pro 套餐执行中的也计入套餐上限
+    assert plan_member_syncs(tenants, interval, 3, {'free': 1, 'pro': 2}, 3600, now=now) == [2, 6]
+    assert plan_member_syncs(tenants, interval, 10, {'pro': 1}, 3600, now=now) == [2, 9]
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from app import tasks
+from app.cache import set_cache
+from app.main import db as _db
+from app.models import Tenant
+from app.routes import wecom
+
+
+def issue(key, age, expires_in=7200):
+    """写入 get_or_refresh 的签发记录：age 秒前签发、有效期 expires_in"""
+    set_cache(f'{key}:issued', f'{int(time.time() - age)}:{expires_in}', ttl=expires_in, local=False)
+
+
+@pytest.fixture
+def scheduled(app, db, fake_redis, monkeypatch):
+    """
+    记录 refresh_corp_token 的投递参数；suite_access_token 视为新签发
+    任务用 .run() 调用，在测试应用上下文中执行（ContextTask 会进入 Celery 自己的应用）
+    """
+    app.config['WECOM_TOKEN_REFRESH_RATIO'] = 0.8
+    app.config['WECOM_TOKEN_REFRESH_JITTER'] = 120
+    issue('suite_access_token', 60)
+    calls = []
+    monkeypatch.setattr(tasks.refresh_corp_token, 'apply_async',
+                        lambda args, countdown: calls.append((args[0], countdown)))
+    return calls
+
+
+def add_tenant(corp_id, plan='trial', permanent_code='perm'):
+    tenant = Tenant(corp_id=corp_id, name=corp_id, permanent_code=permanent_code, plan=plan)
+    _db.session.add(tenant)
+    _db.session.commit()
+    return tenant.id
+
+
+def test_refresh_tokens_schedules_corps_past_ratio(scheduled, monkeypatch):
+    fresh = add_tenant('wwfresh')
+    issue('corp_access_token:wwfresh', 3600)          # 0.5
+    old = add_tenant('wwold')
+    issue('corp_access_token:wwold', 6000)            # 0.83
+    missing = add_tenant('wwmissing')                 # 没有缓存记录
+    ticket = add_tenant('wwticket')
+    issue('corp_access_token:wwticket', 600)
+    issue('jsapi_ticket:wwticket', 7000)              # 只有ticket快过期
+    add_tenant('wwcancelled', plan='cancelled')
+    add_tenant('wwpending', permanent_code='')
+    jitters = iter([5.0, 60.0, 119.0])
+    monkeypatch.setattr(tasks.random, 'uniform', lambda low, high: next(jitters))
+
+    assert tasks.refresh_tokens.run() == {'scheduled': 3}
+    assert scheduled == [(old, 5.0), (missing, 60.0), (ticket, 119.0)]
+    assert fresh not in [tenant_id for tenant_id, _ in scheduled]
+
+
+def test_refresh_tokens_spreads_countdown_within_jitter(scheduled):
+    tenant_ids = [add_tenant(f'wwcorp{i}') for i in range(20)]
+
+    assert tasks.refresh_tokens.run() == {'scheduled': 20}
+    assert [tenant_id for tenant_id, _ in scheduled] == tenant_ids
+    countdowns = [countdown for _, countdown in scheduled]
+    assert all(0 <= countdown <= 120 for countdown in countdowns)
+    assert len(set(countdowns)) > 1
+
+
+def test_refresh_tokens_skips_corps_when_suite_token_fails(scheduled, monkeypatch):
+    add_tenant('wwold')
+    issue('suite_access_token', 7000)
+    monkeypatch.setattr(wecom, 'get_suite_access_token', lambda force_refresh=False: None)
+
+    assert tasks.refresh_tokens.run() == {'scheduled': 0}
+    assert scheduled == []
+
+
+def test_refresh_corp_token_rechecks_age_before_refreshing(scheduled, monkeypatch):
+    tenant_id = add_tenant('wwa')
+    refreshed = []
+    monkeypatch.setattr(wecom, 'get_corp_access_token',
+                        lambda corp_id, permanent_code, force_refresh=False: refreshed.append(corp_id) or 'token')
+    monkeypatch.setattr(wecom, 'get_jsapi_ticket',
+                        lambda corp_id, permanent_code, ticket_type, force_refresh=False:
+                        refreshed.append(ticket_type) or 'ticket')
+
+    # 延迟期间已被其它Worker续期
+    issue('corp_access_token:wwa', 60)
+    assert tasks.refresh_corp_token.run(tenant_id) is True
+    assert refreshed == []
+
+    issue('corp_access_token:wwa', 6000)
+    issue('agent_ticket:wwa', 6000)
+    assert tasks.refresh_corp_token.run(tenant_id) is True
+    assert refreshed == ['wwa', 'agent']
@@ -0,0 +1,106 @@
+import pytest
+
+from app.wecom_client import WeComClient, WeComAPIError
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        if self._data is None:
+            raise ValueError('no json')
+        return self._data
+
+
+class FakeSession:
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return FakeResponse(self.data)
+
+
+def make_client(data):
+    client = WeComClient(base_url='http://qyapi.test/cgi-bin/')
+    client._session = FakeSession(data)
+    client._pid = __import__('os').getpid()
+    return client
+
+
+def test_corp_token_returns_typed_result():
+    client = make_client({'access_token': 'tok', 'expires_in': 7200})
+    result = client.get_corp_token('suite_tok', 'wx123', 'perm')
+    assert result.token == 'tok'
+    assert result.expires_in == 7200
+    method, url, kwargs = client._session.calls[0]
+    assert method == 'POST'
+    assert url == 'http://qyapi.test/cgi-bin/service/get_corp_token'
+    assert kwargs['json'] == {'auth_corpid': 'wx123', 'permanent_code': 'perm'}
+
+
+def test_errcode_raises_api_error():
+    client = make_client({'errcode': 40014, 'errmsg': 'invalid access_token'})
+    with pytest.raises(WeComAPIError) as exc_info:
+        client.user_list('tok', 1)
+    assert exc_info.value.errcode == 40014
+    assert exc_info.value.api == 'user/list'
+
+
+def test_invalid_json_raises_api_error():
+    client = make_client(None)
+    with pytest.raises(WeComAPIError) as exc_info:
+        client.get_user('tok', 'zhangsan')
+    assert exc_info.value.errcode == -1
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.acquired = []
+        self.penalized = []
+        self.resets = []
+
+    def acquire(self, scope, api):
+        self.acquired.append((scope, api))
+        return True
+
+    def penalize(self, scope, api):
+        self.penalized.append((scope, api))
+        return 0
+
+    def reset(self, scope, api):
+        self.resets.append((scope, api))
+
+
+class SequenceSession(FakeSession):
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return FakeResponse(self.data[min(len(self.calls), len(self.data)) - 1])
+
+
+def test_rate_limit_errcode_backs_off_and_retries():
+    limiter = FakeLimiter()
+    client = WeComClient(base_url='http://qyapi.test/cgi-bin/', limiter=limiter, rate_limit_retries=3)
+    client._session = SequenceSession([
+        {'errcode': 45009, 'errmsg': 'api freq out of limit'},
+        {'errcode': 0, 'userlist': [{'userid': 'zhangsan'}]},
+    ])
+    client._pid = __import__('os').getpid()
+    assert client.user_list('tok', 1, corp_id='wx123') == [{'userid': 'zhangsan'}]
+    assert limiter.acquired == [('wx123', 'user/list')] * 2
+    assert limiter.penalized == [('wx123', 'user/list')]
+    assert limiter.resets == [('wx123', 'user/list')]
+
+
+def test_rate_limit_retries_exhausted_raises():
+    limiter = FakeLimiter()
+    client = WeComClient(base_url='http://qyapi.test/cgi-bin/', limiter=limiter, rate_limit_retries=2)
+    client._session = SequenceSession([{'errcode': 45033, 'errmsg': 'api concurrent out of limit'}])
+    client._pid = __import__('os').getpid()
+    with pytest.raises(WeComAPIError) as exc_info:
+        client.get_user('tok', 'zhangsan')
+    assert exc_info.value.errcode == 45033
+    assert len(client._session.calls) == 3
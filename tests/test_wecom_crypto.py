@@ -0,0 +1,54 @@
+import base64
+import os
+
+import pytest
+
+from app.wecom_crypto import (
+    ILLEGAL_AES_KEY, VALIDATE_RECEIVE_ID_ERROR, VALIDATE_SIGNATURE_ERROR,
+    WeComCryptoError, WXBizMsgCrypt
+)
+
+AES_KEY = base64.b64encode(os.urandom(32)).decode().rstrip('=')
+
+
+def make_crypto():
+    return WXBizMsgCrypt('callback-token', AES_KEY, 'ww_suite_id')
+
+
+def test_encrypt_decrypt_roundtrip():
+    crypto = make_crypto()
+    plaintext = '<xml><InfoType>suite_ticket</InfoType><SuiteTicket>票据</SuiteTicket></xml>'
+    encrypt = crypto.encrypt(plaintext)
+    assert crypto.decrypt(encrypt, receive_ids={'ww_suite_id'}) == (plaintext, 'ww_suite_id')
+
+
+def test_decrypt_callback_checks_signature():
+    crypto = make_crypto()
+    encrypt = crypto.encrypt('<xml/>')
+    signature = crypto.signature('1700000000', 'nonce', encrypt)
+    assert crypto.decrypt_callback(signature, '1700000000', 'nonce', encrypt)[0] == '<xml/>'
+    with pytest.raises(WeComCryptoError) as exc_info:
+        crypto.decrypt_callback('0' * 40, '1700000000', 'nonce', encrypt)
+    assert exc_info.value.code == VALIDATE_SIGNATURE_ERROR
+
+
+def test_decrypt_rejects_unexpected_receive_id():
+    crypto = make_crypto()
+    encrypt = crypto.encrypt('<xml/>', receive_id='ww_other')
+    with pytest.raises(WeComCryptoError) as exc_info:
+        crypto.decrypt(encrypt, receive_ids={'ww_suite_id'})
+    assert exc_info.value.code == VALIDATE_RECEIVE_ID_ERROR
+
+
+def test_encrypt_reply_is_verifiable():
+    crypto = make_crypto()
+    reply = crypto.encrypt_reply('success', nonce='abc', timestamp=1700000000)
+    encrypt = reply.split('<Encrypt><![CDATA[')[1].split(']]>')[0]
+    signature = reply.split('<MsgSignature><![CDATA[')[1].split(']]>')[0]
+    assert crypto.verify_signature(signature, '1700000000', 'abc', encrypt)
+
+
+def test_illegal_aes_key():
+    with pytest.raises(WeComCryptoError) as exc_info:
+        WXBizMsgCrypt('token', 'short', '')
+    assert exc_info.value.code == ILLEGAL_AES_KEY
@@ -0,0 +1,195 @@
+import pytest
+
+from app.wecom_events import EventRegistry, WeComEvent
+
+
+def make_event(xml):
+    event = WeComEvent.parse(xml)
+    assert event is not None
+    return event
+
+
+def test_change_type_handler_takes_precedence():
+    registry = EventRegistry()
+    calls = []
+
+    @registry.register('change_contact')
+    def generic(event):
+        calls.append('generic')
+
+    @registry.register('change_contact/create_user')
+    def create_user(event):
+        calls.append('create_user')
+
+    registry.dispatch(make_event('<xml><InfoType>change_contact</InfoType><ChangeType>create_user</ChangeType></xml>'))
+    registry.dispatch(make_event('<xml><InfoType>change_contact</InfoType><ChangeType>update_party</ChangeType></xml>'))
+    assert calls == ['create_user', 'generic']
+
+
+def test_inline_flag_and_handler_errors_surface():
+    registry = EventRegistry()
+
+    @registry.register('suite_ticket', inline=True)
+    def suite_ticket(event):
+        return event.text('SuiteTicket')
+
+    @registry.register('cancel_auth')
+    def cancel_auth(event):
+        raise RuntimeError('boom')
+
+    ticket = make_event('<xml><InfoType>suite_ticket</InfoType><SuiteTicket>T</SuiteTicket></xml>')
+    cancel = make_event('<xml><InfoType>cancel_auth</InfoType></xml>')
+    assert registry.is_inline(ticket)
+    assert not registry.is_inline(cancel)
+    assert registry.dispatch(ticket) == 'T'
+    with pytest.raises(RuntimeError):
+        registry.dispatch(cancel)
+
+
+def test_duplicate_registration_rejected():
+    registry = EventRegistry()
+    registry.register('create_auth')(lambda event: None)
+    with pytest.raises(ValueError):
+        registry.register('create_auth')(lambda event: None)
+
+
+def test_parse_invalid_xml_returns_none():
+    assert WeComEvent.parse('not xml') is None
+
+
+def test_failed_event_task_is_retried(fake_redis, monkeypatch):
+    import app.routes.wecom as wecom
+    from app import tasks
+
+    calls = []
+
+    def flaky(xml_plaintext, received_at=None):
+        calls.append(xml_plaintext)
+        if len(calls) < 3:
+            raise RuntimeError('db down')
+
+    monkeypatch.setattr(wecom, 'process_event', flaky)
+    monkeypatch.setattr(tasks, 'incr_stat', lambda *args, **kwargs: None)
+    fake_redis.set('dedup', 'processing')
+    tasks.process_wecom_event.apply(args=['<xml/>', 'callback'], kwargs={'dedup_key': 'dedup'})
+    assert len(calls) == 3
+    assert fake_redis.get('dedup') == 'done'
+
+    calls.clear()
+    monkeypatch.setattr(wecom, 'process_event', lambda *args, **kwargs: calls.append(1) or 1 / 0)
+    fake_redis.set('dedup', 'processing')
+    result = tasks.process_wecom_event.apply(args=['<xml/>', 'callback'], kwargs={'dedup_key': 'dedup'})
+    assert len(calls) == 4
+    assert result.failed()
+    # 重试用尽：释放去重标记，企微重推时可以重新处理
+    assert fake_redis.get('dedup') is None
+
+
+def test_failed_event_releases_dedup_claim(app, fake_redis, monkeypatch):
+    import app.routes.wecom as wecom
+
+    calls = []
+
+    def handler(xml_plaintext, received_at=None):
+        calls.append(xml_plaintext)
+        if len(calls) == 1:
+            raise RuntimeError('handler failed')
+
+    recorded = []
+    monkeypatch.setattr(wecom, 'process_event', handler)
+    monkeypatch.setattr(wecom, 'record_event', lambda *args: recorded.append(args))
+    app.config['WECOM_EVENT_ASYNC'] = False
+    xml = '<xml><InfoType>create_auth</InfoType></xml>'
+    key = wecom.event_dedup_key('ENCRYPTED')
+
+    with pytest.raises(RuntimeError):
+        wecom.dispatch_event(xml, 'callback', 'ENCRYPTED')
+    assert fake_redis.get(key) is None
+
+    # 企微重推：重新处理，成功后标记完成
+    wecom.dispatch_event(xml, 'callback', 'ENCRYPTED')
+    assert fake_redis.get(key) == 'done'
+    assert fake_redis.ttl(key) > wecom.EVENT_CLAIM_TTL
+
+    wecom.dispatch_event(xml, 'callback', 'ENCRYPTED')
+    assert len(calls) == 2
+    # 重复包不录制
+    assert len(recorded) == 2
+
+
+def test_claim_expires_while_processing(app, fake_redis):
+    import app.routes.wecom as wecom
+
+    key = wecom.event_dedup_key('ENCRYPTED')
+    assert wecom.claim_event(key)
+    assert not wecom.claim_event(key)
+    assert fake_redis.get(key) == 'processing'
+    assert 0 < fake_redis.ttl(key) <= wecom.EVENT_CLAIM_TTL
+
+
+def test_async_dispatch_sends_task_without_building_worker_app(app, fake_redis, monkeypatch):
+    import app.routes.wecom as wecom
+    from app.celery_client import get_celery_client
+
+    client = get_celery_client()
+    assert client is get_celery_client()
+    assert client.conf.broker_url == app.config['CELERY_BROKER_URL']
+
+    sent = []
+    monkeypatch.setattr(client, 'send_task', lambda name, **options: sent.append((name, options)))
+    monkeypatch.setattr(wecom, 'record_event', lambda *args: None)
+    app.config['WECOM_EVENT_ASYNC'] = True
+    wecom.dispatch_event('<xml><InfoType>create_auth</InfoType></xml>', 'callback', 'ENCRYPTED')
+    name, options = sent[0]
+    assert name == 'wecom.process_event'
+    assert options['queue'] == app.config['WECOM_EVENT_QUEUE']
+    assert options['kwargs'] == {'dedup_key': wecom.event_dedup_key('ENCRYPTED')}
+
+
+def test_change_auth_without_auth_code_refreshes_and_invalidates(db, fake_redis, monkeypatch):
+    import json
+
+    from app.cache import CACHE_PREFIX, get_cache, set_cache
+    from app.card_cache import tenant_card_key
+    from app.models import Tenant
+    from app.routes import wecom
+    from app.wecom_client import wecom_client
+
+    tenant = Tenant(corp_id='wwauth', name='旧名称', permanent_code='perm', auth_info='{}')
+    db.session.add(tenant)
+    db.session.commit()
+    set_cache('corp_access_token:wwauth', 'old-token', ttl=600)
+    set_cache(tenant_card_key(tenant.id), {'name': '旧名称'}, ttl=600)
+    fake_redis.sadd(f'{CACHE_PREFIX}:admin_list:wwauth', wecom.ADMIN_LIST_PLACEHOLDER, 'admin1')
+    perm_key = wecom.permission_cache_key(tenant.id, 'zhangsan')
+    set_cache(perm_key, {'has_access': False}, ttl=600)
+
+    monkeypatch.setattr(wecom, 'get_suite_access_token', lambda force_refresh=False: 'suite-token')
+    monkeypatch.setattr(wecom_client, 'get_auth_info', lambda token, corp_id, permanent_code: {
+        'auth_corp_info': {'corpid': corp_id, 'corp_name': '新名称'},
+        'auth_info': {'agent': [{'agentid': 1, 'privilege': {'allow_user': ['zhangsan', 'lisi']}}]},
+    })
+    wecom.process_event('<xml><InfoType>change_auth</InfoType><AuthCorpId>wwauth</AuthCorpId></xml>')
+
+    db.session.refresh(tenant)
+    assert tenant.name == '新名称' and tenant.user_limit == 2
+    assert json.loads(tenant.auth_info)['agent'][0]['privilege']['allow_user'] == ['zhangsan', 'lisi']
+    assert get_cache('corp_access_token:wwauth') is None
+    assert get_cache(tenant_card_key(tenant.id)) is None
+    assert not fake_redis.exists(f'{CACHE_PREFIX}:admin_list:wwauth')
+    assert wecom.permission_cache_key(tenant.id, 'zhangsan') != perm_key
+
+
+def test_change_auth_refresh_failure_still_invalidates_and_raises(db, fake_redis, monkeypatch):
+    from app.cache import get_cache, set_cache
+    from app.models import Tenant
+    from app.routes import wecom
+
+    tenant = Tenant(corp_id='wwauth', name='企业', permanent_code='perm')
+    db.session.add(tenant)
+    db.session.commit()
+    set_cache('corp_access_token:wwauth', 'old-token', ttl=600)
+    monkeypatch.setattr(wecom, 'get_auth_info', lambda corp_id, permanent_code: None)
+    with pytest.raises(RuntimeError):
+        wecom.process_event('<xml><InfoType>change_auth</InfoType><AuthCorpId>wwauth</AuthCorpId></xml>')
+    assert get_cache('corp_access_token:wwauth') is None
@@ -0,0 +1,80 @@
+import json
+import time
+
+import pytest
+
+from app import welcome_push
+from app.welcome_push import acquire_slot, claim_next_job, enqueue_welcome_push, latency_bucket, release_slot
+
+
+def test_latency_bucket_boundaries():
+    assert latency_bucket(0) == 'le_100'
+    assert latency_bucket(100) == 'le_100'
+    assert latency_bucket(101) == 'le_250'
+    assert latency_bucket(19999) == 'le_20000'
+    assert latency_bucket(25000) == 'le_inf'
+
+
+@pytest.fixture
+def stats(fake_redis, monkeypatch):
+    counted = []
+    monkeypatch.setattr(welcome_push, 'incr_stat', lambda group, field, amount=1: counted.append(field))
+    return counted
+
+
+def queue_job(fake_redis, corp_id, received_at, job_id):
+    job = {'id': job_id, 'corp_id': corp_id, 'tenant_id': 1, 'welcome_code': f'code-{job_id}',
+           'card_preview_url': 'u', 'card_title': 't', 'received_at': received_at}
+    fake_redis.zadd(welcome_push.QUEUE_KEY, {json.dumps(job): received_at})
+    return job
+
+
+def test_enqueue_delivers_inline_when_async_disabled(app, stats, monkeypatch):
+    import app.routes.wecom as wecom
+
+    sent = []
+    monkeypatch.setattr(wecom, 'send_welcome_message', lambda **kwargs: sent.append(kwargs['welcome_code']) or True)
+    app.config['WECOM_EVENT_ASYNC'] = False
+    assert enqueue_welcome_push('corp', 1, 'W1', 'url', 'title')
+    assert sent == ['W1']
+    assert stats == ['enqueued', 'sent', 'le_100']
+    assert welcome_push.redis_client.zcard(welcome_push.QUEUE_KEY) == 0
+
+
+def test_claim_oldest_first_and_drop_expired(fake_redis, stats):
+    now = time.time()
+    queue_job(fake_redis, 'corp', now - welcome_push.WELCOME_CODE_TTL - 1, 'expired')
+    queue_job(fake_redis, 'corp', now - 2, 'older')
+    queue_job(fake_redis, 'corp', now - 1, 'newer')
+    assert claim_next_job()['id'] == 'older'
+    assert claim_next_job()['id'] == 'newer'
+    assert claim_next_job() is None
+    assert stats == ['expired']
+
+
+def test_corp_concurrency_and_deferral_counted_once(fake_redis, stats, monkeypatch):
+    monkeypatch.setattr(welcome_push, 'WELCOME_CORP_CONCURRENCY', 1)
+    now = time.time()
+    queue_job(fake_redis, 'busy', now - 3, 'a')
+    queue_job(fake_redis, 'busy', now - 2, 'b')
+    queue_job(fake_redis, 'other', now - 1, 'c')
+    first = claim_next_job()
+    assert first['id'] == 'a'
+    # busy 企业名额已满：跳过 b，先推 other 的任务
+    assert claim_next_job()['id'] == 'c'
+    assert claim_next_job() is None
+    assert stats.count('deferred') == 1
+
+    release_slot('busy', 'a')
+    assert claim_next_job()['id'] == 'b'
+
+
+def test_leaked_slots_are_recovered(fake_redis, monkeypatch):
+    monkeypatch.setattr(welcome_push, 'WELCOME_CORP_CONCURRENCY', 2)
+    now = time.time()
+    assert acquire_slot('corp', 'crashed-1', now)
+    assert acquire_slot('corp', 'crashed-2', now)
+    assert not acquire_slot('corp', 'next', now + 1)
+    # 持续有新任务时名额集合一直存在，但过期的名额在计数前被清除
+    assert acquire_slot('corp', 'next', now + welcome_push.SLOT_TTL + 1)
+    assert fake_redis.zrange(welcome_push.slot_key('corp'), 0, -1) == ['next']